@@ -4,14 +4,42 @@
 #Desc:  Build and execute a zybot command from user-provided variables and Polarion STTL block.
 
 from __future__ import annotations
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
+from datetime import datetime
 import re
+import json
+import math
+import heapq
+import statistics
+import collections
+import contextlib
+import functools
+import cProfile
+import time
+import sqlite3
+import tempfile
+import bisect
 import argparse
 import logging
 import subprocess
 import os
-from typing import List, Tuple, Optional, Sequence
+import sys
+import queue
+import signal
+import threading
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Tuple, Optional, Sequence
+from xml.parsers import expat
+from xml.sax.saxutils import quoteattr
 import shlex
+import shutil
+import itertools
+import socket
+import getpass
+import csv
+import hashlib
+import gzip
+import concurrent.futures
+import secrets
 
 # Import colorama for cross-platform coloring (assumes colorama installed)
 try:
@@ -25,6 +53,11 @@ except ImportError:  # graceful fallback if unexpectedly missing
     def colorama_init(*args, **kwargs):  # type: ignore
         pass
 
+try:  # optional: only needed for YAML job manifests
+    import yaml
+except ImportError:
+    yaml = None  # type: ignore
+
 # ---------------- Constants / Patterns ----------------
 
 STTL_BLOCK_PATTERN = re.compile(r'^id:\((.*)\)$', re.IGNORECASE)
@@ -33,7 +66,80 @@ DUT_KEY_PATTERN = re.compile(r'^DUT(\d+)$', re.IGNORECASE)
 VAR_PAIR_PATTERN = re.compile(r'^[A-Za-z0-9_]+:[^\s]+$')
 ALLOWED_NON_DUT_KEYS = {"TESTDIR"}
 MIN_SERIAL_LEN = 10  # minimum length for DUT serial validation (now alphanumeric)
-EXECUTION_DIR = r"C:\RFS_CI\GIT_REPO\ST_Master\mcd_validation_RFS\RFS"  # Required working directory for zybot execution
+EXECUTION_DIR = os.environ.get("ZYBUTLER_EXECUTION_DIR") or r"C:\RFS_CI\GIT_REPO\ST_Master\mcd_validation_RFS\RFS"  # Default working directory for zybot execution
+ZYBOT_EXECUTABLE = os.environ.get("ZYBUTLER_ZYBOT", "zybot")  # zybot launcher; may include an interpreter, e.g. "python my_zybot.py"
+DEFAULT_OUTPUT_DIR = "Results"  # base --outputdir used for per-shard results in parallel mode
+MAX_FAILED_RC = 250  # zybot (Robot Framework) caps the failed-test count exit code here
+# ZyButler's own error codes stay above MAX_FAILED_RC (next to Robot's 251-253 and 255) so they are never summed as failed tests
+EXECUTION_ERROR_RC = 255  # zybot could not be run (missing execution directory, spawn failure); Robot uses it for internal errors
+DUT_UNAVAILABLE_RC = 254  # the run could not start on its DUTs (leased, failed pre-flight or staging); unused by Robot
+GUI_OUTPUT_MAX_LINES = 5000  # zybot output lines kept in GUI output panes
+GUI_POLL_MS = 100  # GUI output queue polling interval
+ADB_EXECUTABLE = os.environ.get("ZYBUTLER_ADB", "adb")  # adb binary used for device discovery
+ADB_START_TIMEOUT = 10.0  # seconds allowed for `adb start-server` before giving up on this attempt
+ADB_RETRY_MAX_DELAY = 30.0  # cap for the reconnect backoff when adb is missing or wedged
+ADB_STATE_TIMEOUT = 10.0  # seconds allowed for `adb get-state` when checking a DUT after a hang
+WATCHDOG_POLL = 1.0  # seconds between hang checks of a running zybot process
+MAX_REQUEUES = 1  # times the unfinished STTL IDs of a hung zybot run are re-queued
+RETRY_BACKOFF = 10.0  # default seconds before the first retry of failed tests (--retry-backoff)
+RETRY_BACKOFF_FACTOR = 2.0  # each further retry waits this much longer
+PROGRESS_REFRESH = 1.0  # seconds between progress bar redraws on a terminal
+PROGRESS_LOG_INTERVAL = 60.0  # seconds between progress log lines when stdout is not a terminal
+FAILURE_MESSAGE_MAX = 4096  # characters of a failure message kept for --retry-on-message matching
+INDEX_FILENAME = ".zybutler_sttl_index.json"  # STTL index stored at the root of the indexed test path
+WINDOWS_CMD_LIMIT = 8191  # cmd.exe maximum command-line length (zybot installed as a .bat/.cmd launcher)
+WINDOWS_CREATEPROCESS_LIMIT = 32767  # CreateProcess maximum command-line length (zybot.exe)
+POSIX_CMD_LIMIT = 131072  # conservative share of ARG_MAX (argv and environment share it)
+CHUNK_MODES = ("auto", "argfile", "batch")  # how oversized commands are split (see chunk_command)
+SCHEDULES = ("lpt", "round-robin", "steal")  # how --parallel assigns STTL IDs to DUTs (see shard_command)
+DEFAULT_TEST_DURATION = 120.0  # seconds assumed for tests without recorded history
+ZYBUTLER_HOME = os.environ.get("ZYBUTLER_HOME") or os.path.join(os.path.expanduser("~"), ".zybutler")  # local state (history, caches)
+HISTORY_DB = os.path.join(ZYBUTLER_HOME, "history.db")
+HISTORY_QUERY_BATCH = 500  # STTL IDs per history or result cache query (older SQLite allows only 999 parameters)
+RESULT_CACHE_DB = os.path.join(ZYBUTLER_HOME, "result_cache.db")  # passes keyed on test, build and file hash (--skip-cached)
+STAGE_CACHE_DB = os.path.join(ZYBUTLER_HOME, "stage_cache.db")  # artifacts staged per DUT and local artifact hashes (--stage)
+STAGE_TIMEOUT = 600.0  # seconds allowed for one `adb install` / `adb push` while staging
+STAGE_HASH_BATCH = 4000  # characters of device paths hashed per `adb shell sha256sum` call
+STAGE_FAILED_RC = DUT_UNAVAILABLE_RC  # exit code when artifacts could not be staged on a DUT
+CACHE_MAX_AGE_DAYS = 30.0  # cached passes older than this are ignored and evicted
+CACHE_MAX_ENTRIES = 200000  # newest cached passes kept; older ones are evicted
+LEASE_DIR = os.environ.get("ZYBUTLER_LEASE_DIR") or os.path.join(os.environ.get("ProgramData") or tempfile.gettempdir(), "zybutler", "leases")  # shared by all users of the host
+LEASE_TTL = 60.0  # seconds a DUT lease stays valid without a heartbeat
+LEASE_POLL = 2.0  # seconds between attempts while waiting for leased DUTs
+LEASE_BUSY_RC = DUT_UNAVAILABLE_RC  # exit code when a DUT stays leased by another run
+PREFLIGHT_FAILED_RC = DUT_UNAVAILABLE_RC  # exit code when DUTs fail the pre-flight check and the run cannot start
+PREFLIGHT_MODES = ("off", "report", "exclude")  # what to do with DUTs failing the pre-flight check (--preflight)
+PREFLIGHT_MODE = os.environ.get("ZYBUTLER_PREFLIGHT") or "report"  # default of RunOptions.preflight
+PREFLIGHT_TIMEOUT = 1.5  # seconds each DUT gets to answer the pre-flight probe
+PREFLIGHT_TTL = 30.0  # seconds a pre-flight result is reused for later runs in the same process
+PREFLIGHT_MIN_BATTERY = 15  # percent; below this a DUT fails pre-flight unless it is charging
+PREFLIGHT_MIN_FREE_MB = 200  # free MB on /data below which a DUT fails pre-flight
+LOGCAT_DIR = os.environ.get("ZYBUTLER_LOGCAT")  # default of RunOptions.logcat_dir: capture adb logcat per DUT; "" = inside the results directory
+LOGCAT_READ_CHUNK = 1 << 16  # bytes copied from an adb logcat pipe per read
+LOGCAT_ROTATE_BYTES = 64 << 20  # uncompressed logcat bytes per .gz file before rotating to the next
+LOGCAT_KEEP_FILES = 16  # newest logcat files kept per DUT and run; older ones are deleted
+LOGCAT_COMPRESSLEVEL = 1  # gzip level: fastest, still ~8x smaller for logcat text
+DAEMON_PORT = 8765  # localhost port of the ZyButler daemon (--daemon)
+DAEMON_STATE = os.path.join(ZYBUTLER_HOME, "daemon.json")  # port, pid and access token of the running daemon
+DAEMON_OUTPUT_LINES = 5000  # newest output lines kept per daemon job
+DAEMON_MAX_JOBS = 500  # finished daemon jobs kept for status queries
+MANIFEST_WORKERS = 4  # default number of manifest jobs running at once (--jobs)
+PROFILE_PATH = os.environ.get("ZYBUTLER_PROFILE")  # trace file written at exit (also for the GUI); see --profile
+OUTPUT_XML_PATTERN = re.compile(r'^output.*\.xml$', re.IGNORECASE)  # zybot result files searched in results dirs
+XML_READ_CHUNK = 1 << 20  # bytes fed to the result file parser per read
+MERGED_XML = "merged.xml"  # consolidated results of a job's zybot runs (not matched by OUTPUT_XML_PATTERN)
+MERGED_SUMMARY = "summary.json"  # per-test / per-DUT summary written next to MERGED_XML
+MERGE_WRITE_INTERVAL = 30.0  # seconds between rewrites of the merged report while a run is in progress
+RESULT_LINE_PATTERN = re.compile(r'^(STTL-\d+)\b(.*?)\|\s*(PASS|FAIL|SKIP|NOT RUN)\s*\|\s*$')
+SEPARATOR_LINE_PATTERN = re.compile(r'^[=-]{20,}\s*$')
+SUITE_EXTENSIONS = (".robot", ".txt", ".tsv")  # files scanned for test cases when building the index
+TEST_SECTION_PATTERN = re.compile(r'^\*+\s*(test cases?|tasks?)\s*\**\s*$', re.IGNORECASE)
+INDEXED_TEST_PATTERN = re.compile(r'^STTL-(\d+)', re.IGNORECASE)
+STTL_ID_PATTERN = re.compile(r'STTL-(\d+)')  # IDs extracted from export files (Polarion CSV/XML, text)
+LOOSE_STTL_ID_PATTERN = re.compile(r'(?:STTL/STTL-|STTL-)?(\d{4,})')  # GUI paste box also accepts bare numbers; never streamed
+STTL_ID_MAX_LEN = 32  # longest STTL-<digits> carried over a chunk boundary; longer digit runs are not IDs
+STTL_ID_TAIL_PATTERN = re.compile(r'(?:STTL-\d*|STTL|STT|ST|S)$')  # chunk tail that may be the start of an STTL_ID_PATTERN match
+STTL_READ_CHUNK = 1 << 20  # characters read per chunk when extracting IDs from files
 # Default zybot base command token used if no custom path supplied
 #DEFAULT_ZYBOT_TOKEN = "zybot"
 
@@ -60,6 +166,8 @@ FORMAT_HELP = (
     "    Set FORCE_COLOR=1 to force color (will try enabling Windows ANSI).\n"
     "  Execution Directory Requirement:\n"
     f"    Script executes zybot command from: {EXECUTION_DIR}\n"
+    "    Override with --exec-dir or ZYBUTLER_EXECUTION_DIR.\n"
+    "    Each run writes its results to <outputdir>/<job id> (default outputdir: Results).\n"
     "  Command Construction:\n"
     "    Each STTL id expands to -t \"STTL-<id>*\" automatically. Do NOT add quotes or * yourself.\n"
     "  Additional Flags:\n"
@@ -71,250 +179,3580 @@ FORMAT_HELP = (
     "    --var KEY:VALUE        Repeatable; adds a variable (e.g. --var DUT1:ABC1234567)\n"
     "    --flag FLAG_STRING     Repeatable; adds raw zybot flag tokens (e.g. --flag '-L TRACE')\n"
     "    --sttl-block STRING    Direct STTL block text (id:(STTL/STTL-123 ...))\n"
-    "    --sttl-file PATH       Read STTL block from a file (exclusive with --sttl-block)\n"
+    "    --sttl-file PATH       Repeatable; read STTL IDs from a block, CSV/XML export or text file ('-' = stdin)\n"
+    "    --rerun-failed PATH    Use failed STTL tests from a previous output.xml or results directory\n"
+    "    --manifest FILE        Validate and run every job of a .json/.yaml/.csv manifest (with --execute)\n"
+    "    --jobs N               Manifest jobs running at once (default 4; jobs sharing a DUT queue)\n"
     "    --path PATH            Optional test case path appended to command\n"
+    "    --exec-dir DIR         Working directory for zybot (default: $ZYBUTLER_EXECUTION_DIR)\n"
+    "    --no-job-dir           Write results to the output dir itself, not a per-job subdirectory\n"
+    "    --use-index            Replace PATH with the exact suite files holding the STTL IDs\n"
     "    --execute              Run zybot after displaying command\n"
+    "    --parallel             Split STTL IDs into one shard per DUT and run shards concurrently\n"
+    "    --schedule MODE        --parallel assignment: lpt (default, by recorded durations), round-robin, steal\n"
+    "    --steal-batch N        STTL IDs per zybot run with --schedule steal (default 1)\n"
+    "    --chunk-mode MODE      Oversized commands: auto/argfile (zybot argument file) or batch\n"
+    "    --max-cmd-len N        Override the command-line length limit used for chunking\n"
     "    --pretty               Show formatted summary before/with command\n"
     "    --no-color             Disable ANSI color output\n"
     "    --verbose / -V         Debug-level logging\n"
     "    --show-formats         Print this format help and exit\n"
+    "    --list-devices         List connected adb devices and exit\n"
+    "    --history STTL-ID      Show last status / p95 duration from the run history (repeatable)\n"
+    "    --history-stats        Show p95 duration per test from the run history\n"
+    "    --no-history           Do not record this run in the run history\n"
+    "    --watch-devices        Print adb device add/remove events until Ctrl+C\n"
+    "    --lease-wait SECONDS   Queue for DUTs leased by another run (default 0: fail fast with code 254)\n"
+    "    --no-lease             Do not lease the DUTs for this run\n"
+    "    --timeout SECONDS      Kill a zybot process running longer than SECONDS and re-queue its unfinished tests\n"
+    "    --idle-timeout SECONDS Same, when zybot prints nothing for SECONDS (e.g. a DUT dropped off USB)\n"
+    "    --retries N            Re-run failed STTL tests up to N more times (only the failed IDs, next DUT first)\n"
+    "    --retry-backoff SEC    Wait before the first retry, doubling per retry (default 10)\n"
+    "    --retry-on-exit CODES  Only retry tests of zybot runs ending with these codes (e.g. 252,253,255)\n"
+    "    --retry-on-message RE  Only retry failures whose message matches RE (repeatable)\n"
+    "    --skip-cached          Skip tests that passed on the DUTs' build with unchanged suite files (needs --path)\n"
+    "    --cache-max-age DAYS   Ignore and evict cached passes older than DAYS (default 30)\n"
+    "    --no-progress          Do not show the progress bar / ETA while zybot runs\n"
+    "    --daemon               Serve a localhost JSON API that queues and runs jobs (see zybutler_client.py)\n"
+    "    --daemon-port PORT     Port of the daemon (default 8765)\n"
+    "    --merge-results DIR    Merge every output*.xml under DIR into DIR/merged.xml and DIR/summary.json\n"
+    "    --stage FILE           Install/push the artifacts listed in FILE (JSON/YAML) to every DUT first\n"
+    "    --preflight MODE       off | report | exclude DUTs failing the adb health check (default report)\n"
+    "    --logcat [DIR]         Capture adb logcat of every DUT to DIR (default: <results>/logcat)\n"
+    "    --profile PATH         Write phase / zybot process timings (.jsonl lines, else Chrome trace JSON)\n"
+    "    --cprofile PATH        Write cProfile stats of ZyButler's own overhead\n"
     #"    --zybot-path PATH      (Reserved) Custom zybot executable/script path (currently not executed)\n"
     "  Output Examples:\n"
     "    zybot -v DUT1:ABC1234567 -t \"STTL-238897*\"\n"
     "    zybot --flag '-L TRACE' -v DUT1:ABC1234567 -v DUT2:ZX9QWERTYU -t \"STTL-238897*\" -t \"STTL-127394*\" Tests\\Regression\n"
 )
 
-RESET = Style.RESET_ALL
-BOLD = Style.BRIGHT
-DIM = Style.DIM
-# Foreground colors
-CYAN = Fore.CYAN
-MAGENTA = Fore.MAGENTA
-GREEN = Fore.GREEN
-YELLOW = Fore.YELLOW
-RED = Fore.RED
+RESET = Style.RESET_ALL
+BOLD = Style.BRIGHT
+DIM = Style.DIM
+# Foreground colors
+CYAN = Fore.CYAN
+MAGENTA = Fore.MAGENTA
+GREEN = Fore.GREEN
+YELLOW = Fore.YELLOW
+RED = Fore.RED
+
+_def_use_color = True
+
+def supports_color() -> bool:
+    if os.environ.get('NO_COLOR'):
+        return False
+    # Require TTY unless FORCE_COLOR specified
+    if not sys.stdout.isatty() and not os.environ.get('FORCE_COLOR'):
+        return False
+    return True
+
+def color(txt: str, *codes: str) -> str:
+    if not _def_use_color:
+        return txt
+    return ''.join(codes) + txt + RESET
+
+def hr(char: str = '-', width: int = 60) -> str:
+    return char * width
+
+def print_format_help():
+    print(color(hr(), CYAN))
+    for line in FORMAT_HELP.splitlines():
+        if line.strip():
+            print(color(line, CYAN))
+    print(color(hr(), CYAN))
+
+# ---------------- Tracing ----------------
+
+class Tracer:
+    """Lightweight span recorder for --profile: monotonic start/duration per phase and per zybot process.
+    When disabled, span() costs a single attribute check."""
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.origin = time.perf_counter()
+        self.events: List[dict] = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, start: float, duration: float, cat: str = "zybutler",
+            thread: Optional[threading.Thread] = None, **args) -> None:
+        """Record a finished span; start is a time.perf_counter() value.
+        thread selects the timeline the span is drawn on (default: the calling thread)."""
+        if not self.enabled:
+            return
+        thread = thread or threading.current_thread()
+        event = {"name": name, "cat": cat, "ts": start - self.origin, "dur": duration,
+                 "tid": thread.ident, "thread": thread.name, "args": args}
+        with self._lock:
+            self.events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name: str, cat: str = "zybutler", **args):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter() - start, cat, **args)
+
+    def write(self, path: str) -> None:
+        """Write spans as JSON lines (*.jsonl, seconds) or a Chrome trace-event file (chrome://tracing, Perfetto)."""
+        with self._lock:
+            events = list(self.events)
+        pid = os.getpid()
+        with open(path, 'w', encoding='utf-8') as f:
+            if path.endswith('.jsonl'):
+                for ev in events:
+                    f.write(json.dumps(dict(ev, pid=pid)) + '\n')
+                return
+            threads = {ev["tid"]: ev["thread"] for ev in events}
+            trace = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                     for tid, name in threads.items()]
+            trace.extend({"name": ev["name"], "cat": ev["cat"], "ph": "X", "pid": pid, "tid": ev["tid"],
+                          "ts": round(ev["ts"] * 1e6), "dur": round(ev["dur"] * 1e6), "args": ev["args"]}
+                         for ev in events)
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+TRACER = Tracer(enabled=bool(PROFILE_PATH))
+
+def traced(name: str):
+    """Decorator recording each call of the function as a span."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return fn(*args, **kwargs)
+            with TRACER.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def write_profile(path: Optional[str]) -> None:
+    if not path or not TRACER.enabled:
+        return
+    try:
+        TRACER.write(path)
+        logging.info("Trace (%d spans) written to %s", len(TRACER.events), path)
+    except OSError as e:
+        logging.error("Could not write trace %s: %s", path, e)
+
+# ---------------- Exceptions ----------------
+
+class ParseError(ValueError):
+    pass
+
+class ValidationError(ValueError):
+    pass
+
+class LeaseError(RuntimeError):
+    pass
+
+class PreflightError(RuntimeError):
+    pass
+
+
+# ---------------- Dataclass ----------------
+
+@dataclass
+class ZybotCommand:
+    vars: List[Tuple[str, str]]
+    sttls: List[str]
+    path: Optional[str] = None
+    flags: List[str] = None  # raw additional flags (each element is one argument token)
+    sources: List[str] = None  # exact suite files resolved from the STTL index; replaces path when set
+    argument_file: Optional[str] = None  # zybot --argumentfile holding -v/-t options and sources (long commands)
+
+    def build_args(self) -> List[str]:
+        args: List[str] = ["zybot"]
+        if self.flags:
+            args.extend(self.flags)
+        if self.argument_file:
+            args.extend(["--argumentfile", self.argument_file])
+            return args
+        for k, v in self.vars:
+            args.extend(["-v", f"{k}:{v}"])
+        for sid in self.sttls:
+            args.extend(["-t", f"{sid}*"])  # raw arg; quoting added for display only
+        if self.sources:
+            args.extend(self.sources)
+        elif self.path:
+            args.append(self.path)
+        return args
+
+    def display_command(self) -> str:
+        raw = self.build_args()
+        disp: List[str] = []
+        i = 0
+        while i < len(raw):
+            token = raw[i]
+            disp.append(token)
+            if token == "-t" and i + 1 < len(raw):
+                pattern = raw[i + 1]
+                disp.append(f'"{pattern}"')
+                i += 2
+                continue
+            i += 1
+        return " ".join(disp)
+
+    def pretty(self, exec_dir: Optional[str] = None) -> str:
+        lines: List[str] = []
+        lines.append(color('=== Zybot Command Summary ===', CYAN))
+        lines.append(color(f'Script Execution Directory:', BOLD, GREEN))
+        lines.append(color(exec_dir or EXECUTION_DIR, BOLD))
+        if self.flags:
+            lines.append(color('Flags:', BOLD, GREEN))
+            lines.append(color('  ' + ' '.join(self.flags), BOLD))
+        else:
+            lines.append(color('Flags: (none)', DIM))
+        if self.vars:
+            lines.append(color('Variables:', BOLD, GREEN))
+            for k, v in self.vars:
+                lines.append(f'  {color(k, BOLD)}: {v}')
+        else:
+            lines.append(color('Variables: (none)', DIM))
+        if self.sttls:
+            lines.append(color(f'STTL IDs ({len(self.sttls)}):', BOLD, GREEN))
+            for sid in self.sttls[:25]:
+                lines.append(color(f'  {sid}', BOLD))
+            if len(self.sttls) > 25:
+                lines.append(color(f'  ... ({len(self.sttls) - 25} more)', BOLD))
+        else:
+            lines.append(color('STTL IDs: (none)', DIM))
+        if self.path:
+            lines.append(color(f'Test Script Path: {self.path}', BOLD, GREEN))
+            lines.append(color(self.path, BOLD))
+        else:
+            lines.append(color('Path: (none)', DIM))
+        if self.sources:
+            lines.append(color(f'Indexed Suite Files ({len(self.sources)}):', BOLD, GREEN))
+            for src in self.sources:
+                lines.append(color(f'  {src}', BOLD))
+
+        lines.append(color('Full Command:', BOLD, GREEN))
+        cmd = self.display_command()
+        lines.append(color(f'  {cmd}', BOLD))
+        lines.append(color(hr(), DIM))
+        return '\n'.join(lines)
+
+# ---------------- Parsing Helpers ----------------
+
+def parse_sttl_block(raw: str) -> List[str]:
+    raw = raw.strip()
+    m = STTL_BLOCK_PATTERN.match(raw)
+    if not m:
+        raise ParseError("STTL block must match id:(STTL/STTL-<id> ...)")
+    body = m.group(1).strip()
+    if not body:
+        raise ParseError("STTL block empty")
+    tokens = body.split()
+    seen = set()
+    ordered: List[str] = []
+    for tok in tokens:
+        tm = TOKEN_PATTERN.match(tok)
+        if not tm:
+            raise ParseError(f"Malformed STTL token: {tok}")
+        sid = f"STTL-{tm.group(1)}"
+        if sid in seen:
+            continue
+        seen.add(sid)
+        ordered.append(sid)
+    if not ordered:
+        raise ParseError("No valid STTL tokens parsed")
+    return ordered
+
+# ---------------- STTL Ingestion ----------------
+
+def iter_sttl_ids(stream, seen: Optional[set] = None, chunk_size: int = STTL_READ_CHUNK) -> Iterator[str]:
+    """
+    Yield new STTL IDs (STTL_ID_PATTERN) from a text stream in order of first appearance.
+    The stream is read in chunks; memory grows with the number of unique IDs, not the input size.
+    The chunk carry only fits STTL_ID_PATTERN, so the pattern is fixed.
+    """
+    seen = set() if seen is None else seen
+    carry = ""
+    while True:
+        chunk = stream.read(chunk_size)
+        buf = carry + chunk
+        if chunk:
+            # Hold back an ID cut by the chunk boundary; at most STTL_ID_MAX_LEN characters are carried
+            tail = STTL_ID_TAIL_PATTERN.search(buf, max(0, len(buf) - STTL_ID_MAX_LEN))
+            keep = tail.start() if tail else len(buf)
+            buf, carry = buf[:keep], buf[keep:]
+        for num in STTL_ID_PATTERN.findall(buf):
+            if num not in seen:
+                seen.add(num)
+                yield f"STTL-{num}"
+        if not chunk:
+            return
+
+def read_sttl_ids(paths: Sequence[str]) -> List[str]:
+    """Extract unique STTL IDs from export files (CSV, XML or any text); '-' reads stdin."""
+    seen: set = set()
+    ids: List[str] = []
+    for path in paths:
+        if path == "-":
+            ids.extend(iter_sttl_ids(sys.stdin, seen))
+            continue
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            ids.extend(iter_sttl_ids(f, seen))
+    return ids
+
+def normalize_key(key: str) -> str:
+    return key.upper()
+
+def parse_vars(raw_tokens: Sequence[str], allow_empty: bool = False) -> List[Tuple[str, str]]:
+    if not raw_tokens:
+        if allow_empty:
+            return []
+        raise ValidationError("No variables provided")
+    pairs: List[Tuple[str, str]] = []
+    for kv in raw_tokens:
+        if not VAR_PAIR_PATTERN.match(kv):
+            raise ValidationError(f"Invalid KEY:VALUE format: {kv}")
+        key, value = kv.split(":", 1)
+        key_u = normalize_key(key)
+        if DUT_KEY_PATTERN.match(key_u):
+            # Accept alphanumeric serials; enforce length only
+            if (not value.isalnum()) or len(value) < MIN_SERIAL_LEN:
+                raise ValidationError(
+                    f"Invalid DUT serial for {key}: must be alphanumeric length >= {MIN_SERIAL_LEN}"
+                )
+        elif key_u not in ALLOWED_NON_DUT_KEYS:
+            raise ValidationError(f"Unknown variable key: {key}")
+        pairs.append((key_u, value))
+    return pairs
+
+def parse_flags(flag_specs: Sequence[str]) -> List[str]:
+    """Expand repeated --flag specifications into individual argument tokens.
+    Each spec can contain one or multiple tokens (e.g. "-L TRACE" or "--dryrun").
+    Validation: Disallow -v and -t tokens here (they belong to variables / STTL IDs)."""
+    tokens: List[str] = []
+    for spec in flag_specs:
+        if not spec.strip():
+            continue
+        split = shlex.split(spec)
+        for tok in split:
+            if tok in {"-v", "-t"}:
+                raise ValidationError(f"Disallowed token in --flag specification: {tok}")
+            tokens.append(tok)
+    return tokens
+
+# ---------------- STTL Index ----------------
+
+def scan_suite_file(path: str) -> List[Tuple[str, str]]:
+    """Return (numeric STTL id, test name) for every STTL test case defined in a suite file."""
+    found: List[Tuple[str, str]] = []
+    in_tests = False
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if line.startswith('*'):
+                in_tests = bool(TEST_SECTION_PATTERN.match(line.strip()))
+                continue
+            if not in_tests or not line.strip() or line[0] in ' \t#|':
+                continue
+            name = re.split(r'\t| {2,}', line.rstrip('\r\n'), maxsplit=1)[0].strip()
+            m = INDEXED_TEST_PATTERN.match(name)
+            if m:
+                found.append((m.group(1), name))
+    return found
+
+class SttlIndex:
+    """On-disk map of STTL id -> (suite file, test name) for one test tree.
+    update() only re-scans files whose mtime or size changed since the index was saved."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.index_path = os.path.join(root, INDEX_FILENAME)
+        self.files: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._by_id: Dict[str, List[Tuple[str, str]]] = {}
+        self._keys: List[str] = []
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == 1:
+                self.files = data.get('files', {})
+        except (OSError, ValueError) as e:
+            logging.debug("No usable STTL index at %s: %s", self.index_path, e)
+        self._rebuild_lookup()
+
+    def save(self) -> None:
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'files': self.files}, f)
+        os.replace(tmp, self.index_path)
+
+    def update(self) -> int:
+        """Re-scan new or modified suite files and drop deleted ones. Returns files (re)scanned."""
+        with self._lock:
+            return self._update()
+
+    def _update(self) -> int:
+        seen = set()
+        scanned = 0
+        removed = 0
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            for name in filenames:
+                if not name.lower().endswith(SUITE_EXTENSIONS):
+                    continue
+                full = os.path.join(dirpath, name)
+                rel = os.path.relpath(full, self.root)
+                try:
+                    st = os.stat(full)
+                except OSError:
+                    continue
+                seen.add(rel)
+                entry = self.files.get(rel)
+                if entry and entry['mtime'] == st.st_mtime_ns and entry['size'] == st.st_size:
+                    continue
+                try:
+                    tests = scan_suite_file(full)
+                except OSError as e:
+                    logging.warning("Skipping unreadable suite file %s: %s", full, e)
+                    continue
+                self.files[rel] = {'mtime': st.st_mtime_ns, 'size': st.st_size, 'tests': tests}
+                scanned += 1
+        for rel in list(self.files):
+            if rel not in seen:
+                del self.files[rel]
+                removed += 1
+        if scanned or removed:
+            self._rebuild_lookup()
+            try:
+                self.save()
+            except OSError as e:
+                logging.warning("Could not save STTL index %s: %s", self.index_path, e)
+        logging.debug("STTL index %s: %d file(s) scanned, %d removed, %d cached",
+                      self.root, scanned, removed, len(self.files) - scanned)
+        return scanned
+
+    def _rebuild_lookup(self) -> None:
+        by_id: Dict[str, List[Tuple[str, str]]] = {}
+        for rel, entry in self.files.items():
+            for num, name in entry['tests']:
+                by_id.setdefault(num, []).append((rel, name))
+        self._by_id = by_id
+        self._keys = sorted(by_id)
+
+    def hash_files(self, rels: Sequence[str]) -> Dict[str, str]:
+        """sha256 of suite files (relative paths), kept in the index until a file changes."""
+        hashes: Dict[str, str] = {}
+        computed = 0
+        with self._lock:
+            for rel in rels:
+                entry = self.files.get(rel)
+                if entry is None:
+                    continue
+                if 'sha256' not in entry:
+                    digest = hashlib.sha256()
+                    try:
+                        with open(os.path.join(self.root, rel), 'rb') as f:
+                            for block in iter(lambda: f.read(1 << 16), b''):
+                                digest.update(block)
+                    except OSError as e:
+                        logging.warning("Cannot hash suite file %s: %s", rel, e)
+                        continue
+                    entry['sha256'] = digest.hexdigest()
+                    computed += 1
+                hashes[rel] = entry['sha256']
+            if computed:
+                try:
+                    self.save()
+                except OSError as e:
+                    logging.warning("Could not save STTL index %s: %s", self.index_path, e)
+        return hashes
+
+    def lookup(self, sttl_id: str) -> List[Tuple[str, str]]:
+        """Return (file, test name) pairs selected by zybot's -t "<sttl_id>*" pattern.
+        The trailing wildcard means STTL-123 also selects STTL-1234, so match by prefix."""
+        num = sttl_id.split('-', 1)[-1]
+        hits: List[Tuple[str, str]] = []
+        i = bisect.bisect_left(self._keys, num)
+        while i < len(self._keys) and self._keys[i].startswith(num):
+            hits.extend(self._by_id[self._keys[i]])
+            i += 1
+        return hits
+
+_indexes: Dict[str, SttlIndex] = {}
+_indexes_lock = threading.Lock()
+
+def get_sttl_index(path: str, cwd: Optional[str] = None) -> SttlIndex:
+    """Return the (incrementally updated) index for a test path, relative to cwd (default EXECUTION_DIR)."""
+    root = os.path.normpath(path if os.path.isabs(path) else os.path.join(cwd or EXECUTION_DIR, path))
+    with _indexes_lock:
+        index = _indexes.get(root)
+        if index is None:
+            index = _indexes[root] = SttlIndex(root)
+    index.update()
+    return index
+
+def resolve_sources(sttls: Sequence[str], path: str, cwd: Optional[str] = None) -> Optional[List[str]]:
+    """Map STTL ids to the exact suite files zybot needs to parse (path relative to cwd, default EXECUTION_DIR).
+    Returns None (keep the full path) if the path is missing or any id is not indexed."""
+    root = path if os.path.isabs(path) else os.path.join(cwd or EXECUTION_DIR, path)
+    if not os.path.isdir(root):
+        logging.warning("STTL index skipped; test path not found: %s", root)
+        return None
+    index = get_sttl_index(path, cwd)
+    files: List[str] = []
+    missing: List[str] = []
+    for sid in sttls:
+        hits = index.lookup(sid)
+        if not hits:
+            missing.append(sid)
+        for rel, _ in hits:
+            if rel not in files:
+                files.append(rel)
+    if missing:
+        logging.warning("STTL index has no test for %s; passing full path %s", ', '.join(missing[:10]), path)
+        return None
+    return [os.path.join(path, rel) for rel in files]
+
+# ---------------- Unified Build Function ----------------
+
+def build_command(vars_tokens: Sequence[str], sttl_block: str, path: Optional[str], allow_empty_vars: bool = False, flags: Optional[Sequence[str]] = None) -> ZybotCommand:
+    vars_list = parse_vars(vars_tokens, allow_empty=allow_empty_vars)
+    sttls = parse_sttl_block(sttl_block)
+    flag_tokens = parse_flags(flags or [])
+    return ZybotCommand(vars=vars_list, sttls=sttls, path=path or None, flags=flag_tokens)
+
+# Overload build_command to accept sttl_ids as list
+
+@traced("build_command")
+def build_command(vars_tokens, sttl_ids, path, allow_empty_vars=False, flags=None, use_index=False):
+    vars_list = parse_vars(vars_tokens, allow_empty=allow_empty_vars)
+    flag_tokens = parse_flags(flags or [])
+    sources = resolve_sources(sttl_ids, path) if use_index and path else None
+    return ZybotCommand(vars=vars_list, sttls=sttl_ids, path=path or None, flags=flag_tokens, sources=sources)
+
+# --------------- Zybot Executable Resolution ---------------
+
+@traced("execute")
+def execute(command: ZybotCommand, chunk_mode: str = "auto", options: Optional[RunOptions] = None) -> int:
+    """
+    Simplified execution:
+    1. Run the command's argument vector (no shell) from options.exec_dir,
+       with results in a per-job output directory.
+       Commands over the command-line limit are chunked (see plan_execution).
+    2. Stream zybot output line by line to stdout, with a progress bar and ETA (see ProgressDisplay).
+    Safe to call from several threads at once: nothing process-wide (cwd, env) is changed.
+    """
+    options = options or RunOptions()
+    try:
+        command = apply_preflight(command, mode=options.preflight)
+        return execute_with_progress(command, plan_execution(command, chunk_mode=chunk_mode), options)
+    except PreflightError as e:
+        logging.error("%s", e)
+        return PREFLIGHT_FAILED_RC
+    except LeaseError as e:
+        logging.error("%s", e)
+        return LEASE_BUSY_RC
+
+# ---------------- Parallel (Sharded) Execution ----------------
+
+def split_outputdir(flags: Optional[Sequence[str]]) -> Tuple[List[str], str]:
+    """Return (flags without --outputdir/-d, output dir base) so shards can get their own directory."""
+    remaining: List[str] = []
+    base = DEFAULT_OUTPUT_DIR
+    tokens = list(flags or [])
+    i = 0
+    while i < len(tokens):
+        tok = tokens[i]
+        if tok in {"--outputdir", "-d"} and i + 1 < len(tokens):
+            base = tokens[i + 1]
+            i += 2
+            continue
+        if tok.startswith("--outputdir="):
+            base = tok.split("=", 1)[1]
+            i += 1
+            continue
+        remaining.append(tok)
+        i += 1
+    return remaining, base
+
+def dut_serial(command: ZybotCommand) -> str:
+    """Serial of the command's first DUT variable ('-' when none)."""
+    duts = sorted((int(m.group(1)), v) for k, v in command.vars for m in [DUT_KEY_PATTERN.match(k)] if m)
+    return duts[0][1] if duts else '-'
+
+def estimate_durations(sttls: Sequence[str]) -> Dict[str, float]:
+    """Median recorded duration per test from the run history; DEFAULT_TEST_DURATION when unknown."""
+    history = get_history()
+    known: Dict[str, List[float]] = {}
+    if history:
+        try:
+            known = history.durations(sttls)
+        except sqlite3.Error as e:
+            logging.debug("Duration lookup failed: %s", e)
+    return {sid: statistics.median(known[sid]) if known.get(sid) else DEFAULT_TEST_DURATION for sid in sttls}
+
+def schedule_lpt(sttls: Sequence[str], bins: int, durations: Dict[str, float]) -> List[List[str]]:
+    """Longest-processing-time-first: assign each test, longest first, to the least loaded bin."""
+    buckets: List[List[str]] = [[] for _ in range(bins)]
+    heap = [(0.0, i) for i in range(bins)]
+    for sid in sorted(sttls, key=lambda sid: durations[sid], reverse=True):
+        load, i = heapq.heappop(heap)
+        buckets[i].append(sid)
+        heapq.heappush(heap, (load + durations[sid], i))
+    return buckets
+
+def shard_command(command: ZybotCommand, schedule: str = "lpt") -> List[ZybotCommand]:
+    """Split command.sttls into one shard per DUT variable.
+    Each shard drives a single phone, rebound as DUT1 so single-device suites run unchanged.
+    Non-DUT variables (e.g. TESTDIR) are copied to every shard and each shard writes its
+    results to <outputdir>/<serial> to avoid concurrent writers clobbering output.xml.
+    schedule 'lpt' (and 'steal', which starts from the LPT assignment) balances shards by
+    historical test duration; 'round-robin' deals IDs out in order."""
+    if schedule not in SCHEDULES:
+        raise ValidationError(f"Unknown schedule: {schedule}")
+    duts = [(k, v) for k, v in command.vars if DUT_KEY_PATTERN.match(k)]
+    duts.sort(key=lambda kv: int(DUT_KEY_PATTERN.match(kv[0]).group(1)))
+    others = [(k, v) for k, v in command.vars if not DUT_KEY_PATTERN.match(k)]
+    if len(duts) < 2:
+        return [command]
+    if schedule == "round-robin":
+        buckets: List[List[str]] = [[] for _ in duts]
+        for i, sid in enumerate(command.sttls):
+            buckets[i % len(duts)].append(sid)
+    else:
+        durations = estimate_durations(command.sttls)
+        buckets = schedule_lpt(command.sttls, len(duts), durations)
+        total = sum(durations.values())
+        makespan = max(sum(durations[sid] for sid in b) for b in buckets)
+        logging.info("LPT schedule: %.1f min of work on %d DUTs, predicted wall-clock %.1f min",
+                     total / 60, len(duts), makespan / 60)
+    base_flags, out_base = split_outputdir(command.flags)
+    shards: List[ZybotCommand] = []
+    for (_, serial), sttls in zip(duts, buckets):
+        if not sttls:
+            continue
+        shards.append(ZybotCommand(
+            vars=[("DUT1", serial)] + others,
+            sttls=sttls,
+            path=command.path,
+            flags=base_flags + ["--outputdir", os.path.join(out_base, serial)],
+            sources=command.sources,
+        ))
+    return shards
+
+def split_units(command: ZybotCommand, size: int = 1) -> List[ZybotCommand]:
+    """Split a shard into work-stealing units of `size` STTL IDs.
+    Units write to <outputdir>/<first STTL id> so they stay unique on whichever DUT runs them."""
+    base_flags, out_base = split_outputdir(command.flags)
+    out_root = os.path.dirname(out_base) or DEFAULT_OUTPUT_DIR  # shard dirs are <outputdir>/<serial>
+    return [ZybotCommand(vars=command.vars, sttls=command.sttls[i:i + size], path=command.path,
+                         flags=base_flags + ["--outputdir", os.path.join(out_root, command.sttls[i])],
+                         sources=command.sources)
+            for i in range(0, len(command.sttls), size)]
+
+def rebind_command(command: ZybotCommand, serial: str) -> ZybotCommand:
+    """Return a copy of a single-DUT command that targets another DUT1 serial."""
+    return replace(command, vars=[(k, serial if k == "DUT1" else v) for k, v in command.vars])
+
+def merge_return_codes(codes: Sequence[int]) -> int:
+    """Combine per-shard exit codes into one zybot-style result.
+    0..MAX_FAILED_RC is a failed-test count and is summed (capped); any other code is an
+    execution error and takes precedence."""
+    errors = [c for c in codes if c < 0 or c > MAX_FAILED_RC]
+    if errors:
+        return errors[0]
+    return min(sum(codes), MAX_FAILED_RC)
+
+def execute_parallel(command: ZybotCommand, chunk_mode: str = "auto", schedule: str = "lpt",
+                     options: Optional[RunOptions] = None) -> int:
+    """Run one zybot process per shard concurrently and merge the exit codes."""
+    options = options or RunOptions()
+    try:
+        command = apply_preflight(command, parallel=True, mode=options.preflight)
+    except PreflightError as e:
+        logging.error("%s", e)
+        return PREFLIGHT_FAILED_RC
+    plan = plan_execution(command, parallel=True, chunk_mode=chunk_mode, schedule=schedule)
+    try:
+        return execute_with_progress(command, plan, options)
+    except LeaseError as e:
+        logging.error("%s", e)
+        return LEASE_BUSY_RC
+
+# ---------------- Execution Planning (Command-Line Limits) ----------------
+
+def command_line_limit() -> int:
+    if os.name != 'nt':
+        return POSIX_CMD_LIMIT
+    # .bat/.cmd launchers are run through cmd.exe, which keeps its shorter limit
+    if zybot_launcher()[0].lower().endswith(('.bat', '.cmd')):
+        return WINDOWS_CMD_LIMIT
+    return WINDOWS_CREATEPROCESS_LIMIT
+
+def write_argument_file(command: ZybotCommand) -> str:
+    """Write the -v/-t options (and suite files) of a command to a zybot --argumentfile."""
+    fd, path = tempfile.mkstemp(prefix="zybutler_", suffix=".args")
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        for k, v in command.vars:
+            f.write(f"--variable {k}:{v}\n")
+        for sid in command.sttls:
+            f.write(f"--test {sid}*\n")
+        for src in command.sources or ([command.path] if command.path else []):
+            f.write(f"{src}\n")
+    return path
+
+def remove_argument_files(commands: Iterable[ZybotCommand]) -> None:
+    """Delete the argument files of commands; ones already gone are skipped."""
+    for cmd in commands:
+        if cmd.argument_file:
+            try:
+                os.remove(cmd.argument_file)
+            except OSError:
+                pass
+
+def split_batches(command: ZybotCommand, limit: int) -> List[ZybotCommand]:
+    """Split command.sttls into batches whose command line stays under limit.
+    Each batch writes to <outputdir>/batch<N> so sequential batches don't overwrite results."""
+    base_flags, out_base = split_outputdir(command.flags)
+    def batch(idx: int, sttls: List[str]) -> ZybotCommand:
+        return ZybotCommand(vars=command.vars, sttls=sttls, path=command.path,
+                            flags=base_flags + ["--outputdir", os.path.join(out_base, f"batch{idx}")],
+                            sources=command.sources)
+    budget = limit - len(batch(999, []).display_command())
+    batches: List[ZybotCommand] = []
+    current: List[str] = []
+    size = 0
+    for sid in command.sttls:
+        cost = len(f' -t "{sid}*"')
+        if current and size + cost > budget:
+            batches.append(batch(len(batches) + 1, current))
+            current, size = [], 0
+        current.append(sid)
+        size += cost
+    if current:
+        batches.append(batch(len(batches) + 1, current))
+    return batches
+
+def chunk_command(command: ZybotCommand, mode: str = "auto", limit: Optional[int] = None) -> List[ZybotCommand]:
+    """Return the sequential zybot invocations needed to run command within the command-line limit.
+    auto/argfile: one invocation whose -v/-t options live in an argument file.
+    batch: several invocations, each with a slice of the STTL IDs."""
+    if mode not in CHUNK_MODES:
+        raise ValidationError(f"Unknown chunk mode: {mode}")
+    limit = limit or command_line_limit()
+    length = len(command.display_command())
+    if length <= limit:
+        return [command]
+    if mode == "batch":
+        batches = split_batches(command, limit)
+        if all(len(b.display_command()) <= limit for b in batches):
+            logging.info("Command is %d chars (limit %d); running %d sequential batches", length, limit, len(batches))
+            return batches
+        logging.warning("Variables and flags alone exceed the command-line limit; using an argument file")
+    argfile = write_argument_file(command)
+    logging.info("Command is %d chars (limit %d); passing -v/-t options via %s", length, limit, argfile)
+    return [ZybotCommand(vars=command.vars, sttls=command.sttls, path=command.path,
+                         flags=command.flags, sources=command.sources, argument_file=argfile)]
+
+_job_counter = itertools.count(1)
+
+def new_job_id() -> str:
+    """Unique id for one execution: timestamp, process id and a per-process counter."""
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_job_counter)}"
+
+def isolate_output(command: ZybotCommand, job_id: str) -> ZybotCommand:
+    """Copy of command writing its results to <outputdir>/<job_id>, so concurrent jobs never share a directory."""
+    base_flags, out_base = split_outputdir(command.flags)
+    return replace(command, flags=base_flags + ["--outputdir", os.path.join(out_base, job_id)])
+
+class ExecutionPlan(list):
+    """Groups of zybot invocations: groups run concurrently, commands within a group in order.
+    With steal=True an idle group takes pending commands from the busiest other group."""
+    steal = False
+    parallel = False  # groups are single-DUT shards of the command
+    job_id: Optional[str] = None
+    output_dir: Optional[str] = None  # job output directory, relative to the execution directory
+
+def plan_execution(command: ZybotCommand, parallel: bool = False, chunk_mode: str = "auto",
+                   limit: Optional[int] = None, schedule: str = "lpt", steal_batch: int = 1,
+                   job_dir: bool = True) -> ExecutionPlan:
+    """Build the execution plan for a command (sharded per DUT when parallel).
+    With job_dir, all results of the plan go below a fresh <outputdir>/<job id> directory."""
+    plan = ExecutionPlan()
+    if job_dir:
+        plan.job_id = new_job_id()
+        command = isolate_output(command, plan.job_id)
+    plan.output_dir = split_outputdir(command.flags)[1]
+    shards = shard_command(command, schedule) if parallel else [command]
+    plan.parallel = parallel and len(shards) > 1
+    if parallel and schedule == "steal" and len(shards) > 1:
+        plan.extend(split_units(shard, steal_batch) for shard in shards)
+        plan.steal = True
+    else:
+        plan.extend(chunk_command(shard, chunk_mode, limit) for shard in shards)
+    return plan
+
+# ---------------- Output Parsing ----------------
+
+@dataclass
+class TestResult:
+    sttl: str
+    status: str
+    duration: float  # seconds, measured from the zybot output stream
+    dut: str = '-'
+    name: str = ''
+    started: float = 0.0  # epoch seconds
+    finished: float = 0.0
+    message: str = ''  # failure message (console lines after a FAIL, filled in as they arrive)
+
+class ResultParser:
+    """Incrementally turn zybot console lines into TestResults.
+    zybot prints `<test name> ... | PASS |` when a test ends; a test is taken to start at the
+    previous separator line (printed after each result and each suite header). Lines between
+    a FAIL and the next separator are appended to that result's message."""
+
+    def __init__(self, dut: str = '-'):
+        self.dut = dut
+        self._mark = time.monotonic()
+        self._mark_wall = time.time()
+        self._failed: Optional[TestResult] = None
+
+    def feed(self, line: str) -> Optional[TestResult]:
+        if SEPARATOR_LINE_PATTERN.match(line):
+            self._mark = time.monotonic()
+            self._mark_wall = time.time()
+            self._failed = None
+            return None
+        m = RESULT_LINE_PATTERN.match(line)
+        if not m:
+            failed = self._failed
+            if failed and len(failed.message) < FAILURE_MESSAGE_MAX:
+                failed.message = (failed.message + '\n' + line if failed.message else line)[:FAILURE_MESSAGE_MAX]
+            return None
+        now = time.monotonic()
+        result = TestResult(sttl=m.group(1).upper(), status=m.group(3), duration=now - self._mark,
+                            dut=self.dut, name=(m.group(1) + m.group(2)).strip(),
+                            started=self._mark_wall, finished=time.time())
+        self._mark = now
+        self._mark_wall = result.finished
+        self._failed = result if result.status == 'FAIL' else None
+        return result
+
+# ---------------- Progress ----------------
+
+def format_clock(seconds: float) -> str:
+    """H:MM:SS (or M:SS under an hour)."""
+    minutes, sec = divmod(int(max(seconds, 0)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{sec:02d}" if hours else f"{minutes}:{sec:02d}"
+
+class Progress:
+    """Live test counts of one run against its STTL ids, with an ETA.
+    Fed with parsed TestResults from any thread; memory grows with the number of ids, never with
+    the amount of output. The ETA scales the expected duration of the remaining tests (recorded
+    medians, see estimate_durations) by how fast the finished ones actually went, which also
+    accounts for parallel lanes; before the first result it assumes lanes run in parallel."""
+
+    def __init__(self, sttls: Sequence[str], lanes: int = 1, durations: Optional[Dict[str, float]] = None):
+        self.expected = dict(durations) if durations is not None else estimate_durations(sttls)
+        self.total = len(self.expected)
+        self.lanes = max(1, lanes)
+        self.started = time.monotonic()
+        self.counts: Dict[str, int] = collections.Counter()
+        self._status: Dict[str, str] = {}
+        self._remaining = sum(self.expected.values())
+        self._done_work = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, result: TestResult) -> None:
+        with self._lock:
+            weight = self.expected.get(result.sttl)
+            if weight is None:  # selected by a -t prefix but not one of the run's ids
+                return
+            previous = self._status.get(result.sttl)
+            if previous is None:
+                self._remaining -= weight
+                self._done_work += weight
+            else:  # a retry replaces the earlier outcome
+                self.counts[previous] -= 1
+            self._status[result.sttl] = result.status
+            self.counts[result.status] += 1
+
+    @property
+    def done(self) -> int:
+        return len(self._status)
+
+    @property
+    def fraction(self) -> float:
+        return self.done / self.total if self.total else 1.0
+
+    def eta(self) -> float:
+        """Estimated seconds until every test has a result."""
+        with self._lock:
+            if self._done_work > 0:
+                return (time.monotonic() - self.started) * self._remaining / self._done_work
+            return self._remaining / self.lanes
+
+    def summary(self, width: int = 24) -> str:
+        """One-line status, e.g. `[######------] 12/40 30%  9 passed  3 failed  0:12:00 elapsed  ETA 0:34:00`."""
+        filled = int(width * self.fraction)
+        bar = f"[{'#' * filled}{'-' * (width - filled)}] " if width else ''
+        text = f"{bar}{self.done}/{self.total} {self.fraction:.0%}  {self.counts['PASS']} passed  {self.counts['FAIL']} failed"
+        skipped = self.counts['SKIP'] + self.counts['NOT RUN']
+        if skipped:
+            text += f"  {skipped} skipped"
+        text += f"  {format_clock(time.monotonic() - self.started)} elapsed"
+        if self.done < self.total:
+            text += f"  ETA {format_clock(self.eta())}"
+        return text
+
+_stdout_lock = threading.Lock()
+
+class ProgressDisplay:
+    """zybot output on stdout together with the progress of the run.
+    On a terminal the progress line stays below the streaming output and is redrawn every
+    PROGRESS_REFRESH seconds; otherwise a progress line is logged every PROGRESS_LOG_INTERVAL
+    seconds while results arrive. Output lines only cost a write; the status text is
+    rebuilt by the refresh thread. Log records clear the progress line first so they do
+    not end up appended to it."""
+
+    def __init__(self, progress: Progress, stream=None):
+        self.progress = progress
+        self.stream = stream or sys.stdout
+        self.tty = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        self._status = ''
+        self._logged = (0, time.monotonic())  # (tests done, when) at the last log line
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._refresh_loop, name="progress", daemon=True)
+
+    def start(self) -> "ProgressDisplay":
+        if self.tty:
+            for handler in logging.getLogger().handlers:
+                handler.addFilter(self._clear)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=2)
+        for handler in logging.getLogger().handlers:
+            handler.removeFilter(self._clear)
+        self._clear()
+        logging.info("Progress: %s", self.progress.summary(width=0))
+
+    def on_line(self, line: str) -> None:
+        with _stdout_lock:
+            if self.tty and self._status:
+                self.stream.write('\r\x1b[K' + line + '\n' + self._status)
+            else:
+                self.stream.write(line + '\n')
+            self.stream.flush()
+
+    def _clear(self, record: Optional[logging.LogRecord] = None) -> bool:
+        """Erase the progress line; the next refresh draws it again (also a logging filter)."""
+        with _stdout_lock:
+            if self._status:
+                self._status = ''
+                self.stream.write('\r\x1b[K')
+                self.stream.flush()
+        return True
+
+    def refresh(self) -> None:
+        if self.tty:
+            status = color(self.progress.summary(), CYAN)
+            with _stdout_lock:
+                self._status = status
+                self.stream.write('\r\x1b[K' + status)
+                self.stream.flush()
+            return
+        done, when = self._logged
+        if self.progress.done != done and time.monotonic() - when >= PROGRESS_LOG_INTERVAL:
+            self._logged = (self.progress.done, time.monotonic())
+            logging.info("Progress: %s", self.progress.summary(width=0))
+
+    def _refresh_loop(self) -> None:
+        while not self._stop.wait(PROGRESS_REFRESH):
+            self.refresh()
+
+PROGRESS_ENABLED = not os.environ.get("ZYBUTLER_NO_PROGRESS")  # default of RunOptions.progress
+
+def execute_with_progress(command: ZybotCommand, plan: Sequence[Sequence[ZybotCommand]],
+                          options: Optional[RunOptions] = None, **kwargs) -> int:
+    """execute_plan streaming to stdout, with the run's progress and ETA unless options.progress is off."""
+    options = options or RunOptions()
+    if not options.progress:
+        return execute_plan(command, plan, echo_line, options, **kwargs)
+    progress = Progress(command.sttls, lanes=len(plan))
+    display = ProgressDisplay(progress).start()
+    try:
+        return execute_plan(command, plan, display.on_line, options, progress=progress, **kwargs)
+    finally:
+        display.stop()
+
+# ---------------- Result Files ----------------
+
+def _parse_result_time(value: Optional[str]) -> Optional[float]:
+    """Epoch seconds from an output.xml timestamp (RF7 ISO 'start' or legacy 'starttime').
+    Sliced by hand: strptime would dominate parse time on large result files."""
+    if not value or value == 'N/A':
+        return None
+    try:
+        if 'T' in value:
+            return datetime.fromisoformat(value).timestamp()
+        return datetime(int(value[0:4]), int(value[4:6]), int(value[6:8]), int(value[9:11]),
+                        int(value[12:14]), int(value[15:17]), int(value[18:21] or 0) * 1000).timestamp()
+    except (ValueError, IndexError):
+        return None
+
+def iter_output_results(path: str, dut: str = '-') -> Iterator[TestResult]:
+    """Stream STTL test results out of a zybot output.xml in constant memory.
+    Uses expat callbacks directly (no element tree), so multi-hundred-MB files parse quickly."""
+    stack: List[str] = []
+    pending: List[TestResult] = []
+    current: Dict[str, Optional[str]] = {}
+
+    def start(tag: str, attrs: Dict[str, str]) -> None:
+        if tag == 'test':
+            current.clear()
+            current['name'] = attrs.get('name', '')
+        elif tag == 'status' and stack and stack[-1] == 'test' and 'name' in current:
+            current['status'] = attrs.get('status')
+            started = _parse_result_time(attrs.get('start') or attrs.get('starttime'))
+            if 'elapsed' in attrs:
+                duration = float(attrs['elapsed'])
+            else:
+                ended = _parse_result_time(attrs.get('endtime'))
+                duration = ended - started if started is not None and ended is not None else 0.0
+            current['started'] = started
+            current['duration'] = duration
+        stack.append(tag)
+
+    def end(tag: str) -> None:
+        stack.pop()
+        if tag == 'test' and current.get('status'):
+            m = INDEXED_TEST_PATTERN.match(current['name'] or '')
+            if m:
+                started = current.get('started') or 0.0
+                pending.append(TestResult(sttl=f"STTL-{m.group(1)}", status=current['status'],
+                                          duration=current['duration'], dut=dut, name=current['name'],
+                                          started=started, finished=started + current['duration']))
+            current.clear()
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.buffer_text = True
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(XML_READ_CHUNK)
+            try:
+                parser.Parse(chunk, not chunk)
+            except expat.ExpatError as e:
+                raise ParseError(f"{path}: {e}") from e
+            yield from pending
+            pending.clear()
+            if not chunk:
+                break
+
+def find_output_files(path: str) -> List[str]:
+    """Return the output.xml file itself, or every output*.xml under a results directory (oldest first)."""
+    if not os.path.isdir(path):
+        return [path]
+    found = [os.path.join(dirpath, name) for dirpath, _, names in os.walk(path)
+             for name in names if OUTPUT_XML_PATTERN.match(name)]
+    if not found:
+        raise ParseError(f"No output*.xml files under {path}")
+    return sorted(found, key=os.path.getmtime)
+
+def failed_sttls(path: str) -> List[str]:
+    """STTL IDs whose most recent result in the given output file(s) is FAIL, in first-seen order."""
+    latest: Dict[str, str] = {}
+    for result_file in find_output_files(path):
+        for result in iter_output_results(result_file):
+            latest[result.sttl] = result.status
+    return [sid for sid, status in latest.items() if status == 'FAIL']
+
+def _dut_from_path(path: str, root: str) -> str:
+    """DUT serial of a result file from its directory names (shards write to <job>/<serial>), or '-'."""
+    parts = os.path.relpath(os.path.dirname(path), root).replace(os.sep, '/').split('/')
+    return next((p for p in reversed(parts) if p.isalnum() and len(p) >= MIN_SERIAL_LEN), '-')
+
+class ResultMerger:
+    """Consolidated results of several zybot output.xml files, merged one file at a time.
+    Files are streamed through iter_output_results, so memory holds one record per STTL ID
+    however large the files are. The newest result of a test wins (retries and re-queued runs
+    come later); attempts counts how many results a test had. With start(), files queued by
+    add() are merged on a background thread while the run goes on, and the report is
+    rewritten at most every MERGE_WRITE_INTERVAL seconds."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.results: Dict[str, TestResult] = {}
+        self.attempts: Dict[str, int] = collections.Counter()
+        self.files = 0
+        self._queue: "queue.Queue[Optional[Tuple[str, str]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._written = 0.0
+
+    def merge_file(self, path: str, dut: str = '-') -> int:
+        """Merge one result file; return the number of test results read from it."""
+        count = 0
+        for result in iter_output_results(path, dut):
+            count += 1
+            self.attempts[result.sttl] += 1
+            previous = self.results.get(result.sttl)
+            if previous is None or result.finished >= previous.finished:
+                self.results[result.sttl] = result
+        self.files += 1
+        return count
+
+    def start(self) -> "ResultMerger":
+        self._thread = threading.Thread(target=self._run, name="result-merge", daemon=True)
+        self._thread.start()
+        return self
+
+    def add(self, path: str, dut: str = '-') -> None:
+        """Queue a finished result file for merging (merged right away without start())."""
+        if self._thread:
+            self._queue.put((path, dut))
+        else:
+            self._merge_logged(path, dut)
+
+    def finish(self, min_files: int = 1) -> bool:
+        """Merge everything still queued and write the final report if at least min_files
+        were merged; return whether it was written."""
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self.files < min_files:
+            return False
+        self.write()
+        return True
+
+    def _merge_logged(self, path: str, dut: str) -> None:
+        try:
+            self.merge_file(path, dut)
+        except (OSError, ParseError) as e:  # e.g. a killed zybot left no or half an output.xml
+            logging.warning("Result file not merged: %s", e)
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            self._merge_logged(*item)
+            if self.files > 1 and time.monotonic() - self._written >= MERGE_WRITE_INTERVAL:
+                self.write()
+
+    def counts(self) -> Dict[str, int]:
+        return dict(collections.Counter(r.status for r in self.results.values()))
+
+    def write(self) -> None:
+        """Write MERGED_XML and MERGED_SUMMARY into the directory (each replaced atomically)."""
+        self._written = time.monotonic()
+        xml_path = os.path.join(self.directory, MERGED_XML)
+        duts: Dict[str, Dict[str, float]] = {}
+        try:
+            with open(xml_path + '.tmp', 'w', encoding='utf-8') as f:
+                f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                        f'<robot generator="ZyButler" generated={quoteattr(datetime.now().isoformat(timespec="seconds"))}>\n'
+                        '<suite name="Merged">\n')
+                for r in self.results.values():
+                    start = datetime.fromtimestamp(r.started).isoformat(timespec="microseconds") if r.started else "N/A"
+                    f.write(f'<test name={quoteattr(r.name or r.sttl)}>\n<tag>{r.dut}</tag>\n'
+                            f'<status status="{r.status}" start="{start}" elapsed="{r.duration:.3f}"/>\n</test>\n')
+                    stats = duts.setdefault(r.dut, collections.Counter())
+                    stats[r.status] += 1
+                    stats['duration'] += r.duration
+                f.write('</suite>\n</robot>\n')
+            os.replace(xml_path + '.tmp', xml_path)
+            head = {"generated": time.time(), "files": self.files, "tests": len(self.results), "counts": self.counts(),
+                    "duts": {dut: {k: round(v, 3) for k, v in stats.items()} for dut, stats in duts.items()}}
+            summary_path = os.path.join(self.directory, MERGED_SUMMARY)
+            with open(summary_path + '.tmp', 'w', encoding='utf-8') as f:
+                # Results are written one line each rather than built as one big object
+                f.write(json.dumps(head)[:-1] + ', "results": [')
+                for i, r in enumerate(self.results.values()):
+                    f.write((',\n ' if i else '\n ') + json.dumps(
+                        {"sttl": r.sttl, "status": r.status, "duration": round(r.duration, 3), "dut": r.dut,
+                         "started": r.started, "attempts": self.attempts[r.sttl]}))
+                f.write('\n]}\n')
+            os.replace(summary_path + '.tmp', summary_path)
+        except OSError as e:
+            logging.warning("Could not write merged results to %s: %s", self.directory, e)
+
+    def summary_line(self) -> str:
+        counts = self.counts()
+        line = f"{len(self.results)} test(s) from {self.files} result file(s): {counts.get('PASS', 0)} passed, {counts.get('FAIL', 0)} failed"
+        others = len(self.results) - counts.get('PASS', 0) - counts.get('FAIL', 0)
+        return line + (f", {others} skipped/not run" if others else '')
+
+def merge_results(path: str) -> ResultMerger:
+    """Merge every output*.xml under a results directory (oldest first) into its merged report."""
+    if not os.path.isdir(path):
+        raise ParseError(f"Not a results directory: {path}")
+    merger = ResultMerger(path)
+    for result_file in find_output_files(path):
+        merger.add(result_file, _dut_from_path(result_file, path))
+    merger.finish()
+    return merger
+
+# ---------------- Device Leases ----------------
+
+HOSTNAME = socket.gethostname()
+
+def _pid_alive(pid: int) -> bool:
+    """True if a process with this pid exists on this host (os.kill(pid, 0) would terminate it on Windows)."""
+    if os.name == 'nt':
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return kernel32.GetLastError() == 5  # access denied: exists, owned by another user
+        try:
+            code = ctypes.c_ulong()
+            kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+            return code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def describe_lease(info: dict) -> str:
+    since = time.strftime('%H:%M:%S', time.localtime(info['acquired'])) if info.get('acquired') else '?'
+    return f"{info.get('user', '?')}@{info.get('host', '?')} (pid {info.get('pid', '?')}, since {since})"
+
+class Lease:
+    """DUT serials held by one execution; release() (or leaving the with block) frees them."""
+
+    def __init__(self, manager: "LeaseManager", owner: str, serials: List[str]):
+        self.manager = manager
+        self.owner = owner
+        self.serials = serials
+
+    def release(self) -> None:
+        self.manager.release(self)
+
+    def __enter__(self) -> "Lease":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+class LeaseManager:
+    """Per-serial lease files, so concurrent ZyButler runs (any user, CLI or GUI) never drive the same DUT.
+    <serial>.lease is created with O_EXCL and renewed by a heartbeat thread. A lease is stale once
+    its TTL passes without renewal, or at once when its process on this host is gone; stale
+    leases are taken over by the next run that needs the DUT."""
+
+    def __init__(self, directory: str = LEASE_DIR, ttl: float = LEASE_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+        try:
+            # Shared like /tmp: everyone may create leases, but only their owner can remove or replace them
+            os.chmod(directory, 0o1777)
+        except OSError as e:
+            logging.debug("Could not make lease directory %s shared: %s", directory, e)
+        try:
+            self.user = getpass.getuser()
+        except Exception:
+            self.user = '?'
+        self._leases: List[Lease] = []
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        self._heartbeat: Optional[threading.Thread] = None
+
+    def _path(self, serial: str) -> str:
+        return os.path.join(self.directory, f"{serial}.lease")
+
+    def _read(self, path: str) -> Optional[dict]:
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            # Being written right now (or corrupt): treat as held until it ages out
+            try:
+                return {"expires": os.path.getmtime(path) + self.ttl}
+            except OSError:
+                return None
+
+    def holder(self, serial: str) -> Optional[dict]:
+        """Current lease record of a serial, or None when it is free (or its lease is stale)."""
+        info = self._read(self._path(serial))
+        return None if info is None or self._is_stale(info) else info
+
+    def _is_stale(self, info: dict) -> bool:
+        if info.get('expires', 0) < time.time():
+            return True
+        return info.get('host') == HOSTNAME and isinstance(info.get('pid'), int) and not _pid_alive(info['pid'])
+
+    def _record(self, serial: str, owner: str) -> dict:
+        now = time.time()
+        return {"serial": serial, "owner": owner, "user": self.user, "host": HOSTNAME, "pid": os.getpid(),
+                "acquired": now, "expires": now + self.ttl}
+
+    def _break(self, path: str, stale: dict) -> bool:
+        """Remove a stale lease file unless someone else replaced it in the meantime.
+        Returns False when the file belongs to another user and cannot be removed."""
+        grave = f"{path}.{os.getpid()}.{next(self._counter)}.stale"
+        try:
+            os.rename(path, grave)
+        except PermissionError:
+            # Sticky lease directory: another user's file, so it stays until its owner or an admin removes it
+            logging.warning("Stale lease %s belongs to %s and cannot be removed by %s; delete it to free the DUT",
+                            path, describe_lease(stale), self.user)
+            return False
+        except OSError:
+            return True  # already broken or released by someone else
+        current = self._read(grave)
+        if current and current.get('owner') != stale.get('owner'):
+            try:
+                os.link(grave, path)  # lost a race against a fresh lease: put it back
+            except OSError:
+                pass
+        try:
+            os.remove(grave)
+        except OSError:
+            pass
+        return True
+
+    def _try_acquire(self, serial: str, owner: str) -> Optional[dict]:
+        """Create the lease file; return None on success, else the holder's record."""
+        path = self._path(serial)
+        for _ in range(3):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+            except FileExistsError:
+                info = self._read(path)
+                if info is None:
+                    continue  # released between our attempt and the read
+                if not self._is_stale(info):
+                    return info
+                if not self._break(path, info):
+                    return info
+                logging.warning("Recovered stale lease on %s held by %s", serial, describe_lease(info))
+                continue
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self._record(serial, owner), f)
+            return None
+        return self._read(path) or {}
+
+    def _remove(self, serial: str, owner: str) -> None:
+        path = self._path(serial)
+        info = self._read(path)
+        if info and info.get('owner') == owner:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logging.debug("Could not release lease %s: %s", path, e)
+
+    def acquire(self, serials: Sequence[str], wait: float = 0.0,
+                stop_event: Optional[threading.Event] = None) -> Tuple[Lease, float]:
+        """Lease all serials or none, retrying every LEASE_POLL seconds for up to wait seconds.
+        Never holds part of the set while waiting, so runs sharing DUTs cannot deadlock.
+        Returns (lease, seconds waited); raises LeaseError naming the holders."""
+        owner = f"{HOSTNAME}:{os.getpid()}:{next(self._counter)}"
+        wanted = sorted(set(serials))
+        started = time.monotonic()
+        announced = False
+        while True:
+            taken: List[str] = []
+            busy: Dict[str, dict] = {}
+            for serial in wanted:
+                info = self._try_acquire(serial, owner)
+                if info is None:
+                    taken.append(serial)
+                else:
+                    busy[serial] = info
+            if not busy:
+                lease = Lease(self, owner, taken)
+                with self._lock:
+                    self._leases.append(lease)
+                    if not (self._heartbeat and self._heartbeat.is_alive()):
+                        self._heartbeat = threading.Thread(target=self._renew_loop, name="lease-heartbeat", daemon=True)
+                        self._heartbeat.start()
+                return lease, time.monotonic() - started
+            for serial in taken:
+                self._remove(serial, owner)
+            waited = time.monotonic() - started
+            holders = "; ".join(f"{s} by {describe_lease(i)}" for s, i in busy.items())
+            if waited >= wait or (stop_event and stop_event.is_set()):
+                raise LeaseError(f"DUT(s) in use: {holders}")
+            if not announced:
+                logging.info("Waiting for leased DUT(s): %s", holders)
+                announced = True
+            (stop_event or threading.Event()).wait(min(LEASE_POLL, wait - waited))
+
+    def release(self, lease: Lease) -> None:
+        with self._lock:
+            if lease not in self._leases:
+                return
+            self._leases.remove(lease)
+        for serial in lease.serials:
+            self._remove(serial, lease.owner)
+
+    def _renew_loop(self) -> None:
+        while True:
+            time.sleep(self.ttl / 3)
+            with self._lock:
+                leases = list(self._leases)
+                if not leases:
+                    self._heartbeat = None
+                    return
+            for lease in leases:
+                for serial in lease.serials:
+                    self._renew(serial, lease.owner)
+
+    def _renew(self, serial: str, owner: str) -> None:
+        path = self._path(serial)
+        info = self._read(path)
+        if not info or info.get('owner') != owner:
+            logging.warning("Lease on %s was lost (taken over as stale)", serial)
+            return
+        info['expires'] = time.time() + self.ttl
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(info, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            logging.debug("Lease heartbeat for %s failed: %s", serial, e)  # retried on the next beat
+
+LEASES_ENABLED = not os.environ.get("ZYBUTLER_NO_LEASE")  # default of RunOptions.lease
+_lease_manager: Optional[LeaseManager] = None
+_lease_manager_failed = False  # the lease directory could not be created; not retried
+_lease_manager_lock = threading.Lock()
+
+def get_lease_manager() -> Optional[LeaseManager]:
+    """Return the process-wide LeaseManager, or None when leasing is disabled or unavailable."""
+    global _lease_manager, _lease_manager_failed
+    with _lease_manager_lock:
+        if not LEASES_ENABLED or _lease_manager_failed:
+            return None
+        if _lease_manager is None:
+            try:
+                _lease_manager = LeaseManager()
+            except OSError as e:
+                logging.warning("DUT leasing disabled (%s): %s", LEASE_DIR, e)
+                _lease_manager_failed = True
+        return _lease_manager
+
+# ---------------- Run History ----------------
+
+class HistoryStore:
+    """SQLite-backed history of zybot runs and per-test results.
+    Safe to share between threads; WAL mode lets concurrent ZyButler processes write."""
+
+    def __init__(self, path: str = HISTORY_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    id INTEGER PRIMARY KEY, command TEXT NOT NULL, duts TEXT NOT NULL,
+                    started REAL NOT NULL, finished REAL, returncode INTEGER);
+                CREATE TABLE IF NOT EXISTS results (
+                    run_id INTEGER NOT NULL REFERENCES runs(id), sttl TEXT NOT NULL, status TEXT NOT NULL,
+                    duration REAL NOT NULL, dut TEXT, name TEXT, started REAL, finished REAL NOT NULL);
+                CREATE INDEX IF NOT EXISTS idx_results_sttl_finished ON results(sttl, finished);
+                CREATE INDEX IF NOT EXISTS idx_results_run ON results(run_id);
+            """)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(runs)")}
+            if 'output_dir' not in columns:
+                self._conn.execute("ALTER TABLE runs ADD COLUMN output_dir TEXT")
+            if 'lease_wait' not in columns:
+                self._conn.execute("ALTER TABLE runs ADD COLUMN lease_wait REAL")
+            if 'attempt' not in {row[1] for row in self._conn.execute("PRAGMA table_info(results)")}:
+                self._conn.execute("ALTER TABLE results ADD COLUMN attempt INTEGER NOT NULL DEFAULT 1")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def start_run(self, command: ZybotCommand, output_dir: Optional[str] = None, lease_wait: float = 0.0) -> int:
+        duts = ' '.join(v for k, v in command.vars if DUT_KEY_PATTERN.match(k))
+        with self._lock, self._conn:
+            cur = self._conn.execute("INSERT INTO runs (command, duts, started, output_dir, lease_wait) VALUES (?, ?, ?, ?, ?)",
+                                     (command.display_command(), duts, time.time(), output_dir, lease_wait))
+            return cur.lastrowid
+
+    def finish_run(self, run_id: int, returncode: int) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE runs SET finished = ?, returncode = ? WHERE id = ?",
+                               (time.time(), returncode, run_id))
+
+    def record_result(self, run_id: int, result: TestResult, attempt: int = 1) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO results (run_id, sttl, status, duration, dut, name, started, finished, attempt) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_id, result.sttl, result.status, result.duration, result.dut, result.name, result.started, result.finished, attempt))
+
+    def last_status(self, sttl: str) -> Optional[TestResult]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sttl, status, duration, dut, name, started, finished FROM results WHERE sttl = ? ORDER BY finished DESC LIMIT 1",
+                (sttl.upper(),)).fetchone()
+        return TestResult(*row) if row else None
+
+    def durations(self, sttls: Optional[Sequence[str]] = None, limit: int = 20) -> Dict[str, List[float]]:
+        """Most recent `limit` PASS/FAIL durations per test (all tests when sttls is None)."""
+        query = ("SELECT sttl, duration FROM (SELECT sttl, duration, ROW_NUMBER() OVER "
+                 "(PARTITION BY sttl ORDER BY finished DESC) AS n FROM results WHERE status IN ('PASS', 'FAIL')"
+                 "{where}) WHERE n <= ?")
+        batches: List[List[str]] = [[]]
+        if sttls is not None:
+            ids = sorted({sid.upper() for sid in sttls})
+            batches = [ids[i:i + HISTORY_QUERY_BATCH] for i in range(0, len(ids), HISTORY_QUERY_BATCH)]
+        out: Dict[str, List[float]] = {}
+        with self._lock:
+            for batch in batches:
+                where = f" AND sttl IN ({','.join('?' * len(batch))})" if sttls is not None else ''
+                for sid, dur in self._conn.execute(query.format(where=where), batch + [limit]):
+                    out.setdefault(sid, []).append(dur)
+        return out
+
+    def duration_percentile(self, pct: float = 95.0, sttls: Optional[Sequence[str]] = None) -> Dict[str, float]:
+        """Per-test duration percentile (nearest-rank) over recent runs."""
+        result: Dict[str, float] = {}
+        for sid, values in self.durations(sttls).items():
+            values.sort()
+            rank = min(len(values), max(1, math.ceil(pct / 100.0 * len(values)))) - 1
+            result[sid] = values[rank]
+        return result
+
+HISTORY_ENABLED = not os.environ.get("ZYBUTLER_NO_HISTORY")  # default of RunOptions.history
+_history: Optional[HistoryStore] = None
+_history_failed = False  # the database could not be opened; not retried
+_history_lock = threading.Lock()
+
+def get_history() -> Optional[HistoryStore]:
+    """Return the shared HistoryStore, or None when history is disabled or unavailable."""
+    global _history, _history_failed
+    with _history_lock:
+        if not HISTORY_ENABLED or _history_failed:
+            return None
+        if _history is None:
+            try:
+                _history = HistoryStore()
+            except (OSError, sqlite3.Error) as e:
+                logging.warning("Run history disabled (%s): %s", HISTORY_DB, e)
+                _history_failed = True
+        return _history
+
+def execute_plan(command: ZybotCommand, plan: Sequence[Sequence[ZybotCommand]], on_line: Callable[[str], None],
+                 options: Optional[RunOptions] = None, cache: Optional[CacheContext] = None,
+                 stage: Optional[List[Artifact]] = None, progress: Optional[Progress] = None,
+                 on_spawn: Optional[Callable[[subprocess.Popen], None]] = None,
+                 stop_event: Optional[threading.Event] = None) -> int:
+    """Run an execution plan for command with the settings in options (default RunOptions()) and
+    record the run and its per-test results in the history.
+    Every DUTn serial is leased first (waiting up to options.lease_wait seconds); raises LeaseError
+    if another run keeps holding one of them. With cache=CacheContext, results also update
+    the result cache; with progress=Progress, they update the live counts. With options.logcat_dir
+    set, adb logcat of every DUT is captured for the duration of the run (see LogcatCapture). With
+    stage=[Artifact, ...], the artifacts are staged on every DUT while the leases are held;
+    returns STAGE_FAILED_RC without running anything when that fails on a DUT.
+    When the run takes several zybot invocations (shards, batches, retries), their output.xml
+    files are merged into the job directory as they finish (see ResultMerger)."""
+    options = options or RunOptions()
+    output_dir = getattr(plan, 'output_dir', None)
+    lease, waited = None, 0.0
+    manager = get_lease_manager() if options.lease else None
+    serials = [v for k, v in command.vars if DUT_KEY_PATTERN.match(k)]
+    try:
+        if manager and serials:
+            with TRACER.span("lease_wait", duts=len(serials)):
+                lease, waited = manager.acquire(serials, options.lease_wait, stop_event)
+            if waited >= LEASE_POLL:
+                logging.info("Waited %.1fs for DUT lease(s)", waited)
+        if stage and serials:
+            with TRACER.span("stage", duts=len(serials), artifacts=len(stage)):
+                failed = stage_artifacts(serials, stage)
+            if failed:
+                logging.error("Staging failed on %s; not running zybot", ', '.join(failed))
+                return STAGE_FAILED_RC
+        if output_dir:
+            logging.info("Results directory: %s", os.path.join(options.exec_dir, output_dir))
+        with TRACER.span("history_open"):
+            history = get_history() if options.history else None
+        run_id = history.start_run(command, output_dir, waited) if history else None
+        captures: Dict[str, LogcatCapture] = {}
+        if options.logcat_dir is not None and serials:
+            with TRACER.span("logcat_start", duts=len(serials)):
+                captures = start_logcat(serials, logcat_directory(output_dir, options))
+        def record(result: TestResult, attempt: int) -> None:
+            if progress:
+                progress.update(result)
+            # Results of a non-sharded run come from DUT1's parser; every captured log gets the marker
+            for capture in [captures[result.dut]] if result.dut in captures else captures.values():
+                capture.mark_result(result, attempt)
+            if cache:
+                cache.record(result)
+            if history is None:
+                return
+            try:
+                history.record_result(run_id, result, attempt)
+            except sqlite3.Error as e:
+                logging.debug("Could not record %s: %s", result.sttl, e)
+        merger = ResultMerger(os.path.join(options.exec_dir, output_dir)).start() if output_dir else None
+        def merge(cmd: ZybotCommand, rc: int) -> None:
+            result_file = os.path.join(options.exec_dir, split_outputdir(cmd.flags)[1], "output.xml")
+            if os.path.isfile(result_file):
+                merger.add(result_file, dut_serial(cmd))
+        rc = EXECUTION_ERROR_RC
+        try:
+            with TRACER.span("run_plan", runs=sum(len(g) for g in plan)):
+                rc = run_with_retries(command, plan, on_line, policy=options.retry,
+                                      record=record if history or cache or progress or captures else None,
+                                      cwd=options.exec_dir, timeout=options.timeout, idle_timeout=options.idle_timeout,
+                                      on_exit=merge if merger else None, on_spawn=on_spawn, stop_event=stop_event)
+        finally:
+            # A single zybot run's output.xml already is the whole report
+            if merger and merger.finish(min_files=2):
+                logging.info("Merged %s into %s", merger.summary_line(), os.path.join(merger.directory, MERGED_XML))
+            stop_logcat(captures)
+            if cache:
+                cache.flush()
+            if history:
+                try:
+                    history.finish_run(run_id, rc)
+                except sqlite3.Error as e:
+                    logging.debug("Could not finish run %s: %s", run_id, e)
+        return rc
+    finally:
+        # run_plan deletes them too, but is never reached when leasing or staging fails
+        remove_argument_files(cmd for group in plan for cmd in group)
+        if lease:
+            lease.release()
+
+def print_history(history: HistoryStore, sttls: Sequence[str]) -> None:
+    p95 = history.duration_percentile(95.0, sttls)
+    for sid in sttls:
+        last = history.last_status(sid)
+        if not last:
+            print(f"  {color(sid, BOLD)}  {color('no history', DIM)}")
+            continue
+        when = time.strftime('%Y-%m-%d %H:%M', time.localtime(last.finished))
+        st_color = GREEN if last.status == 'PASS' else RED if last.status == 'FAIL' else YELLOW
+        print(f"  {color(sid, BOLD)}  {color(last.status, st_color)}  {last.duration:.1f}s on {last.dut} at {when}"
+              f"  (p95 {p95.get(sid, last.duration):.1f}s)")
+
+def print_history_stats(history: HistoryStore, pct: float = 95.0) -> None:
+    stats = history.duration_percentile(pct)
+    if not stats:
+        print(color('No test durations recorded yet.', DIM))
+        return
+    print(color(f'p{pct:g} duration per test ({len(stats)} tests):', CYAN))
+    for sid, dur in sorted(stats.items(), key=lambda kv: kv[1], reverse=True):
+        print(f"  {color(sid, BOLD)}  {dur:.1f}s")
+
+# ---------------- Result Cache ----------------
+
+class ResultCache:
+    """Passed tests keyed on (STTL id, device build fingerprint, suite file hash).
+    SQLite in WAL mode with a busy timeout, so concurrent ZyButler processes can share it.
+    Passes older than max_age days are ignored; each write evicts those and everything beyond
+    the newest max_entries."""
+
+    def __init__(self, path: str = RESULT_CACHE_DB, max_age: float = CACHE_MAX_AGE_DAYS,
+                 max_entries: int = CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_age = max_age
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS passes (
+                    sttl TEXT NOT NULL, build TEXT NOT NULL, file_hash TEXT NOT NULL, passed REAL NOT NULL,
+                    PRIMARY KEY (sttl, build, file_hash));
+                CREATE INDEX IF NOT EXISTS idx_passes_passed ON passes(passed);
+            """)
+
+    def _cutoff(self) -> float:
+        return time.time() - self.max_age * 86400
+
+    def passed(self, keys: Sequence[Tuple[str, str, str]]) -> set:
+        """The keys with a pass recorded within max_age."""
+        cutoff = self._cutoff()
+        wanted = set(keys)
+        ids = sorted({sttl for sttl, _, _ in wanted})
+        found: set = set()
+        with self._lock:
+            for i in range(0, len(ids), HISTORY_QUERY_BATCH):
+                batch = ids[i:i + HISTORY_QUERY_BATCH]
+                rows = self._conn.execute("SELECT sttl, build, file_hash FROM passes WHERE sttl IN "
+                                          f"({','.join('?' * len(batch))}) AND passed >= ?", batch + [cutoff])
+                found.update(row for row in rows if row in wanted)
+        return found
+
+    def update(self, passed: Sequence[Tuple[str, str, str]], failed: Sequence[Tuple[str, str, str]] = ()) -> None:
+        """Record passes, drop keys that failed since, then evict old and excess entries."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO passes (sttl, build, file_hash, passed) VALUES (?, ?, ?, ?)",
+                                   [key + (now,) for key in passed])
+            self._conn.executemany("DELETE FROM passes WHERE sttl = ? AND build = ? AND file_hash = ?", list(failed))
+            self._conn.execute("DELETE FROM passes WHERE passed < ?", (self._cutoff(),))
+            self._conn.execute("DELETE FROM passes WHERE rowid IN (SELECT rowid FROM passes ORDER BY passed DESC "
+                               "LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+def device_fingerprint(serial: str, timeout: float = ADB_STATE_TIMEOUT) -> Optional[str]:
+    """ro.build.fingerprint of a DUT via adb, or None if it cannot be read."""
+    try:
+        out = subprocess.run([ADB_EXECUTABLE, "-s", serial, "shell", "getprop", "ro.build.fingerprint"],
+                             capture_output=True, text=True, errors='replace', timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logging.debug("Build fingerprint of %s unavailable: %s", serial, e)
+        return None
+    fingerprint = out.stdout.strip()
+    return fingerprint if out.returncode == 0 and fingerprint else None
+
+def device_fingerprints(serials: Sequence[str]) -> Dict[str, Optional[str]]:
+    """Build fingerprints of several DUTs, queried concurrently."""
+    if not serials:
+        return {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(serials)) as pool:
+        return dict(zip(serials, pool.map(device_fingerprint, serials)))
+
+def test_file_hashes(sttls: Sequence[str], path: str, cwd: Optional[str] = None) -> Dict[str, str]:
+    """Hash of the suite file(s) each STTL id selects, via the STTL index of path (relative to cwd).
+    IDs that are not indexed are left out (and therefore never skipped)."""
+    root = path if os.path.isabs(path) else os.path.join(cwd or EXECUTION_DIR, path)
+    if not os.path.isdir(root):
+        logging.warning("Result cache skipped; test path not found: %s", root)
+        return {}
+    index = get_sttl_index(path, cwd)
+    files = {sid: sorted({rel for rel, _ in index.lookup(sid)}) for sid in sttls}
+    digests = index.hash_files(sorted({rel for rels in files.values() for rel in rels}))
+    hashes: Dict[str, str] = {}
+    for sid, rels in files.items():
+        if rels and all(rel in digests for rel in rels):
+            combined = hashlib.sha256()
+            for rel in rels:
+                combined.update(f"{rel.replace(os.sep, '/')}\0{digests[rel]}\0".encode())
+            hashes[sid] = combined.hexdigest()
+    return hashes
+
+@dataclass
+class CacheContext:
+    """Result cache keys for one run. A sharded (--parallel) run keys each result on the build of
+    the DUT it ran on, and a test is skipped only if it passed on every build among the DUTs;
+    otherwise the key is the builds of all DUTs of the command together."""
+    cache: ResultCache
+    duts: List[str]  # DUT serials in DUTn order
+    fingerprints: Dict[str, Optional[str]]
+    hashes: Dict[str, str]
+    sharded: bool = False
+    results: Dict[Tuple[str, str, str], bool] = field(default_factory=dict)  # key -> passed, until flush()
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def builds(self, serial: Optional[str] = None) -> List[str]:
+        """Build keys a result on serial is stored under (all distinct builds when serial is None)."""
+        if self.sharded:
+            serials = self.duts if serial is None else [serial]
+            if any(not self.fingerprints.get(s) for s in serials):
+                return []
+            return sorted({self.fingerprints[s] for s in serials})
+        if any(not self.fingerprints.get(s) for s in self.duts):
+            return []
+        return [' + '.join(self.fingerprints[s] for s in self.duts)]
+
+    def keys(self, sttl: str, serial: Optional[str] = None) -> List[Tuple[str, str, str]]:
+        file_hash = self.hashes.get(sttl.upper())
+        return [(sttl.upper(), build, file_hash) for build in self.builds(serial)] if file_hash else []
+
+    def record(self, result: TestResult) -> None:
+        if result.status not in ('PASS', 'FAIL'):
+            return
+        with self.lock:
+            for key in self.keys(result.sttl, result.dut if self.sharded else None):
+                self.results[key] = result.status == 'PASS'
+
+    def flush(self) -> None:
+        with self.lock:
+            results, self.results = self.results, {}
+        if not results:
+            return
+        try:
+            self.cache.update([k for k, ok in results.items() if ok], [k for k, ok in results.items() if not ok])
+        except sqlite3.Error as e:
+            logging.warning("Could not update the result cache %s: %s", self.cache.path, e)
+
+def apply_result_cache(command: ZybotCommand, parallel: bool = False,
+                       options: Optional[RunOptions] = None) -> Tuple[ZybotCommand, Optional[CacheContext]]:
+    """Drop the STTL ids whose (test, build, suite file hash) already passed; return the reduced
+    command and the context that records this run's results (None when nothing can be cached)."""
+    options = options or RunOptions()
+    if not command.path:
+        logging.warning("--skip-cached needs --path to hash the test files; running all tests")
+        return command, None
+    try:
+        cache = ResultCache(max_age=options.cache_max_age)
+    except (OSError, sqlite3.Error) as e:
+        logging.warning("Result cache unavailable (%s): %s", RESULT_CACHE_DB, e)
+        return command, None
+    duts = [v for _, v in sorted((int(m.group(1)), v) for k, v in command.vars for m in [DUT_KEY_PATTERN.match(k)] if m)]
+    with TRACER.span("fingerprint", duts=len(duts)):
+        fingerprints = device_fingerprints(duts)
+    unknown = [s for s in duts if not fingerprints.get(s)]
+    if unknown:
+        logging.warning("No build fingerprint for %s; their results are not cached", ', '.join(unknown))
+    with TRACER.span("hash_tests", ids=len(command.sttls)):
+        hashes = test_file_hashes(command.sttls, command.path, options.exec_dir)
+    ctx = CacheContext(cache, duts, fingerprints, hashes, sharded=parallel and len(duts) > 1)
+    wanted = {sid: ctx.keys(sid) for sid in command.sttls}
+    try:
+        hits = cache.passed([key for keys in wanted.values() for key in keys])
+    except sqlite3.Error as e:
+        logging.warning("Result cache lookup failed: %s", e)
+        return command, ctx
+    skipped = [sid for sid, keys in wanted.items() if keys and all(key in hits for key in keys)]
+    if skipped:
+        logging.info("Skipping %d of %d test(s) that already passed on this build with unchanged suite files: %s",
+                     len(skipped), len(command.sttls), ', '.join(skipped[:20]) + (' ...' if len(skipped) > 20 else ''))
+    return replace(command, sttls=[sid for sid in command.sttls if sid not in set(skipped)]), ctx
+
+# ---------------- Retries ----------------
+
+@dataclass
+class RetryPolicy:
+    """Which failed STTL tests are re-run, how often and after what delay.
+    max_attempts counts the first run (1 = no retries). Without exit_codes or messages every
+    failed test is retried; otherwise only tests whose zybot run ended with one of exit_codes
+    or whose failure message matches one of messages. Tests that produced no result are
+    retried only when their zybot run ended with an execution error, not a failed-test count."""
+    max_attempts: int = 1
+    backoff: float = RETRY_BACKOFF
+    backoff_factor: float = RETRY_BACKOFF_FACTOR
+    exit_codes: Tuple[int, ...] = ()
+    messages: Tuple[re.Pattern, ...] = ()
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait before an attempt (2 = first retry)."""
+        return self.backoff * self.backoff_factor ** max(attempt - 2, 0)
+
+    def should_retry(self, returncode: int, message: Optional[str] = None) -> bool:
+        if not self.exit_codes and not self.messages:
+            return True
+        if returncode in self.exit_codes:
+            return True
+        return message is not None and any(p.search(message) for p in self.messages)
+
+RETRY_POLICY = RetryPolicy(max_attempts=1 + int(os.environ.get("ZYBUTLER_RETRIES") or 0))  # default of RunOptions.retry
+
+def plan_retry(command: ZybotCommand, plan: Sequence[Sequence[ZybotCommand]], failed: Dict[str, str],
+               attempt: int, unhealthy: Optional["UnhealthyDuts"] = None) -> ExecutionPlan:
+    """Execution plan re-running only the failed STTL IDs of command ({id: DUT serial it failed on}).
+    Results go to <job output dir>/retry<attempt>. In a sharded plan each test moves to the next
+    healthy DUT (not in unhealthy) after the one it failed on, so a flake tied to one phone gets
+    another phone."""
+    unhealthy = unhealthy or UnhealthyDuts()
+    base_flags, out_base = split_outputdir(command.flags)
+    out = os.path.join(getattr(plan, 'output_dir', None) or out_base, f"retry{attempt}")
+    retry = replace(command, sttls=[sid for sid in command.sttls if sid in failed], argument_file=None,
+                    flags=base_flags + ["--outputdir", out])
+    new = ExecutionPlan()
+    new.job_id, new.output_dir = getattr(plan, 'job_id', None), getattr(plan, 'output_dir', None)
+    serials = [v for _, v in sorted((int(m.group(1)), v) for k, v in command.vars for m in [DUT_KEY_PATTERN.match(k)] if m)]
+    if not getattr(plan, 'parallel', False) or len(serials) < 2:
+        new.append(chunk_command(retry, "argfile"))
+        return new
+    new.parallel = True
+    buckets: Dict[str, List[str]] = {s: [] for s in serials if s not in unhealthy} or {s: [] for s in serials}
+    for sid in retry.sttls:
+        start = serials.index(failed[sid]) if failed[sid] in serials else -1
+        ring = [serials[(start + k) % len(serials)] for k in range(1, len(serials) + 1)]
+        buckets[next(s for s in ring if s in buckets)].append(sid)
+    others = [(k, v) for k, v in command.vars if not DUT_KEY_PATTERN.match(k)]
+    for serial, sttls in buckets.items():
+        if sttls:
+            new.append(chunk_command(ZybotCommand(
+                vars=[("DUT1", serial)] + others, sttls=sttls, path=command.path,
+                flags=base_flags + ["--outputdir", os.path.join(out, serial)], sources=command.sources), "argfile"))
+    return new
+
+def run_with_retries(command: ZybotCommand, plan: Sequence[Sequence[ZybotCommand]], on_line: Callable[[str], None],
+                     policy: Optional[RetryPolicy] = None,
+                     record: Optional[Callable[[TestResult, int], None]] = None, **kwargs) -> int:
+    """Run a plan, then re-run the failed STTL IDs selected by the retry policy (default
+    RETRY_POLICY) until they pass or the attempts are used up. record(result, attempt) gets every
+    test result of every attempt. The exit code covers failures that were not retried plus
+    those still failing in the last attempt."""
+    policy = policy or RETRY_POLICY
+    stop_event = kwargs.get('stop_event') or threading.Event()
+    kwargs['stop_event'] = stop_event
+    unhealthy = kwargs.get('unhealthy') or UnhealthyDuts()  # DUTs broken in one attempt are avoided by the next
+    kwargs['unhealthy'] = unhealthy
+    notify_exit: Optional[Callable[[ZybotCommand, int], None]] = kwargs.pop('on_exit', None)
+    kept: List[int] = []  # exit codes of earlier attempts without the failures that were retried
+    attempt = 1
+    while True:
+        results: Dict[str, TestResult] = {}
+        exits: List[Tuple[ZybotCommand, int]] = []
+        lock = threading.Lock()
+        def on_result(result: TestResult, attempt: int = attempt) -> None:
+            with lock:
+                results[result.sttl] = result
+            if record:
+                record(result, attempt)
+        def on_exit(cmd: ZybotCommand, rc: int) -> None:
+            with lock:
+                exits.append((cmd, rc))
+            if notify_exit:
+                notify_exit(cmd, rc)
+        with TRACER.span("attempt", attempt=attempt, tests=sum(len(c.sttls) for g in plan for c in g)):
+            rc = run_plan(plan, on_line, on_result=on_result, on_exit=on_exit, **kwargs)
+        if rc == 0 or attempt >= policy.max_attempts or stop_event.is_set():
+            break
+        failed: Dict[str, str] = {}
+        carried: List[int] = []
+        for cmd, code in exits:
+            picked = 0
+            for sid in cmd.sttls:
+                result = results.get(sid.upper())
+                if result is not None:
+                    retry = result.status == 'FAIL' and policy.should_retry(code, result.message)
+                else:
+                    retry = not 0 <= code <= MAX_FAILED_RC and policy.should_retry(code)
+                if retry:
+                    failed[sid] = result.dut if result else dut_serial(cmd)
+                    picked += 1
+            if 0 <= code <= MAX_FAILED_RC:
+                carried.append(max(code - picked, 0))
+            elif not picked:
+                carried.append(code)
+        if not failed:
+            break
+        attempt += 1
+        delay = policy.delay(attempt)
+        logging.warning("Retrying %d failed test(s), attempt %d/%d%s: %s", len(failed), attempt,
+                        policy.max_attempts, f" in {delay:g}s" if delay else "", ', '.join(failed))
+        if delay and stop_event.wait(delay):
+            break
+        kept.extend(carried)
+        plan = plan_retry(command, plan, failed, attempt, unhealthy)
+    return merge_return_codes(kept + [rc]) if kept else rc
+
+# ---------------- Run Options ----------------
+
+@dataclass
+class RunOptions:
+    """Settings of one run, from CLI flags or the environment (the module defaults below are
+    read when an instance is created). Handed to execute_plan and the job classes instead of
+    being set as module globals, so jobs running at once in one process never see each
+    other's settings."""
+    exec_dir: str = field(default_factory=lambda: EXECUTION_DIR)  # working directory of zybot
+    history: bool = field(default_factory=lambda: HISTORY_ENABLED)  # record the run (--no-history)
+    lease: bool = field(default_factory=lambda: LEASES_ENABLED)  # lease the DUTs (--no-lease)
+    lease_wait: float = 0.0  # seconds to wait for DUTs leased by another run (--lease-wait); 0 fails fast
+    timeout: Optional[float] = None  # wall-clock seconds allowed per zybot process (--timeout); None = no limit
+    idle_timeout: Optional[float] = None  # seconds without zybot output before it counts as hung (--idle-timeout)
+    retry: RetryPolicy = field(default_factory=lambda: RETRY_POLICY)  # --retries and --retry-*
+    preflight: str = field(default_factory=lambda: PREFLIGHT_MODE)  # --preflight
+    logcat_dir: Optional[str] = field(default_factory=lambda: LOGCAT_DIR)  # --logcat; None = no capture
+    progress: bool = field(default_factory=lambda: PROGRESS_ENABLED)  # progress bar / ETA (--no-progress)
+    cache_max_age: float = CACHE_MAX_AGE_DAYS  # --cache-max-age
+
+# ---------------- Process Helpers ----------------
+
+@dataclass
+class Watchdog:
+    """Wall-clock and output-idle limits for one zybot process.
+    expired names the limit that fired ('timeout' or 'idle') once the process was killed."""
+    timeout: Optional[float] = None
+    idle_timeout: Optional[float] = None
+    expired: Optional[str] = None
+    started: float = 0.0
+    last_output: float = 0.0
+
+    @property
+    def active(self) -> bool:
+        return bool(self.timeout or self.idle_timeout)
+
+    def start(self) -> None:
+        self.started = self.last_output = time.monotonic()
+
+    def feed(self) -> None:
+        self.last_output = time.monotonic()
+
+    def check(self) -> Optional[str]:
+        now = time.monotonic()
+        if self.timeout and now - self.started > self.timeout:
+            return 'timeout'
+        if self.idle_timeout and now - self.last_output > self.idle_timeout:
+            return 'idle'
+        return None
+
+def echo_line(line: str) -> None:
+    sys.stdout.write(line + '\n')
+    sys.stdout.flush()
+
+def zybot_launcher() -> List[str]:
+    """ZYBOT_EXECUTABLE split into argv tokens, with the program resolved on PATH (PATHEXT on Windows)."""
+    tokens = [t.strip('"') for t in shlex.split(ZYBOT_EXECUTABLE, posix=os.name != 'nt')] or ["zybot"]
+    tokens[0] = shutil.which(tokens[0]) or tokens[0]
+    return tokens
+
+def zybot_argv(command: ZybotCommand) -> List[str]:
+    """Argument vector for a command: no shell involved, so -t patterns need no quoting."""
+    return zybot_launcher() + command.build_args()[1:]
+
+def spawn_zybot(command: ZybotCommand, cwd: str) -> subprocess.Popen:
+    """Start zybot in cwd with stdout/stderr merged into one text pipe.
+    The working directory is passed to the child, never set process-wide, so concurrent jobs
+    are safe. On POSIX zybot gets its own session so kill_process_tree() can signal the group."""
+    kwargs = dict(cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                  text=True, errors='replace', bufsize=1)
+    if os.name != 'nt':
+        kwargs['start_new_session'] = True
+    return subprocess.Popen(zybot_argv(command), **kwargs)
+
+def kill_process_tree(proc: subprocess.Popen, grace: float = 5.0) -> None:
+    """Terminate a zybot process together with everything it spawned."""
+    if os.name == 'nt':
+        if proc.poll() is None:
+            subprocess.call(["taskkill", "/F", "/T", "/PID", str(proc.pid)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(proc.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            return
+        try:
+            proc.wait(timeout=grace)
+            return
+        except subprocess.TimeoutExpired:
+            continue
+
+def pump_output(proc: subprocess.Popen, on_line: Callable[[str], None], prefix: str = '') -> None:
+    for line in proc.stdout:
+        on_line(prefix + line.rstrip('\r\n'))
+    proc.stdout.close()
+
+def run_zybot_process(command: ZybotCommand, cwd: str, on_line: Callable[[str], None], prefix: str = '',
+                      on_spawn: Optional[Callable[[subprocess.Popen], None]] = None,
+                      on_result: Optional[Callable[[TestResult], None]] = None,
+                      watchdog: Optional[Watchdog] = None) -> int:
+    """Run one zybot invocation to completion, streaming its output through on_line.
+    With on_result, per-test results parsed from the output are reported as they appear.
+    With an active watchdog, the process tree is killed once a limit is exceeded and
+    watchdog.expired says which one."""
+    serial = dut_serial(command)
+    owner = threading.current_thread()
+    started = time.perf_counter()
+    try:
+        proc = spawn_zybot(command, cwd)
+    except OSError as e:
+        logging.error("Failed to execute in %s: %s", cwd, e)
+        return EXECUTION_ERROR_RC
+    TRACER.add("spawn", started, time.perf_counter() - started, "process", serial=serial)
+    if on_spawn:
+        on_spawn(proc)
+    sink = on_line
+    first_output: List[float] = []
+    if on_result or TRACER.enabled:
+        parser = ResultParser(serial)
+        def sink(line: str) -> None:
+            if not first_output:
+                first_output.append(time.perf_counter() - started)
+            result = parser.feed(line[len(prefix):])
+            if result:
+                if on_result:
+                    on_result(result)
+                TRACER.add(result.sttl, time.perf_counter() - result.duration, result.duration, "test",
+                           owner, status=result.status, serial=serial)
+            on_line(line)
+    watching = watchdog is not None and watchdog.active
+    if watching:
+        forward = sink
+        def sink(line: str) -> None:
+            watchdog.feed()
+            forward(line)
+        watchdog.start()
+    pump = threading.Thread(target=pump_output, args=(proc, sink, prefix), daemon=True)
+    pump.start()
+    try:
+        while True:
+            try:
+                rc = proc.wait(timeout=WATCHDOG_POLL if watching else None)
+                break
+            except subprocess.TimeoutExpired:
+                expired = watchdog.check()
+            if expired:
+                if expired == 'idle':
+                    logging.error("zybot on %s printed nothing for %gs; killing it", serial, watchdog.idle_timeout)
+                else:
+                    logging.error("zybot on %s still running after %gs; killing it", serial, watchdog.timeout)
+                watchdog.expired = expired
+                kill_process_tree(proc)
+                rc = proc.wait()
+                break
+    except BaseException:
+        kill_process_tree(proc)
+        raise
+    # A daemon spawned by zybot (e.g. the adb server) may inherit the pipe; don't wait on it forever.
+    pump.join(timeout=2)
+    TRACER.add("zybot", started, time.perf_counter() - started, "process", serial=serial, pid=proc.pid, rc=rc,
+               tests=len(command.sttls), first_output_s=first_output[0] if first_output else None,
+               killed=watchdog.expired if watchdog else None)
+    return rc
+
+def requeue_command(command: ZybotCommand, sttls: Sequence[str], attempt: int) -> ZybotCommand:
+    """Copy of a hung command running only sttls, writing to <outputdir>/requeue<attempt>."""
+    base_flags, out_base = split_outputdir(command.flags)
+    return replace(command, sttls=list(sttls), argument_file=None,
+                   flags=base_flags + ["--outputdir", os.path.join(out_base, f"requeue{attempt}")])
+
+def run_plan(groups: Sequence[Sequence[ZybotCommand]], on_line: Callable[[str], None],
+             cwd: Optional[str] = None,
+             on_spawn: Optional[Callable[[subprocess.Popen], None]] = None,
+             stop_event: Optional[threading.Event] = None,
+             on_result: Optional[Callable[[TestResult], None]] = None,
+             timeout: Optional[float] = None, idle_timeout: Optional[float] = None,
+             on_exit: Optional[Callable[[ZybotCommand, int], None]] = None,
+             unhealthy: Optional["UnhealthyDuts"] = None) -> int:
+    """Run an execution plan, streaming output through on_line.
+    Each group runs on its own thread; commands inside a group run one after another.
+    When several commands run, each line is prefixed with the command's DUT1 serial.
+    on_exit receives every command with its exit code once it has ended.
+    With a timeout or idle_timeout (seconds; None = no limit) a hung zybot is killed,
+    its DUTs are checked with adb, and the STTL IDs it did not finish are re-queued (up to
+    MAX_REQUEUES times) onto the next group with a healthy DUT. A DUT that is no longer in
+    'device' state gets no further work; its pending commands are re-queued too. Broken DUTs
+    are recorded in unhealthy (default: a fresh UnhealthyDuts for this call).
+    Returns the merged exit code (see merge_return_codes)."""
+    cwd = cwd or EXECUTION_DIR
+    if not os.path.isdir(cwd):
+        logging.error("Execution directory missing: %s", cwd)
+        return EXECUTION_ERROR_RC
+    stop_event = stop_event or threading.Event()
+    unhealthy = unhealthy or UnhealthyDuts()
+    watch = bool(timeout or idle_timeout)
+    total = sum(len(g) for g in groups)
+    multi = total > 1
+    codes: List[int] = []
+    procs: List[subprocess.Popen] = []
+    argfiles: List[ZybotCommand] = []  # re-queued commands with their own argument file
+    lock = threading.Condition()  # also wakes idle groups when work is re-queued
+
+    def track(proc: subprocess.Popen) -> None:
+        with lock:
+            procs.append(proc)
+        if on_spawn:
+            on_spawn(proc)
+
+    pending = [collections.deque(g) for g in groups]
+    requeued: Deque[Tuple[ZybotCommand, int]] = collections.deque()  # (command, times re-queued)
+    running = [0]  # commands in flight; while any may hang, idle groups wait for re-queued work
+
+    def next_command(i: int) -> Optional[Tuple[ZybotCommand, int]]:
+        serial = dut_serial(groups[i][0])
+        with lock:
+            while True:
+                if stop_event.is_set():
+                    return None
+                if pending[i]:
+                    cmd, attempt, source = pending[i].popleft(), 0, None
+                elif requeued:
+                    (cmd, attempt), source = requeued.popleft(), 'requeue'
+                elif getattr(groups, 'steal', False) and any(pending):
+                    victim = max(range(len(pending)), key=lambda j: len(pending[j]))
+                    cmd, attempt, source = pending[victim].pop(), 0, 'steal'
+                elif watch and running[0]:
+                    lock.wait(WATCHDOG_POLL)
+                    continue
+                else:
+                    return None
+                running[0] += 1
+                break
+        if source == 'steal':
+            logging.info("%s idle; taking %s from %s", serial, ', '.join(cmd.sttls), dut_serial(cmd))
+            cmd = rebind_command(cmd, serial)
+        elif source == 'requeue':
+            logging.info("%s takes %d re-queued test(s) from %s", serial, len(cmd.sttls), dut_serial(cmd))
+            # The argument file is written after rebinding, so it names the new DUT
+            cmd = chunk_command(rebind_command(cmd, serial), "argfile")[0]
+            if cmd.argument_file:
+                with lock:
+                    argfiles.append(cmd)
+        return cmd, attempt
+
+    def retire(i: int) -> None:
+        """Stop scheduling on group i's DUT and hand its pending commands to healthy groups."""
+        with lock:
+            requeued.extend((cmd, 0) for cmd in pending[i])
+            pending[i].clear()
+            lock.notify_all()
+
+    def handle_hang(cmd: ZybotCommand, attempt: int, finished: Dict[str, str]) -> Tuple[int, Dict[str, str], List[str]]:
+        """Re-queue the unfinished tests of a killed command; return (its exit code, broken DUTs, re-queued IDs)."""
+        bad = unhealthy.check([v for k, v in cmd.vars if DUT_KEY_PATTERN.match(k)])
+        failed = sum(1 for status in finished.values() if status == 'FAIL')
+        left = [sid for sid in cmd.sttls if sid.upper() not in finished]
+        if left and attempt < MAX_REQUEUES:
+            logging.warning("Re-queueing %d unfinished test(s) of %s: %s", len(left), dut_serial(cmd), ', '.join(left))
+            with lock:
+                requeued.append((requeue_command(cmd, left, attempt + 1), attempt + 1))
+                lock.notify_all()
+            return min(failed, MAX_FAILED_RC), bad, left
+        if left:
+            logging.error("Giving up on %d test(s) after %d hung run(s): %s", len(left), attempt + 1, ', '.join(left))
+            failed += len(left)
+        return min(failed, MAX_FAILED_RC), bad, []
+
+    def run_group(i: int) -> None:
+        group = groups[i]
+        if watch and dut_serial(group[0]) in unhealthy:
+            bad = unhealthy.check([dut_serial(group[0])])
+            if bad:
+                retire(i)
+                return
+        idx = 0
+        while True:
+            task = next_command(i)
+            if task is None:
+                return
+            cmd, attempt = task
+            try:
+                idx += 1
+                serial = dut_serial(cmd)
+                cmd_str = cmd.display_command()
+                if not multi:
+                    logging.info("Executing: %s", cmd_str)
+                elif len(group) > 1:
+                    logging.info("Batch %d/%d on %s (%d test(s)): %s", idx, len(group), serial, len(cmd.sttls), cmd_str)
+                else:
+                    logging.info("Shard on %s (%d test(s)): %s", serial, len(cmd.sttls), cmd_str)
+                dog = Watchdog(timeout, idle_timeout)
+                finished: Dict[str, str] = {}
+                def report(result: TestResult) -> None:
+                    finished[result.sttl.upper()] = result.status
+                    if on_result:
+                        on_result(result)
+                rc = run_zybot_process(cmd, cwd, on_line, f"[{serial}] " if multi else '', track,
+                                       report if watch else on_result, dog)
+                bad: Dict[str, str] = {}
+                if dog.expired:
+                    rc, bad, moved = handle_hang(cmd, attempt, finished)
+                    if moved:  # reported by the command that runs them next
+                        cmd = replace(cmd, sttls=[sid for sid in cmd.sttls if sid not in moved])
+                with lock:
+                    codes.append(rc)
+                if on_exit:
+                    on_exit(cmd, rc)
+                if multi and not dog.expired:
+                    log = logging.info if rc == 0 else logging.error
+                    log("zybot on %s finished with code %s", serial, rc)
+                if bad:
+                    retire(i)
+                    return
+            finally:
+                with lock:
+                    running[0] -= 1
+                    lock.notify_all()
+
+    threads = [threading.Thread(target=run_group, args=(i,), name=f"zybot-{dut_serial(groups[i][0])}", daemon=True)
+               for i in range(len(groups))]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            while t.is_alive():
+                t.join(timeout=0.5)  # short joins keep Ctrl+C responsive on Windows
+    except KeyboardInterrupt:
+        stop_event.set()
+        for proc in list(procs):
+            kill_process_tree(proc)
+        raise
+    finally:
+        remove_argument_files(itertools.chain(argfiles, (cmd for group in groups for cmd in group)))
+    if requeued and not stop_event.is_set():
+        left = [sid for cmd, _ in requeued for sid in cmd.sttls]
+        logging.error("No healthy DUT left for %d test(s): %s", len(left), ', '.join(left))
+        codes.append(min(len(left), MAX_FAILED_RC))
+        if on_exit:
+            for cmd, _ in requeued:
+                on_exit(cmd, min(len(cmd.sttls), MAX_FAILED_RC))  # never ran; counted as failed above
+    return merge_return_codes(codes) if codes else 5
+
+# ---------------- Background Jobs ----------------
+
+class ZybotJob:
+    """Run a ZybotCommand on a background thread so a Tk main loop never blocks.
+    Output lines are queued; the GUI drains them periodically with after().
+    With use_index, suite files are resolved from the STTL index on that thread too."""
+
+    def __init__(self, command: ZybotCommand, parallel: bool = False, schedule: str = "lpt",
+                 options: Optional[RunOptions] = None, stage: Optional[List[Artifact]] = None, use_index: bool = False):
+        self.command = command
+        self.parallel = parallel
+        self.schedule = schedule
+        self.options = options or RunOptions()
+        self.stage = stage
+        self.use_index = use_index
+        self.output_dir: Optional[str] = None
+        self.progress: Optional[Progress] = None  # set once the plan is known
+        self.lines: "queue.Queue[str]" = queue.Queue()
+        self.returncode: Optional[int] = None
+        self._procs: List[subprocess.Popen] = []
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="zybot-job", daemon=True)
+
+    def start(self) -> "ZybotJob":
+        self._thread.start()
+        return self
+
+    @property
+    def running(self) -> bool:
+        return self._thread.is_alive()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped.is_set()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        for proc in list(self._procs):
+            kill_process_tree(proc)
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[int]:
+        self._thread.join(timeout)
+        return self.returncode
+
+    def drain(self, max_lines: int) -> Tuple[List[str], int]:
+        """Return (lines, dropped): everything queued so far, keeping only the newest max_lines."""
+        lines: List[str] = []
+        try:
+            while True:
+                lines.append(self.lines.get_nowait())
+        except queue.Empty:
+            pass
+        dropped = max(0, len(lines) - max_lines)
+        return lines[dropped:], dropped
+
+    def _register(self, proc: subprocess.Popen) -> None:
+        self._procs.append(proc)
+        if self._stopped.is_set():
+            kill_process_tree(proc)
+
+    def _run(self) -> None:
+        try:
+            if self.use_index and self.command.path and not self.command.sources:
+                sources = resolve_sources(self.command.sttls, self.command.path, self.options.exec_dir)
+                self.command = replace(self.command, sources=sources)
+            self.command = apply_preflight(self.command, self.parallel, self.options.preflight)
+            plan = plan_execution(self.command, parallel=self.parallel, schedule=self.schedule)
+            self.output_dir = plan.output_dir
+            self.lines.put(f"Results: {os.path.join(self.options.exec_dir, plan.output_dir)}")
+            self.progress = Progress(self.command.sttls, lanes=len(plan))
+            self.returncode = execute_plan(self.command, plan, self.lines.put, self.options, progress=self.progress,
+                                           on_spawn=self._register, stop_event=self._stopped, stage=self.stage)
+        except PreflightError as e:
+            self.lines.put(f"Not started: {e}")
+            self.returncode = PREFLIGHT_FAILED_RC
+        except LeaseError as e:
+            self.lines.put(f"Not started: {e}")
+            self.returncode = LEASE_BUSY_RC
+        except Exception as e:  # surface to the GUI instead of dying silently on the worker thread
+            self.lines.put(f"Execution error: {e}")
+            self.returncode = EXECUTION_ERROR_RC
+
+# ---------------- Job Manifests ----------------
+
+@dataclass
+class ManifestJob:
+    name: str
+    command: ZybotCommand
+    parallel: bool = False
+    returncode: Optional[int] = None
+    error: Optional[str] = None
+    busy: bool = False  # not started because a DUT was leased by another run
+    duration: float = 0.0
+    output_dir: Optional[str] = None
+    stage: Optional[List[Artifact]] = None  # staged on the job's DUTs before it runs (see --stage)
+
+    def serials(self) -> set:
+        return {v for k, v in self.command.vars if DUT_KEY_PATTERN.match(k)}
+
+    def status(self) -> str:
+        if self.returncode is None:
+            return 'NOT RUN'
+        if self.busy:
+            return 'BUSY'
+        if self.error:
+            return 'ERROR'
+        if self.returncode == STAGE_FAILED_RC:  # DUT_UNAVAILABLE_RC without an error: staging failed
+            return 'STAGE FAILED'
+        if self.returncode == 0:
+            return 'PASS'
+        return f'FAIL ({self.returncode})' if self.returncode <= MAX_FAILED_RC else f'ERROR ({self.returncode})'
+
+def _manifest_list(value, sep: Optional[str] = None) -> List[str]:
+    """Manifest field as a list of strings: lists are kept, strings split (CSV cells), dicts become KEY:VALUE."""
+    if value is None or value == '':
+        return []
+    if isinstance(value, dict):
+        return [f"{k}:{v}" for k, v in value.items()]
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value]
+    return [part.strip() for part in str(value).split(sep) if part.strip()]
+
+def _manifest_bool(value, default: bool) -> bool:
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+
+def _manifest_str(entry: dict, key: str) -> Optional[str]:
+    """Manifest field that must be a string (e.g. a path; YAML reads `path: 2024` as a number), or None."""
+    value = entry.get(key)
+    if value is None or value == '':
+        return None
+    if not isinstance(value, str):
+        raise ValidationError(f"{key} must be a string, got {type(value).__name__} {value!r}")
+    return value
+
+def read_manifest(path: str) -> List[dict]:
+    """Raw job entries of a .json, .yaml/.yml or .csv manifest."""
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, encoding='utf-8', newline='') as f:
+        try:
+            if ext == '.json':
+                data = json.load(f)
+            elif ext in ('.yaml', '.yml'):
+                if yaml is None:
+                    raise ParseError("YAML manifests need PyYAML (pip install pyyaml)")
+                data = yaml.safe_load(f)
+            elif ext == '.csv':
+                data = list(csv.DictReader(f))
+            else:
+                raise ParseError(f"Unknown manifest type '{ext}' (use .json, .yaml or .csv)")
+        except ParseError:
+            raise
+        except (ValueError, csv.Error) as e:  # JSONDecodeError is a ValueError
+            raise ParseError(f"{path}: {e}") from e
+        except Exception as e:
+            if yaml is not None and isinstance(e, yaml.YAMLError):
+                raise ParseError(f"{path}: {e}") from e
+            raise
+    if isinstance(data, dict):
+        data = data.get('jobs')
+    if not isinstance(data, list) or not all(isinstance(e, dict) for e in data):
+        raise ParseError(f"{path}: manifest must be a list of jobs (or an object with a 'jobs' list)")
+    return data
+
+def load_manifest(path: str, parallel: bool = False, extra_flags: Sequence[str] = (),
+                  stage: Optional[List[Artifact]] = None) -> List[ManifestJob]:
+    """
+    Load and validate every job of a manifest before anything runs.
+    Entry fields: name, vars (list / mapping / space-separated), sttl (STTL block), path,
+    flags (list or ';'-separated), parallel and stage (stage file, relative to the manifest;
+    default: the stage argument). Raises ValidationError listing all bad entries.
+    """
+    jobs: List[ManifestJob] = []
+    errors: List[str] = []
+    base_dir = os.path.dirname(os.path.abspath(path))
+    for i, entry in enumerate(read_manifest(path), 1):
+        name = str(entry.get('name') or f"job{i}")
+        try:
+            jobs.append(manifest_job(entry, name, base_dir, parallel, extra_flags, stage))
+        except (ParseError, ValidationError, OSError) as e:
+            errors.append(f"{name}: {e}")
+    if not jobs and not errors:
+        errors.append("no jobs")
+    if errors:
+        raise ValidationError(f"Invalid manifest {path}:\n  " + "\n  ".join(errors))
+    return jobs
+
+def manifest_job(entry: dict, name: str, base_dir: str = '.', parallel: bool = False, extra_flags: Sequence[str] = (),
+                 stage: Optional[List[Artifact]] = None) -> ManifestJob:
+    """One job from a manifest entry (also the JSON accepted by the daemon). Besides the fields
+    listed in load_manifest, sttl_file (export file(s)) may replace sttl. Files are relative to
+    base_dir. Raises ParseError / ValidationError for bad fields and OSError for unreadable files."""
+    vs = parse_vars(_manifest_list(entry.get('vars')))
+    flag_tokens = parse_flags(_manifest_list(entry.get('flags'), ';') + list(extra_flags))
+    if entry.get('sttl_file'):
+        sttls = read_sttl_ids([os.path.join(base_dir, f) for f in _manifest_list(entry['sttl_file'], ',')])
+        if not sttls:
+            raise ParseError("no STTL-<id> found in sttl_file")
+    else:
+        sttls = parse_sttl_block(str(entry.get('sttl') or entry.get('sttl_block') or ''))
+    if entry.get('stage'):
+        stage = load_stage(os.path.join(base_dir, str(entry['stage'])))
+    command = ZybotCommand(vars=vs, sttls=sttls, path=_manifest_str(entry, 'path'), flags=flag_tokens)
+    return ManifestJob(name=name, command=command, parallel=_manifest_bool(entry.get('parallel'), parallel), stage=stage)
+
+def run_manifest(jobs: Sequence[ManifestJob], workers: int = MANIFEST_WORKERS,
+                 on_line: Callable[[str], None] = echo_line, options: Optional[RunOptions] = None,
+                 chunk_mode: str = "auto", schedule: str = "lpt", steal_batch: int = 1,
+                 job_dir: bool = True) -> int:
+    """
+    Run manifest jobs on a pool of at most workers threads, in manifest order where possible,
+    all with the settings in options.
+    A job only starts when none of its DUTs is used by another running job, so jobs on
+    disjoint devices overlap and jobs sharing a device queue behind each other.
+    Returns 0 when every job passed, else the merged exit code (see merge_return_codes).
+    """
+    options = options or RunOptions()
+    pending = list(jobs)
+    busy: set = set()
+    running = 0
+    cond = threading.Condition()
+    stop_event = threading.Event()
+    procs: List[subprocess.Popen] = []
+
+    def run_job(job: ManifestJob) -> None:
+        nonlocal running
+        started = time.monotonic()
+        prefix = f"[{job.name}] "
+        try:
+            # job.command keeps all DUTs: they were reserved in busy and are released from it below
+            command = apply_preflight(job.command, job.parallel, options.preflight)
+            plan = plan_execution(command, parallel=job.parallel, chunk_mode=chunk_mode,
+                                  schedule=schedule, steal_batch=steal_batch, job_dir=job_dir)
+            job.output_dir = plan.output_dir
+            logging.info("Job %s started on %s", job.name, ' '.join(sorted(job.serials())))
+            job.returncode = execute_plan(command, plan, lambda line: on_line(prefix + line), options,
+                                          stage=job.stage, on_spawn=procs.append, stop_event=stop_event)
+        except PreflightError as e:
+            job.error, job.returncode = str(e), PREFLIGHT_FAILED_RC
+            logging.error("Job %s not started: %s", job.name, e)
+        except LeaseError as e:
+            job.error, job.returncode, job.busy = str(e), LEASE_BUSY_RC, True
+            logging.error("Job %s not started: %s", job.name, e)
+        except Exception as e:
+            job.error, job.returncode = str(e), EXECUTION_ERROR_RC
+            logging.error("Job %s failed: %s", job.name, e)
+        finally:
+            job.duration = time.monotonic() - started
+            with cond:
+                busy.difference_update(job.serials())
+                running -= 1
+                cond.notify_all()
+
+    threads: List[threading.Thread] = []
+    try:
+        with cond:
+            while pending:
+                job = None
+                if running < max(1, workers):
+                    job = next((j for j in pending if not (j.serials() & busy)), None)
+                if job is None:
+                    cond.wait(timeout=0.5)  # timed so Ctrl+C is handled promptly on Windows
+                    continue
+                pending.remove(job)
+                busy.update(job.serials())
+                running += 1
+                t = threading.Thread(target=run_job, args=(job,), name=f"job-{job.name}", daemon=True)
+                threads.append(t)
+                t.start()
+        for t in threads:
+            while t.is_alive():
+                t.join(timeout=0.5)  # short joins keep Ctrl+C responsive on Windows
+    except KeyboardInterrupt:
+        stop_event.set()
+        for proc in list(procs):
+            kill_process_tree(proc)
+        raise
+    codes = [job.returncode for job in jobs if job.returncode is not None]
+    if all(c == 0 for c in codes) and len(codes) == len(jobs):
+        return 0
+    return merge_return_codes(codes) or EXECUTION_ERROR_RC
+
+def print_manifest_summary(jobs: Sequence[ManifestJob]) -> None:
+    width = max(len(job.name) for job in jobs)
+    print(color(hr(), DIM))
+    print(color(f'Manifest summary ({len(jobs)} job(s)):', BOLD, CYAN))
+    for job in jobs:
+        status = job.status()
+        st_color = GREEN if status == 'PASS' else RED if status.startswith(('FAIL', 'ERROR')) else YELLOW
+        duts = ' '.join(sorted(job.serials()))
+        print(f"  {job.name.ljust(width)}  {color(status.ljust(10), BOLD, st_color)}  {len(job.command.sttls):>5} test(s)"
+              f"  {job.duration:7.1f}s  {duts}")
+        if job.error:
+            print(color(f"  {' ' * width}  {job.error}", DIM))
+    passed = sum(1 for job in jobs if job.status() == 'PASS')
+    print(color(f'{passed}/{len(jobs)} job(s) passed', BOLD, GREEN if passed == len(jobs) else RED))
+
+# ---------------- Device Discovery ----------------
+
+def parse_adb_devices(text: str) -> Dict[str, str]:
+    """Parse `serial<TAB>state` lines (adb devices / track-devices payload) into {serial: state}."""
+    devices: Dict[str, str] = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and not line.startswith(('List of devices', '*')):
+            devices[parts[0]] = parts[1]
+    return devices
+
+def device_state(serial: str, timeout: float = ADB_STATE_TIMEOUT) -> Optional[str]:
+    """State of one device from `adb -s SERIAL get-state`: 'device' when usable, otherwise e.g.
+    'offline', 'unauthorized', 'missing' (not attached) or 'unresponsive' (adb timed out).
+    None when adb itself cannot be run, i.e. the state is unknown."""
+    try:
+        out = subprocess.run([ADB_EXECUTABLE, "-s", serial, "get-state"], capture_output=True,
+                             text=True, errors='replace', timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return "unresponsive"
+    except OSError as e:
+        logging.debug("adb get-state %s failed: %s", serial, e)
+        return None
+    if out.returncode != 0:
+        return adb_error_state(out.stderr)
+    return out.stdout.strip() or None
+
+def adb_error_state(stderr: str) -> str:
+    """Device state implied by a failed `adb -s SERIAL ...` call."""
+    err = stderr.lower()
+    return next((state for state in ("offline", "unauthorized") if state in err), "missing")
+
+class UnhealthyDuts:
+    """DUTs found broken after a hang, {serial: adb state} until they recover. One instance
+    covers one execution: the run_plan calls of all its retry attempts share it, and the
+    group threads of run_plan update it concurrently."""
+
+    def __init__(self):
+        self._states: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, serial: str) -> bool:
+        with self._lock:
+            return serial in self._states
+
+    def check(self, serials: Sequence[str]) -> Dict[str, str]:
+        """Check DUTs with adb and return {serial: state} of the unusable ones; broken DUTs are
+        recorded, recovered ones forgotten. A DUT whose state cannot be read (adb missing) is
+        given the benefit of the doubt."""
+        bad: Dict[str, str] = {}
+        for serial in serials:
+            state = device_state(serial)
+            with self._lock:
+                if state in ("device", None):
+                    self._states.pop(serial, None)
+                    continue
+                bad[serial] = self._states[serial] = state
+            logging.error("DUT %s is %s; no further tests will run on it", serial, state)
+        return bad
+
+class DeviceTracker:
+    """In-memory view of adb devices fed by one long-lived `adb track-devices` stream.
+    adb is started on a background thread with a timeout, so callers never block on a cold
+    or wedged adb server. Listeners receive (event, serial, state) with event one of
+    'added', 'changed' or 'removed'; they are called on the tracker thread."""
+
+    def __init__(self, adb: Optional[str] = None, start_timeout: float = ADB_START_TIMEOUT):
+        self.adb = adb or ADB_EXECUTABLE
+        self.start_timeout = start_timeout
+        self._devices: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[str, str, Optional[str]], None]] = []
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._proc: Optional[subprocess.Popen] = None
+        self._thread = threading.Thread(target=self._run, name="adb-track-devices", daemon=True)
+
+    def start(self) -> "DeviceTracker":
+        if not self._thread.is_alive():
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        proc = self._proc
+        if proc and proc.poll() is None:
+            proc.kill()
+
+    def add_listener(self, listener: Callable[[str, str, Optional[str]], None]) -> None:
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[str, str, Optional[str]], None]) -> None:
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Block until the first device list arrived (or adb failed to start)."""
+        return self._ready.wait(timeout)
+
+    def snapshot(self) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._devices)
+
+    def state(self, serial: str) -> Optional[str]:
+        with self._lock:
+            return self._devices.get(serial)
+
+    def devices(self, state: str = "device") -> List[str]:
+        with self._lock:
+            return sorted(s for s, st in self._devices.items() if st == state)
+
+    def _apply(self, devices: Dict[str, str]) -> None:
+        events: List[Tuple[str, str, Optional[str]]] = []
+        with self._lock:
+            for serial, st in devices.items():
+                old = self._devices.get(serial)
+                if old is None:
+                    events.append(("added", serial, st))
+                elif old != st:
+                    events.append(("changed", serial, st))
+            for serial in self._devices.keys() - devices.keys():
+                events.append(("removed", serial, None))
+            self._devices = dict(devices)
+            listeners = list(self._listeners)
+        self._ready.set()
+        for event in events:
+            logging.debug("Device %s: %s (%s)", event[0], event[1], event[2])
+            for listener in listeners:
+                listener(*event)
+
+    def _read_stream(self, stream) -> None:
+        # track-devices emits <4 hex digit length><payload> for every change
+        while not self._stop.is_set():
+            header = stream.read(4)
+            if len(header) < 4:
+                return
+            length = int(header, 16)
+            payload = stream.read(length) if length else b''
+            self._apply(parse_adb_devices(payload.decode('utf-8', errors='replace')))
+
+    def _run(self) -> None:
+        delay = 1.0
+        while not self._stop.is_set():
+            try:
+                subprocess.run([self.adb, "start-server"], timeout=self.start_timeout,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                self._proc = subprocess.Popen([self.adb, "track-devices"],
+                                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+                delay = 1.0
+                self._read_stream(self._proc.stdout)
+            except (OSError, ValueError, subprocess.TimeoutExpired) as e:
+                logging.debug("adb device tracking unavailable: %s", e)
+            finally:
+                if self._proc and self._proc.poll() is None:
+                    self._proc.kill()
+                self._proc = None
+            # Stream ended (adb missing, killed or restarted): forget devices and reconnect
+            self._apply({})
+            self._stop.wait(delay)
+            delay = min(delay * 2, ADB_RETRY_MAX_DELAY)
+
+_device_tracker: Optional[DeviceTracker] = None
+_device_tracker_lock = threading.Lock()
+
+def get_device_tracker() -> DeviceTracker:
+    """Return the process-wide DeviceTracker, starting it on first use."""
+    global _device_tracker
+    with _device_tracker_lock:
+        if _device_tracker is None:
+            _device_tracker = DeviceTracker().start()
+        return _device_tracker
+
+def print_devices(tracker: DeviceTracker) -> None:
+    devices = tracker.snapshot()
+    if not devices:
+        print(color('No adb devices connected.', DIM))
+        return
+    leases = get_lease_manager()
+    for serial, st in sorted(devices.items()):
+        holder = leases.holder(serial) if leases else None
+        note = color(f"  leased by {describe_lease(holder)}", DIM) if holder else ''
+        print(f"  {color(serial, BOLD)}  {color(st, GREEN if st == 'device' else YELLOW)}{note}")
+
+def watch_devices(tracker: DeviceTracker) -> int:
+    """Print device add/remove events until interrupted."""
+    events: "queue.Queue[Tuple[str, str, Optional[str]]]" = queue.Queue()
+    tracker.wait_ready(ADB_START_TIMEOUT)
+    print(color('Connected devices (Ctrl+C to stop watching):', CYAN))
+    print_devices(tracker)
+    tracker.add_listener(lambda *ev: events.put(ev))
+    while True:
+        event, serial, st = events.get()
+        if event == 'removed':
+            print(color(f"- {serial} removed", YELLOW))
+        else:
+            print(color(f"+ {serial} {st}", GREEN if st == 'device' else YELLOW))
+
+# ---------------- Pre-flight Checks ----------------
+
+# One adb round trip per DUT; every line is key=value and missing values are not held against the DUT
+PREFLIGHT_SCRIPT = ("echo boot=$(getprop sys.boot_completed);"
+                    " echo battery=$(dumpsys battery | grep -m1 ' level:' | tr -dc 0-9);"
+                    " echo charging=$(dumpsys battery | grep -c -E 'powered: true');"
+                    " echo free_kb=$(df -k /data | tail -n 1 | awk '{print $4}');"
+                    " echo wake=$(dumpsys power | grep -m1 -o -E 'mWakefulness=[A-Za-z]+' | cut -d= -f2);"
+                    " echo locked=$(dumpsys window policy | grep -m1 -o -E"
+                    " '(mShowingLockscreen|isKeyguardShowing|mIsShowing)=(true|false)' | cut -d= -f2)")
+
+@dataclass
+class DeviceHealth:
+    serial: str
+    state: Optional[str]  # see device_state; None when adb itself cannot be run
+    problems: List[str] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)  # logged, but the DUT still counts as ready
+    battery: Optional[int] = None  # percent
+    free_mb: Optional[int] = None  # on /data
+    checked: float = 0.0  # time.monotonic() of the probe
+
+    @property
+    def ok(self) -> bool:
+        return not self.problems
+
+def parse_preflight(serial: str, text: str) -> DeviceHealth:
+    """DeviceHealth from the key=value output of PREFLIGHT_SCRIPT."""
+    values = dict(line.strip().partition('=')[::2] for line in text.splitlines() if '=' in line)
+    health = DeviceHealth(serial, "device", checked=time.monotonic())
+    if values.get('boot') not in (None, '', '1'):
+        health.problems.append("not finished booting")
+    if values.get('battery', '').isdigit():
+        health.battery = int(values['battery'])
+        if health.battery < PREFLIGHT_MIN_BATTERY and values.get('charging', '0') in ('', '0'):
+            health.problems.append(f"battery {health.battery}% and not charging")
+    if values.get('free_kb', '').isdigit():
+        health.free_mb = int(values['free_kb']) // 1024
+        if health.free_mb < PREFLIGHT_MIN_FREE_MB:
+            health.problems.append(f"only {health.free_mb} MB free on /data")
+    # Lab phones usually sit with the screen off; tests that need it on wake the DUT themselves
+    if values.get('wake') in ('Asleep', 'Dozing'):
+        health.warnings.append("screen off")
+    if values.get('locked') == 'true':
+        health.warnings.append("screen locked")
+    return health
+
+def probe_device(serial: str, timeout: float = PREFLIGHT_TIMEOUT) -> DeviceHealth:
+    """Check one DUT with a single `adb shell` call that must answer within timeout."""
+    now = time.monotonic()
+    try:
+        out = subprocess.run([ADB_EXECUTABLE, "-s", serial, "shell", PREFLIGHT_SCRIPT], capture_output=True,
+                             text=True, errors='replace', timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return DeviceHealth(serial, "unresponsive", [f"no answer within {timeout:g}s"], checked=now)
+    except OSError as e:
+        logging.debug("Pre-flight of %s skipped: %s", serial, e)
+        return DeviceHealth(serial, None, checked=now)
+    if out.returncode != 0:
+        state = adb_error_state(out.stderr)
+        return DeviceHealth(serial, state, [state], checked=now)
+    return parse_preflight(serial, out.stdout)
+
+_preflight_cache: Dict[str, DeviceHealth] = {}
+_preflight_lock = threading.Lock()  # guards _preflight_cache
+_preflight_server_started = False  # set once `adb start-server` succeeded
+
+def preflight(serials: Sequence[str], timeout: float = PREFLIGHT_TIMEOUT, ttl: float = PREFLIGHT_TTL) -> Dict[str, DeviceHealth]:
+    """Health of every DUT: probed concurrently, each within timeout, or reused when probed
+    less than ttl seconds ago."""
+    global _preflight_server_started
+    now = time.monotonic()
+    with _preflight_lock:
+        health = {s: _preflight_cache[s] for s in serials
+                  if s in _preflight_cache and now - _preflight_cache[s].checked < ttl}
+    todo = [s for s in dict.fromkeys(serials) if s not in health]
+    if not todo:
+        return health
+    if not _preflight_server_started:
+        # A cold adb server takes seconds to start; that must not count against the per-DUT timeout.
+        # Not under the lock: concurrent first callers may both run it, which adb handles.
+        try:
+            subprocess.run([ADB_EXECUTABLE, "start-server"], timeout=ADB_START_TIMEOUT,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            _preflight_server_started = True
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logging.debug("adb start-server failed: %s", e)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(todo)) as pool:
+        results = list(pool.map(lambda s: probe_device(s, timeout), todo))
+    with _preflight_lock:
+        for result in results:
+            health[result.serial] = _preflight_cache[result.serial] = result
+    return health
+
+def apply_preflight(command: ZybotCommand, parallel: bool = False, mode: Optional[str] = None) -> ZybotCommand:
+    """Probe the command's DUTs (see preflight) and handle failing ones according to mode
+    (default PREFLIGHT_MODE): 'report' only logs them; 'exclude' drops them from a parallel
+    run. Raises PreflightError when no DUT is left, or when a non-parallel run (which needs
+    all of its DUTs) has a failing one in 'exclude' mode."""
+    mode = mode or PREFLIGHT_MODE
+    serials = [v for k, v in command.vars if DUT_KEY_PATTERN.match(k)]
+    if mode == "off" or not serials:
+        return command
+    started = time.monotonic()
+    with TRACER.span("preflight", duts=len(serials)):
+        health = preflight(serials)
+    bad = {s: h for s, h in health.items() if not h.ok}
+    for serial, h in health.items():
+        if h.problems or h.warnings:
+            logging.warning("Pre-flight: DUT %s %s", serial, ', '.join(h.problems + h.warnings))
+    logging.info("Pre-flight: %d of %d DUT(s) ready (%.1fs)", len(serials) - len(bad), len(serials),
+                 time.monotonic() - started)
+    if not bad or mode == "report":
+        return command
+    if not parallel:
+        raise PreflightError(f"DUT(s) failed pre-flight: {', '.join(bad)}")
+    kept = [(k, v) for k, v in command.vars if not (DUT_KEY_PATTERN.match(k) and v in bad)]
+    if len(kept) == len(command.vars) - len(serials):
+        raise PreflightError("No DUT passed pre-flight")
+    logging.warning("Excluding %d DUT(s) that failed pre-flight: %s", len(bad), ', '.join(bad))
+    return replace(command, vars=kept)
+
+# ---------------- Artifact Staging ----------------
+
+@dataclass
+class Artifact:
+    kind: str  # 'install' (adb install -r) or 'push' (adb push)
+    src: str  # local file
+    dest: str = ''  # device path ('push')
+    package: Optional[str] = None  # 'install': package name, lets the installed APK be compared on the device
+    args: List[str] = field(default_factory=list)  # extra `adb install` options, e.g. ["-g"]
+    digest: str = ''  # sha256 of src, filled in by stage_artifacts
+
+    @property
+    def target(self) -> str:
+        """What the artifact occupies on a DUT; the per-serial cache is keyed on it."""
+        if self.kind == 'install':
+            return f"install:{self.package or os.path.basename(self.src)}"
+        return f"push:{self.dest}"
+
+def load_stage(path: str) -> List[Artifact]:
+    """
+    Artifacts of a .json or .yaml stage file:
+        {"install": ["apks/app.apk", {"apk": "apks/helper.apk", "package": "com.example.helper", "args": ["-g"]}],
+         "push": [{"src": "assets/media", "dest": "/sdcard/media"}]}
+    Local paths are relative to the stage file. A pushed directory becomes one artifact per file
+    under dest. Raises ParseError for malformed files and ValidationError listing missing sources.
+    """
+    is_yaml = path.lower().endswith(('.yaml', '.yml'))
+    if is_yaml and yaml is None:
+        raise ParseError("YAML stage files need PyYAML (pip install pyyaml)")
+    with open(path, encoding='utf-8') as f:
+        try:
+            data = yaml.safe_load(f) if is_yaml else json.load(f)
+        except ValueError as e:  # JSONDecodeError is a ValueError
+            raise ParseError(f"{path}: {e}") from e
+        except Exception as e:
+            if yaml is not None and isinstance(e, yaml.YAMLError):
+                raise ParseError(f"{path}: {e}") from e
+            raise
+    if not isinstance(data, dict):
+        raise ParseError(f"{path}: stage file must be an object with 'install' and/or 'push' lists")
+    base = os.path.dirname(os.path.abspath(path))
+    artifacts: List[Artifact] = []
+    errors: List[str] = []
+    for entry in data.get('install') or []:
+        spec = {'apk': entry} if isinstance(entry, str) else entry
+        if not isinstance(spec, dict) or not spec.get('apk'):
+            errors.append(f"install entry needs an 'apk': {entry!r}")
+            continue
+        src = os.path.join(base, str(spec['apk']))
+        if not os.path.isfile(src):
+            errors.append(f"APK not found: {src}")
+            continue
+        artifacts.append(Artifact('install', src, package=spec.get('package') or None,
+                                  args=_manifest_list(spec.get('args'))))
+    for entry in data.get('push') or []:
+        if not isinstance(entry, dict) or not entry.get('src') or not entry.get('dest'):
+            errors.append(f"push entry needs 'src' and 'dest': {entry!r}")
+            continue
+        src, dest = os.path.join(base, str(entry['src'])), str(entry['dest'])
+        if os.path.isdir(src):
+            for root, dirs, files in os.walk(src):
+                dirs.sort()
+                for name in sorted(files):
+                    rel = os.path.relpath(os.path.join(root, name), src).replace(os.sep, '/')
+                    artifacts.append(Artifact('push', os.path.join(root, name), dest=dest.rstrip('/') + '/' + rel))
+        elif os.path.isfile(src):
+            artifacts.append(Artifact('push', src, dest=dest))
+        else:
+            errors.append(f"push source not found: {src}")
+    if errors:
+        raise ValidationError(f"Invalid stage file {path}:\n  " + "\n  ".join(errors))
+    return artifacts
+
+class StageCache:
+    """Per-DUT record of staged artifacts (serial, target) -> (sha256, build fingerprint), plus
+    sha256 of local files keyed on path, size and mtime so unchanged APKs are not re-hashed.
+    SQLite in WAL mode, shared by concurrent ZyButler processes like the result cache."""
+
+    def __init__(self, path: str = STAGE_CACHE_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS staged (
+                    serial TEXT NOT NULL, target TEXT NOT NULL, digest TEXT NOT NULL, build TEXT NOT NULL,
+                    staged REAL NOT NULL, PRIMARY KEY (serial, target));
+                CREATE TABLE IF NOT EXISTS local_files (
+                    path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, digest TEXT NOT NULL);
+            """)
+
+    def staged(self, serial: str) -> Dict[str, Tuple[str, str]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT target, digest, build FROM staged WHERE serial = ?", (serial,))
+            return {target: (digest, build) for target, digest, build in rows}
+
+    def record(self, serial: str, target: str, digest: str, build: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO staged (serial, target, digest, build, staged) VALUES (?, ?, ?, ?, ?)",
+                               (serial, target, digest, build, time.time()))
+
+    def file_digest(self, path: str) -> str:
+        """sha256 of a local file, reused while its size and mtime are unchanged."""
+        st = os.stat(path)
+        with self._lock:
+            row = self._conn.execute("SELECT digest FROM local_files WHERE path = ? AND size = ? AND mtime_ns = ?",
+                                     (path, st.st_size, st.st_mtime_ns)).fetchone()
+        if row:
+            return row[0]
+        digest = file_sha256(path)
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO local_files (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)",
+                               (path, st.st_size, st.st_mtime_ns, digest))
+        return digest
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def device_digests(serial: str, artifacts: Sequence[Artifact]) -> Dict[str, str]:
+    """sha256 on the DUT of what each verifiable artifact occupies ({target: digest}): pushed
+    files, and installed APKs of 'install' artifacts that name their package. Missing ones are
+    left out. Uses one `pm list packages -f` call and batched `sha256sum` calls."""
+    paths = {a.dest: a.target for a in artifacts if a.kind == 'push'}
+    packages = {a.package: a.target for a in artifacts if a.kind == 'install' and a.package}
+    if packages:
+        out = subprocess.run([ADB_EXECUTABLE, "-s", serial, "shell", "pm list packages -f"], capture_output=True,
+                             text=True, errors='replace', timeout=ADB_STATE_TIMEOUT)
+        for line in out.stdout.splitlines():
+            apk, _, package = line.strip()[len('package:'):].rpartition('=')
+            if package in packages:
+                paths[apk] = packages[package]
+    digests: Dict[str, str] = {}
+    batch: List[str] = []
+    def flush() -> None:
+        out = subprocess.run([ADB_EXECUTABLE, "-s", serial, "shell", "sha256sum " + " ".join(batch)],
+                             capture_output=True, text=True, errors='replace', timeout=STAGE_TIMEOUT)
+        for line in out.stdout.splitlines():  # "<digest>  <path>"; missing files only print to stderr
+            digest, _, path = line.strip().partition(' ')
+            if path.strip() in paths:
+                digests[paths[path.strip()]] = digest
+        batch.clear()
+    for path in paths:
+        batch.append(shlex.quote(path))
+        if sum(len(p) + 1 for p in batch) >= STAGE_HASH_BATCH:
+            flush()
+    if batch:
+        flush()
+    return digests
+
+def stage_device(serial: str, artifacts: Sequence[Artifact], cache: Optional[StageCache]) -> List[str]:
+    """Install/push what is not already on one DUT; return the targets that failed."""
+    started = time.monotonic()
+    build = device_fingerprint(serial) or ''
+    try:
+        current = device_digests(serial, artifacts)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logging.warning("Cannot read staged artifacts on %s: %s", serial, e)
+        current = {}
+    staged = cache.staged(serial) if cache else {}
+    failed: List[str] = []
+    installed = pushed = 0
+    for a in artifacts:
+        verifiable = a.kind == 'push' or a.package
+        if current.get(a.target) == a.digest if verifiable else staged.get(a.target) == (a.digest, build):
+            continue
+        if a.kind == 'install':
+            argv = [ADB_EXECUTABLE, "-s", serial, "install", "-r"] + a.args + [a.src]
+        else:
+            argv = [ADB_EXECUTABLE, "-s", serial, "push", a.src, a.dest]
+        try:
+            out = subprocess.run(argv, capture_output=True, text=True, errors='replace', timeout=STAGE_TIMEOUT)
+            # Older adb versions exit 0 even when the install failed
+            ok = out.returncode == 0 and 'Failure' not in out.stdout
+            error = (out.stderr or out.stdout).strip().splitlines()[-1:] if not ok else []
+        except (OSError, subprocess.TimeoutExpired) as e:
+            ok, error = False, [str(e)]
+        if not ok:
+            logging.error("Staging %s on %s failed: %s", a.target, serial, error[0] if error else "unknown error")
+            failed.append(a.target)
+            continue
+        if a.kind == 'install':
+            installed += 1
+        else:
+            pushed += 1
+        if cache:
+            cache.record(serial, a.target, a.digest, build)
+    unchanged = len(artifacts) - installed - pushed - len(failed)
+    logging.info("Staged %s: %d installed, %d pushed, %d unchanged (%.1fs)", serial, installed, pushed, unchanged,
+                 time.monotonic() - started)
+    return failed
+
+def stage_artifacts(serials: Sequence[str], artifacts: Sequence[Artifact]) -> Dict[str, List[str]]:
+    """Stage artifacts on every DUT at once (each DUT's artifacts one after another); skip
+    what a DUT already has with the same content. Returns {serial: failed targets} of DUTs
+    where something failed."""
+    try:
+        cache: Optional[StageCache] = StageCache()
+    except sqlite3.Error as e:
+        logging.warning("Stage cache unavailable (%s); comparing on the devices only", e)
+        cache = None
+    try:
+        for a in artifacts:
+            a.digest = cache.file_digest(a.src) if cache else file_sha256(a.src)
+    except OSError as e:
+        logging.error("Cannot read artifact: %s", e)
+        return {serial: [a.target for a in artifacts] for serial in serials}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(serials)) as pool:
+        results = dict(zip(serials, pool.map(lambda s: stage_device(s, artifacts, cache), serials)))
+    return {serial: failed for serial, failed in results.items() if failed}
+
+# ---------------- Logcat Capture ----------------
+
+def device_clock(serial: str, timeout: float = ADB_STATE_TIMEOUT) -> Tuple[float, int]:
+    """(device clock minus host clock in seconds, device UTC offset in seconds) of a DUT.
+    Falls back to (0, host UTC offset) when the device date cannot be read."""
+    local = time.localtime().tm_gmtoff
+    try:
+        before = time.time()
+        out = subprocess.run([ADB_EXECUTABLE, "-s", serial, "shell", "date", "+%s.%N_%z"], capture_output=True,
+                             text=True, errors='replace', timeout=timeout)
+        after = time.time()
+        epoch, _, zone = out.stdout.strip().partition('_')
+        offset = float(epoch) - (before + after) / 2
+        sign = -1 if zone.startswith('-') else 1
+        return offset, sign * (int(zone[1:3]) * 3600 + int(zone[3:5]) * 60) if len(zone) == 5 else local
+    except (OSError, subprocess.TimeoutExpired, ValueError) as e:
+        logging.debug("Clock of %s unavailable: %s", serial, e)
+        return 0.0, local
+
+class LogcatCapture:
+    """`adb logcat -v threadtime` of one DUT streamed into rotating gzip files
+    <directory>/logcat-001.txt.gz, logcat-002.txt.gz, ... (LOGCAT_ROTATE_BYTES each, the newest
+    LOGCAT_KEEP_FILES kept). A reader thread copies the pipe in LOGCAT_READ_CHUNK blocks, so memory
+    stays bounded however verbose the device is, and zybot's output path is not involved.
+    mark() inserts a `ZyButler:` line between two complete logcat lines, stamped in the device's
+    clock like the threadtime entries around it."""
+
+    def __init__(self, serial: str, directory: str):
+        self.serial = serial
+        self.directory = directory
+        self.bytes = 0  # uncompressed bytes written
+        self.clock = (0.0, 0)  # see device_clock
+        self._proc: Optional[subprocess.Popen] = None
+        self._file = None
+        self._part = 0
+        self._written = 0  # uncompressed bytes in the current file
+        self._tail = b''  # incomplete last line of the previous read
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._pump, name=f"logcat-{serial}", daemon=True)
+
+    def start(self) -> "LogcatCapture":
+        """Start adb logcat (from the newest entry on); raises OSError if adb cannot be run."""
+        os.makedirs(self.directory, exist_ok=True)
+        self.clock = device_clock(self.serial)
+        kwargs = dict(stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if os.name != 'nt':
+            kwargs['start_new_session'] = True  # Ctrl+C stops zybot first; the capture ends in stop()
+        self._proc = subprocess.Popen([ADB_EXECUTABLE, "-s", self.serial, "logcat", "-v", "threadtime", "-T", "1"],
+                                      **kwargs)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._proc:
+            kill_process_tree(self._proc, grace=2.0)
+        self._thread.join(timeout=5)
+        with self._lock:
+            if self._tail:
+                self._write(self._tail + b'\n')
+                self._tail = b''
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def stamp(self, when: float) -> str:
+        """Host epoch time as a threadtime timestamp of the device, e.g. 03-14 09:26:53.589."""
+        offset, utc_offset = self.clock
+        device = when + offset + utc_offset
+        return time.strftime('%m-%d %H:%M:%S', time.gmtime(device)) + f".{int(device % 1 * 1000):03d}"
 
-_def_use_color = True
+    def mark(self, text: str, when: Optional[float] = None) -> None:
+        line = f"{self.stamp(time.time() if when is None else when)}     0     0 I ZyButler: {text}\n"
+        with self._lock:
+            self._write(line.encode())
 
-def supports_color() -> bool:
-    if os.environ.get('NO_COLOR'):
-        return False
-    # Require TTY unless FORCE_COLOR specified
-    if not sys.stdout.isatty() and not os.environ.get('FORCE_COLOR'):
-        return False
-    return True
+    def mark_result(self, result: TestResult, attempt: int = 1) -> None:
+        retry = f" (attempt {attempt})" if attempt > 1 else ''
+        self.mark(f"{result.sttl} {result.status}{retry} started {self.stamp(result.started)}, "
+                  f"ended {self.stamp(result.finished)}, {result.duration:.1f}s", result.finished)
 
-def color(txt: str, *codes: str) -> str:
-    if not _def_use_color:
-        return txt
-    return ''.join(codes) + txt + RESET
+    def _pump(self) -> None:
+        stream = self._proc.stdout
+        while True:
+            data = stream.read1(LOGCAT_READ_CHUNK)
+            if not data:
+                break
+            with self._lock:
+                data = self._tail + data
+                cut = data.rfind(b'\n') + 1
+                if not cut and len(data) < LOGCAT_READ_CHUNK:
+                    self._tail = data  # keep markers off half-written lines
+                    continue
+                cut = cut or len(data)
+                self._write(data[:cut])
+                self._tail = data[cut:]
+        stream.close()
 
-def hr(char: str = '-', width: int = 60) -> str:
-    return char * width
+    def _write(self, data: bytes) -> None:
+        try:
+            if self._file is None or self._written >= LOGCAT_ROTATE_BYTES:
+                self._rotate()
+            self._file.write(data)
+        except OSError as e:  # e.g. disk full: stop capturing, never fail the run
+            logging.warning("Logcat capture of %s stopped: %s", self.serial, e)
+            if self._proc:
+                self._proc.kill()
+            return
+        self._written += len(data)
+        self.bytes += len(data)
 
-def print_format_help():
-    print(color(hr(), CYAN))
-    for line in FORMAT_HELP.splitlines():
-        if line.strip():
-            print(color(line, CYAN))
-    print(color(hr(), CYAN))
+    def _rotate(self) -> None:
+        if self._file:
+            self._file.close()
+        self._part += 1
+        self._written = 0
+        self._file = gzip.open(os.path.join(self.directory, f"logcat-{self._part:03d}.txt.gz"), 'wb',
+                               compresslevel=LOGCAT_COMPRESSLEVEL)
+        expired = os.path.join(self.directory, f"logcat-{self._part - LOGCAT_KEEP_FILES:03d}.txt.gz")
+        if self._part > LOGCAT_KEEP_FILES and os.path.exists(expired):
+            os.remove(expired)
 
-# ---------------- Exceptions ----------------
+def logcat_directory(output_dir: Optional[str], options: RunOptions) -> str:
+    """Where a run's logcat goes: <logcat_dir>/<timestamp>, or <results dir>/logcat when options.logcat_dir is ""."""
+    if options.logcat_dir:
+        return os.path.join(options.logcat_dir, datetime.now().strftime('%Y%m%d-%H%M%S-%f'))
+    return os.path.join(options.exec_dir, output_dir or '', "logcat")
 
-class ParseError(ValueError):
-    pass
+def start_logcat(serials: Sequence[str], directory: str) -> Dict[str, LogcatCapture]:
+    """Start one LogcatCapture per DUT (in <directory>/<serial>), concurrently.
+    DUTs whose capture cannot be started are logged and left out."""
+    def start(serial: str) -> Optional[LogcatCapture]:
+        capture = LogcatCapture(serial, os.path.join(directory, serial))
+        try:
+            capture.start()
+        except OSError as e:
+            logging.warning("Cannot capture logcat of %s: %s", serial, e)
+            return None
+        capture.mark("run started")
+        return capture
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(serials)) as pool:
+        captures = {c.serial: c for c in pool.map(start, serials) if c}
+    if captures:
+        logging.info("Capturing logcat of %d DUT(s) in %s", len(captures), directory)
+    return captures
 
-class ValidationError(ValueError):
-    pass
+def stop_logcat(captures: Dict[str, LogcatCapture]) -> None:
+    for capture in captures.values():
+        capture.mark("run finished")
+        capture.stop()
+        logging.info("Logcat of %s: %.1f MB in %s", capture.serial, capture.bytes / 1e6, capture.directory)
 
+# ---------------- Daemon ----------------
 
-# ---------------- Dataclass ----------------
+class OutputBuffer:
+    """The newest lines of a job's output, numbered from the first line ever put."""
 
-@dataclass
-class ZybotCommand:
-    vars: List[Tuple[str, str]]
-    sttls: List[str]
-    path: Optional[str] = None
-    flags: List[str] = None  # raw additional flags (each element is one argument token)
+    def __init__(self, maxlen: int = DAEMON_OUTPUT_LINES):
+        self._lines: Deque[str] = collections.deque(maxlen=maxlen)
+        self.total = 0
+        self._lock = threading.Lock()
 
-    def build_args(self) -> List[str]:
-        args: List[str] = ["zybot"]
-        if self.flags:
-            args.extend(self.flags)
-        for k, v in self.vars:
-            args.extend(["-v", f"{k}:{v}"])
-        for sid in self.sttls:
-            args.extend(["-t", f"{sid}*"])  # raw arg; quoting added for display only
-        if self.path:
-            args.append(self.path)
-        return args
+    def put(self, line: str) -> None:
+        with self._lock:
+            self._lines.append(line)
+            self.total += 1
 
-    def display_command(self) -> str:
-        raw = self.build_args()
-        disp: List[str] = []
-        i = 0
-        while i < len(raw):
-            token = raw[i]
-            disp.append(token)
-            if token == "-t" and i + 1 < len(raw):
-                pattern = raw[i + 1]
-                disp.append(f'"{pattern}"')
-                i += 2
-                continue
-            i += 1
-        return " ".join(disp)
+    def since(self, n: int) -> Tuple[List[str], int, int]:
+        """(lines from number n on, number of the next line, lines between n and the oldest kept)."""
+        with self._lock:
+            first = self.total - len(self._lines)
+            start = max(n, first)
+            return list(itertools.islice(self._lines, start - first, None)), self.total, start - n if n < first else 0
 
-    def pretty(self) -> str:
-        lines: List[str] = []
-        lines.append(color('=== Zybot Command Summary ===', CYAN))
-        lines.append(color(f'Script Execution Directory:', BOLD, GREEN))
-        lines.append(color(EXECUTION_DIR, BOLD))
-        if self.flags:
-            lines.append(color('Flags:', BOLD, GREEN))
-            lines.append(color('  ' + ' '.join(self.flags), BOLD))
-        else:
-            lines.append(color('Flags: (none)', DIM))
-        if self.vars:
-            lines.append(color('Variables:', BOLD, GREEN))
-            for k, v in self.vars:
-                lines.append(f'  {color(k, BOLD)}: {v}')
-        else:
-            lines.append(color('Variables: (none)', DIM))
-        if self.sttls:
-            lines.append(color(f'STTL IDs ({len(self.sttls)}):', BOLD, GREEN))
-            for sid in self.sttls[:25]:
-                lines.append(color(f'  {sid}', BOLD))
-            if len(self.sttls) > 25:
-                lines.append(color(f'  ... ({len(self.sttls) - 25} more)', BOLD))
-        else:
-            lines.append(color('STTL IDs: (none)', DIM))
-        if self.path:
-            lines.append(color(f'Test Script Path: {self.path}', BOLD, GREEN))
-            lines.append(color(self.path, BOLD))
-        else:
-            lines.append(color('Path: (none)', DIM))
+class DaemonJob(ZybotJob):
+    """A ZybotJob submitted to the daemon: queued until its DUTs are free, output kept in an OutputBuffer."""
 
-        lines.append(color('Full Command:', BOLD, GREEN))
-        cmd = self.display_command()
-        lines.append(color(f'  {cmd}', BOLD))
-        lines.append(color(hr(), DIM))
-        return '\n'.join(lines)
+    def __init__(self, job_id: int, job: ManifestJob, schedule: str = "lpt", options: Optional[RunOptions] = None,
+                 on_done: Optional[Callable[["DaemonJob"], None]] = None):
+        super().__init__(job.command, parallel=job.parallel, schedule=schedule, options=options, stage=job.stage)
+        self.id = job_id
+        self.name = job.name
+        self.serials = job.serials()
+        self.lines = OutputBuffer()  # type: ignore[assignment]
+        self.submitted = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.cancelled = False
+        self._on_done = on_done
 
-# ---------------- Parsing Helpers ----------------
+    def status(self) -> str:
+        if self.cancelled:
+            return 'cancelled'
+        if self.started is None:
+            return 'queued'
+        if self.finished is None:
+            return 'running'
+        if self.stopped:
+            return 'stopped'
+        rc = self.returncode
+        return 'passed' if rc == 0 else 'failed' if rc is not None and 0 < rc <= MAX_FAILED_RC else 'error'
 
-def parse_sttl_block(raw: str) -> List[str]:
-    raw = raw.strip()
-    m = STTL_BLOCK_PATTERN.match(raw)
-    if not m:
-        raise ParseError("STTL block must match id:(STTL/STTL-<id> ...)")
-    body = m.group(1).strip()
-    if not body:
-        raise ParseError("STTL block empty")
-    tokens = body.split()
-    seen = set()
-    ordered: List[str] = []
-    for tok in tokens:
-        tm = TOKEN_PATTERN.match(tok)
-        if not tm:
-            raise ParseError(f"Malformed STTL token: {tok}")
-        sid = f"STTL-{tm.group(1)}"
-        if sid in seen:
-            continue
-        seen.add(sid)
-        ordered.append(sid)
-    if not ordered:
-        raise ParseError("No valid STTL tokens parsed")
-    return ordered
+    def to_dict(self) -> dict:
+        info = {"id": self.id, "name": self.name, "status": self.status(), "returncode": self.returncode,
+                "command": self.command.display_command(), "duts": sorted(self.serials), "parallel": self.parallel,
+                "tests": len(self.command.sttls), "output_dir": self.output_dir, "submitted": self.submitted,
+                "started": self.started, "finished": self.finished, "output_lines": self.lines.total}
+        if self.progress:
+            info["progress"] = {"done": self.progress.done, "total": self.progress.total,
+                                "counts": dict(self.progress.counts), "eta": self.progress.eta(),
+                                "summary": self.progress.summary(width=0)}
+        return info
 
-def normalize_key(key: str) -> str:
-    return key.upper()
+    def start(self) -> "DaemonJob":
+        self.started = time.time()
+        super().start()
+        return self
 
-def parse_vars(raw_tokens: Sequence[str], allow_empty: bool = False) -> List[Tuple[str, str]]:
-    if not raw_tokens:
-        if allow_empty:
-            return []
-        raise ValidationError("No variables provided")
-    pairs: List[Tuple[str, str]] = []
-    for kv in raw_tokens:
-        if not VAR_PAIR_PATTERN.match(kv):
-            raise ValidationError(f"Invalid KEY:VALUE format: {kv}")
-        key, value = kv.split(":", 1)
-        key_u = normalize_key(key)
-        if DUT_KEY_PATTERN.match(key_u):
-            # Accept alphanumeric serials; enforce length only
-            if (not value.isalnum()) or len(value) < MIN_SERIAL_LEN:
-                raise ValidationError(
-                    f"Invalid DUT serial for {key}: must be alphanumeric length >= {MIN_SERIAL_LEN}"
-                )
-        elif key_u not in ALLOWED_NON_DUT_KEYS:
-            raise ValidationError(f"Unknown variable key: {key}")
-        pairs.append((key_u, value))
-    return pairs
+    def _run(self) -> None:
+        try:
+            super()._run()
+        finally:
+            self.finished = time.time()
+            if self._on_done:
+                self._on_done(self)
 
-def parse_flags(flag_specs: Sequence[str]) -> List[str]:
-    """Expand repeated --flag specifications into individual argument tokens.
-    Each spec can contain one or multiple tokens (e.g. "-L TRACE" or "--dryrun").
-    Validation: Disallow -v and -t tokens here (they belong to variables / STTL IDs)."""
-    tokens: List[str] = []
-    for spec in flag_specs:
-        if not spec.strip():
-            continue
-        split = shlex.split(spec)
-        for tok in split:
-            if tok in {"-v", "-t"}:
-                raise ValidationError(f"Disallowed token in --flag specification: {tok}")
-            tokens.append(tok)
-    return tokens
+class Daemon:
+    """Job queue of the daemon. Submitted jobs run as soon as none of their DUTs is used by
+    another daemon job and fewer than workers jobs are running (like manifest jobs); device
+    tracking and the history database stay loaded between jobs. Jobs run with options, or
+    with their own exec_dir."""
 
-# ---------------- Unified Build Function ----------------
+    def __init__(self, workers: int = MANIFEST_WORKERS, options: Optional[RunOptions] = None):
+        self.workers = max(1, workers)
+        self.options = options or RunOptions()
+        self.started = time.time()
+        self.jobs: Dict[int, DaemonJob] = {}
+        self._pending: Deque[DaemonJob] = collections.deque()
+        self._busy: set = set()
+        self._running = 0
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
 
-def build_command(vars_tokens: Sequence[str], sttl_block: str, path: Optional[str], allow_empty_vars: bool = False, flags: Optional[Sequence[str]] = None) -> ZybotCommand:
-    vars_list = parse_vars(vars_tokens, allow_empty=allow_empty_vars)
-    sttls = parse_sttl_block(sttl_block)
-    flag_tokens = parse_flags(flags or [])
-    return ZybotCommand(vars=vars_list, sttls=sttls, path=path or None, flags=flag_tokens)
+    def submit(self, entry: dict) -> DaemonJob:
+        """Queue a job given as a manifest entry (see manifest_job) plus optional schedule and
+        exec_dir; raises ParseError / ValidationError / OSError for bad submissions.
+        Files and exec_dir must be absolute paths: relative ones would resolve against the
+        daemon's working directory, not the client's."""
+        schedule = entry.get('schedule') or "lpt"
+        if schedule not in SCHEDULES:
+            raise ValidationError(f"schedule must be one of {', '.join(SCHEDULES)}")
+        exec_dir = _manifest_str(entry, 'exec_dir')
+        paths = _manifest_list(entry.get('sttl_file'), ',') + [p for p in (str(entry.get('stage') or ''), exec_dir) if p]
+        relative = [p for p in paths if not os.path.isabs(p)]
+        if relative:
+            raise ValidationError(f"sttl_file, stage and exec_dir need absolute paths: {', '.join(relative)}")
+        parsed = manifest_job(entry, str(entry.get('name') or ''))
+        with self._cond:
+            job_id = next(self._ids)
+            parsed.name = parsed.name or f"job{job_id}"
+            options = replace(self.options, exec_dir=exec_dir) if exec_dir else self.options
+            job = DaemonJob(job_id, parsed, schedule, options, on_done=self._done)
+            logging.info("Job %d (%s) queued: %s", job.id, job.name, job.command.display_command())
+            self.jobs[job_id] = job
+            self._pending.append(job)
+            self._dispatch()
+        return job
 
-# Overload build_command to accept sttl_ids as list
+    def stop(self, job_id: int) -> Optional[DaemonJob]:
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        with self._cond:
+            if job in self._pending:
+                self._pending.remove(job)
+                job.cancelled = True
+                return job
+        if job.running:
+            job.stop()
+        return job
 
-def build_command(vars_tokens, sttl_ids, path, allow_empty_vars=False, flags=None):
-    vars_list = parse_vars(vars_tokens, allow_empty=allow_empty_vars)
-    flag_tokens = parse_flags(flags or [])
-    return ZybotCommand(vars=vars_list, sttls=sttl_ids, path=path or None, flags=flag_tokens)
+    def shutdown(self) -> None:
+        with self._cond:
+            for job in self._pending:
+                job.cancelled = True
+            self._pending.clear()
+            running = [job for job in self.jobs.values() if job.running]
+        for job in running:
+            job.stop()
+        for job in running:
+            job.wait(10)
 
-# --------------- Zybot Executable Resolution ---------------
+    def status(self) -> dict:
+        with self._cond:
+            counts = collections.Counter(job.status() for job in self.jobs.values())
+        return {"pid": os.getpid(), "uptime": time.time() - self.started, "workers": self.workers,
+                "exec_dir": self.options.exec_dir, "jobs": dict(counts)}
 
-def execute(command: ZybotCommand) -> int:
-    """
-    Simplified execution:
-    1. cd to required directory.
-    2. Run the full zybot command string exactly as displayed.
-    Note: zybot_path ignored; always uses the command built by command.display_command().
+    def _dispatch(self) -> None:
+        """Start every queued job that can run now, in submission order (caller holds _cond)."""
+        for job in list(self._pending):
+            if self._running >= self.workers:
+                break
+            if job.serials & self._busy:
+                continue
+            self._pending.remove(job)
+            self._busy |= job.serials
+            self._running += 1
+            logging.info("Job %d (%s) started on %s", job.id, job.name, ' '.join(sorted(job.serials)))
+            job.start()
+
+    def _done(self, job: DaemonJob) -> None:
+        logging.info("Job %d (%s) %s (code %s)", job.id, job.name, job.status(), job.returncode)
+        with self._cond:
+            self._busy -= job.serials
+            self._running -= 1
+            finished = [j for j in self.jobs.values() if j.finished is not None or j.cancelled]
+            for old in finished[:max(0, len(finished) - DAEMON_MAX_JOBS)]:
+                del self.jobs[old.id]
+            self._dispatch()
+
+def serve_daemon(daemon: Daemon, port: int = DAEMON_PORT) -> int:
+    """Serve the daemon's JSON API on 127.0.0.1:port until interrupted or POST /shutdown.
+    Every request needs the X-ZyButler-Token header with the token written to DAEMON_STATE.
+
+        GET  /status                  daemon info and job counts
+        GET  /devices                 adb devices {serial: state}
+        GET  /jobs                    all jobs
+        POST /jobs                    submit {"vars": [...], "sttl": "id:(...)" | "sttl_file": ..., "path", "flags",
+                                      "parallel", "schedule", "stage", "exec_dir", "name"} -> 202 + job
+        GET  /jobs/ID                 one job, with progress while it runs
+        GET  /jobs/ID/output?since=N  output lines from line N on
+        POST /jobs/ID/stop            cancel a queued job or stop a running one
+        POST /shutdown                stop all jobs and exit
     """
-    if not os.path.isdir(EXECUTION_DIR):
-        logging.error("Execution directory missing: %s", EXECUTION_DIR)
-        return 5
-    prev_cwd = os.getcwd()
-    try:
-        if prev_cwd != EXECUTION_DIR:
-            os.chdir(EXECUTION_DIR)
-            logging.debug("Changed working directory to %s", EXECUTION_DIR)
-        cmd_str = command.display_command()
-        logging.info("Executing: %s", cmd_str)
-        # Use shell to allow quoted -t arguments to be passed intact.
-        return subprocess.call(cmd_str, shell=True)
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+    token = secrets.token_hex(16)
+    tracker = get_device_tracker()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt: str, *args) -> None:
+            logging.debug("daemon: " + fmt, *args)
+
+        def reply(self, code: int, body) -> None:
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def route(self, method: str) -> None:
+            if not secrets.compare_digest(self.headers.get("X-ZyButler-Token", ""), token):
+                return self.reply(403, {"error": "missing or wrong X-ZyButler-Token"})
+            url = urlparse(self.path)
+            parts = [p for p in url.path.split('/') if p]
+            job = None
+            if len(parts) >= 2 and parts[0] == 'jobs':
+                job = daemon.jobs.get(int(parts[1])) if parts[1].isdigit() else None
+                if job is None:
+                    return self.reply(404, {"error": f"no job {parts[1]}"})
+            if method == 'GET' and parts == ['status']:
+                return self.reply(200, daemon.status())
+            if method == 'GET' and parts == ['devices']:
+                return self.reply(200, tracker.snapshot())
+            if method == 'GET' and parts == ['jobs']:
+                return self.reply(200, [j.to_dict() for j in list(daemon.jobs.values())])
+            if method == 'POST' and parts == ['jobs']:
+                try:
+                    entry = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b'{}')
+                    if not isinstance(entry, dict):
+                        raise ParseError("request body must be a JSON object")
+                    return self.reply(202, daemon.submit(entry).to_dict())
+                except (ValueError, OSError) as e:  # ParseError / ValidationError / JSONDecodeError are ValueErrors
+                    return self.reply(400, {"error": str(e)})
+            if method == 'GET' and len(parts) == 2 and job:
+                return self.reply(200, job.to_dict())
+            if method == 'GET' and parts[2:] == ['output'] and job:
+                since = parse_qs(url.query).get('since', ['0'])[0]
+                lines, next_line, skipped = job.lines.since(int(since) if since.isdigit() else 0)
+                return self.reply(200, {"lines": lines, "next": next_line, "skipped": skipped,
+                                        "status": job.status(), "returncode": job.returncode})
+            if method == 'POST' and parts[2:] == ['stop'] and job:
+                daemon.stop(job.id)
+                return self.reply(200, job.to_dict())
+            if method == 'POST' and parts == ['shutdown']:
+                self.reply(200, {"stopping": True})
+                threading.Thread(target=server.shutdown, daemon=True).start()
+                return None
+            return self.reply(404, {"error": f"unknown endpoint {method} {url.path}"})
+
+        def do_GET(self) -> None:
+            self.route('GET')
+
+        def do_POST(self) -> None:
+            self.route('POST')
+
+    try:
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
     except OSError as e:
-        logging.error("Failed to execute in %s: %s", EXECUTION_DIR, e)
-        return 5
+        logging.error("Cannot listen on 127.0.0.1:%d: %s", port, e)
+        return EXECUTION_ERROR_RC
+    server.daemon_threads = True
+    os.makedirs(os.path.dirname(DAEMON_STATE) or '.', exist_ok=True)
+    fd = os.open(DAEMON_STATE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump({"url": f"http://127.0.0.1:{server.server_address[1]}", "pid": os.getpid(), "token": token}, f)
+    get_history()  # open (and migrate) the history database now rather than in the first job
+    logging.info("ZyButler daemon listening on http://127.0.0.1:%d (%d worker(s)); token in %s",
+                 server.server_address[1], daemon.workers, DAEMON_STATE)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Daemon interrupted")
     finally:
-        try:
-            if os.getcwd() != prev_cwd:
-                os.chdir(prev_cwd)
-                logging.debug("Restored working directory to %s", prev_cwd)
-        except OSError:
-            pass
+        server.server_close()
+        daemon.shutdown()
+        tracker.stop()
+        with contextlib.suppress(OSError):
+            os.remove(DAEMON_STATE)
+    return 0
 
 # ---------------- Interactive Menu Flow ----------------
 
+@traced("interactive_menu")
 def interactive_menu() -> int:
     global _def_use_color
     _def_use_color = supports_color()
@@ -325,12 +3763,19 @@ def interactive_menu() -> int:
         print(color('Main Menu:', CYAN))
         print('  1) Generate new Zybot command')
         if last_command: print('  2) Re-run last command')
+        print('  d) List connected devices')
         print('  0) Quit')
         print('  ?) Show format help')
         choice = input(color('Enter choice: ', BOLD)).strip()
         if choice == '?':
             print_format_help()
             continue
+        if choice.lower() == 'd':
+            tracker = get_device_tracker()
+            with TRACER.span("adb_discovery"):
+                tracker.wait_ready(ADB_START_TIMEOUT)
+            print_devices(tracker)
+            continue
         if choice == '0':
             print(color('Goodbye.', BOLD,GREEN))
             return 0
@@ -435,13 +3880,53 @@ def build_arg_parser() -> argparse.ArgumentParser:
     p.add_argument("--flag", action="append", metavar="FLAG", help="Additional zybot flag (repeatable). Example: --flag '-L TRACE' --flag '--dryrun'")
     group = p.add_mutually_exclusive_group()
     group.add_argument("--sttl-block", help="STTL block string: id:(STTL/STTL-123 STTL/STTL-456)")
-    group.add_argument("--sttl-file", help="File containing single STTL block line")
+    group.add_argument("--sttl-file", action="append", metavar="PATH", help="File with STTL IDs: block line, Polarion CSV/XML export or any text; '-' reads stdin (repeatable)")
+    group.add_argument("--manifest", metavar="JOBS_FILE", help="Run the jobs of a .json/.yaml/.csv manifest (vars, sttl, path, flags per entry) in one process")
+    group.add_argument("--rerun-failed", metavar="OUTPUT_XML|RESULTS_DIR", help="Use the failed STTL tests of a previous zybot output.xml (or every output*.xml under a results directory)")
     p.add_argument("--path", help="Optional test path")
+    p.add_argument("--exec-dir", metavar="DIR", help=f"Working directory for zybot (default: $ZYBUTLER_EXECUTION_DIR or {EXECUTION_DIR})")
+    p.add_argument("--no-job-dir", action="store_true", help="Write results directly to the output dir instead of a per-job subdirectory")
+    p.add_argument("--use-index", action="store_true", help="Pass only the suite files containing the STTL IDs (from the on-disk STTL index of --path)")
     p.add_argument("--execute", action="store_true", help="Run zybot after building command (from required repo directory)")
+    p.add_argument("--parallel", action="store_true", help="Shard STTL IDs across DUTs and run one zybot per device concurrently")
+    p.add_argument("--schedule", choices=SCHEDULES, default="lpt", help="--parallel assignment: lpt (balance by recorded durations), round-robin, or steal (idle DUTs take pending IDs)")
+    p.add_argument("--jobs", type=int, default=MANIFEST_WORKERS, metavar="N", help=f"Manifest jobs running at once (default {MANIFEST_WORKERS}); jobs sharing a DUT never overlap")
+    p.add_argument("--steal-batch", type=int, default=1, metavar="N", help="STTL IDs per zybot run in --schedule steal (default 1)")
+    p.add_argument("--chunk-mode", choices=CHUNK_MODES, default="auto", help="How to run commands over the command-line limit: argument file (auto/argfile) or sequential STTL batches (batch)")
+    p.add_argument("--max-cmd-len", type=int, metavar="N", help="Override the command-line length limit used for chunking")
     p.add_argument("--pretty", action="store_true", help="Pretty formatted output")
     p.add_argument("--no-color", action="store_true", help="Disable ANSI colors")
     p.add_argument("--verbose", "-V", action="store_true", help="Verbose logging")
     p.add_argument("--show-formats", action="store_true", help="Print accepted input format examples and exit")
+    p.add_argument("--list-devices", action="store_true", help="List connected adb devices and exit")
+    p.add_argument("--history", action="append", metavar="STTL-ID", help="Show last status and p95 duration of a test from the run history (repeatable)")
+    p.add_argument("--history-stats", action="store_true", help="Show p95 duration per test from the run history and exit")
+    p.add_argument("--no-history", action="store_true", help="Do not record this run in the run history")
+    p.add_argument("--watch-devices", action="store_true", help="Print adb device add/remove events until Ctrl+C")
+    p.add_argument("--lease-wait", type=float, default=0.0, metavar="SECONDS", help="Wait up to SECONDS for DUTs leased by another run (default 0: fail fast; 'inf' queues indefinitely)")
+    p.add_argument("--no-lease", action="store_true", help="Do not lease the DUTs (allow other runs on the same devices)")
+    p.add_argument("--timeout", type=float, metavar="SECONDS", help="Kill a zybot process still running after SECONDS, check its DUT with adb and re-queue the unfinished tests on a healthy DUT")
+    p.add_argument("--idle-timeout", type=float, metavar="SECONDS", help="Like --timeout, but for a zybot process that prints no output for SECONDS")
+    p.add_argument("--retries", type=int, metavar="N", help="Re-run failed STTL tests up to N more times; only the failed IDs run, on the next DUT when --parallel (default: $ZYBUTLER_RETRIES or 0)")
+    p.add_argument("--retry-backoff", type=float, default=RETRY_BACKOFF, metavar="SECONDS", help=f"Wait before the first retry; each further retry waits {RETRY_BACKOFF_FACTOR:g}x longer (default {RETRY_BACKOFF:g})")
+    p.add_argument("--retry-on-exit", metavar="CODES", help="Only retry tests of zybot runs ending with one of these comma-separated exit codes (e.g. 252,253,255)")
+    p.add_argument("--skip-cached", action="store_true", help="Skip STTL tests that already passed on the DUTs' build fingerprint with unchanged suite files (needs --path)")
+    p.add_argument("--daemon", action="store_true",
+                   help="Run as a daemon serving a localhost JSON API that queues and runs submitted jobs (see zybutler_client.py)")
+    p.add_argument("--daemon-port", type=int, default=DAEMON_PORT, metavar="PORT", help=f"Port of --daemon (default {DAEMON_PORT})")
+    p.add_argument("--merge-results", metavar="RESULTS_DIR",
+                   help=f"Merge every output*.xml under RESULTS_DIR into {MERGED_XML} and {MERGED_SUMMARY} there, then exit")
+    p.add_argument("--stage", metavar="FILE",
+                   help="Install/push the APKs and files listed in FILE (JSON/YAML) to every DUT before running; unchanged ones are skipped")
+    p.add_argument("--preflight", choices=PREFLIGHT_MODES,
+                   help="Check every DUT with adb before running: only report failing DUTs or exclude them (default report)")
+    p.add_argument("--logcat", nargs="?", const="", metavar="DIR",
+                   help="Capture adb logcat of every DUT while zybot runs, into DIR (default: <results dir>/logcat)")
+    p.add_argument("--no-progress", action="store_true", help="Do not show the progress bar and ETA while zybot runs")
+    p.add_argument("--cache-max-age", type=float, default=CACHE_MAX_AGE_DAYS, metavar="DAYS", help=f"Ignore and evict cached passes older than DAYS (default {CACHE_MAX_AGE_DAYS:g})")
+    p.add_argument("--retry-on-message", action="append", metavar="REGEX", help="Only retry failures whose message matches REGEX (repeatable; combined with --retry-on-exit by OR)")
+    p.add_argument("--profile", metavar="PATH", help="Write phase and zybot process timings: JSON lines if PATH ends in .jsonl, else a Chrome trace-event file")
+    p.add_argument("--cprofile", metavar="PATH", help="Write cProfile stats of ZyButler itself (python -m pstats PATH)")
     #p.add_argument("--zybot-path", help="Full path to zybot executable or Python script (optional)")
     return p
 
@@ -449,11 +3934,36 @@ def build_arg_parser() -> argparse.ArgumentParser:
 
 def cli(argv: List[str]) -> int:
     if not argv:
-        return interactive_menu()
+        try:
+            return interactive_menu()
+        finally:
+            write_profile(PROFILE_PATH)
+    started = time.perf_counter()
     parser = build_arg_parser()
     args = parser.parse_args(argv)
     logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format='[%(levelname)s] %(message)s')
+    profile_path = args.profile or PROFILE_PATH
+    if profile_path:
+        TRACER.enabled = True
+        TRACER.add("parse_args", started, time.perf_counter() - started)
+    profiler = cProfile.Profile() if args.cprofile else None
+    if profiler:
+        profiler.enable()
+    try:
+        with TRACER.span("cli"):
+            return run_cli(args)
+    finally:
+        if profiler:
+            profiler.disable()
+            try:
+                profiler.dump_stats(args.cprofile)
+                logging.info("cProfile stats written to %s (view with: python -m pstats %s)", args.cprofile, args.cprofile)
+            except OSError as e:
+                logging.error("Could not write cProfile stats %s: %s", args.cprofile, e)
+        write_profile(profile_path)
 
+def run_cli(args: argparse.Namespace) -> int:
+    """Body of cli() once arguments are parsed."""
     global _def_use_color
     _def_use_color = supports_color() and not args.no_color
 
@@ -461,54 +3971,232 @@ def cli(argv: List[str]) -> int:
         print_format_help()
         return 0
 
+    try:
+        options = run_options(args)
+    except ValidationError as e:
+        logging.error("Retry option error: %s", e)
+        return 3
+    if args.history or args.history_stats:
+        history = get_history()
+        if history is None:
+            logging.error("Run history unavailable")
+            return 3
+        if args.history:
+            print_history(history, [h.upper() for h in args.history])
+        if args.history_stats:
+            print_history_stats(history)
+        return 0
+
+    if args.watch_devices:
+        return watch_devices(get_device_tracker())
+    if args.list_devices:
+        tracker = get_device_tracker()
+        with TRACER.span("adb_discovery"):
+            tracker.wait_ready(ADB_START_TIMEOUT)
+        print_devices(tracker)
+        return 0
+
+    if args.daemon:
+        if args.jobs < 1:
+            logging.error("--jobs must be >= 1")
+            return 3
+        return serve_daemon(Daemon(workers=args.jobs, options=options), args.daemon_port)
+
+    if args.merge_results:
+        try:
+            with TRACER.span("merge_results"):
+                merger = merge_results(args.merge_results)
+        except (OSError, ParseError) as e:
+            logging.error("Merge error: %s", e)
+            return 2
+        print(f"Merged {merger.summary_line()} into {os.path.join(args.merge_results, MERGED_XML)}")
+        return 1 if merger.counts().get('FAIL') else 0
+
+    if args.manifest:
+        return run_manifest_cli(args, options)
+
     if not args.var:
         logging.error("At least one --var KEY:VALUE required")
         return 3
     try:
-        vs = parse_vars(args.var or [], allow_empty=False)
+        with TRACER.span("parse_vars"):
+            vs = parse_vars(args.var or [], allow_empty=False)
     except ValidationError as e:
         logging.error("Variable error: %s", e)
         return 3
     try:
-        flag_tokens = parse_flags(args.flag or [])
+        with TRACER.span("parse_flags"):
+            flag_tokens = parse_flags(args.flag or [])
     except ValidationError as e:
         logging.error("Flag error: %s", e)
         return 3
-    if args.sttl_block:
-        sttl_source = args.sttl_block
-    elif args.sttl_file:
+    sttl_started = time.perf_counter()
+    if args.rerun_failed:
         try:
-            with open(args.sttl_file, 'r', encoding='utf-8') as f:
-                sttl_source = f.read().strip()
-        except OSError as e:
-            logging.error("Failed reading STTL file: %s", e)
+            sttls = failed_sttls(args.rerun_failed)
+        except (OSError, ParseError) as e:
+            logging.error("Failed reading previous results: %s", e)
             return 2
+        if not sttls:
+            print(color(f'No failed STTL tests in {args.rerun_failed}; nothing to re-run.', BOLD, GREEN))
+            return 0
+        logging.info("Re-running %d failed STTL test(s) from %s", len(sttls), args.rerun_failed)
     else:
-        logging.error("Provide --sttl-block or --sttl-file")
-        return 2
+        if args.sttl_block:
+            try:
+                sttls = parse_sttl_block(args.sttl_block)
+            except ParseError as e:
+                logging.error("STTL error: %s", e)
+                return 2
+        elif args.sttl_file:
+            try:
+                sttls = read_sttl_ids(args.sttl_file)
+            except OSError as e:
+                logging.error("Failed reading STTL file: %s", e)
+                return 2
+            if not sttls:
+                logging.error("STTL error: no STTL-<id> found in %s", ", ".join(args.sttl_file))
+                return 2
+            logging.info("Read %d unique STTL ID(s) from %s", len(sttls), ", ".join(args.sttl_file))
+        else:
+            logging.error("Provide --sttl-block, --sttl-file or --rerun-failed")
+            return 2
+    TRACER.add("parse_sttl", sttl_started, time.perf_counter() - sttl_started, ids=len(sttls))
+
+    stage = None
+    if args.stage:
+        try:
+            stage = load_stage(args.stage)
+        except (OSError, ParseError) as e:
+            logging.error("Stage file error: %s", e)
+            return 2
+        except ValidationError as e:
+            logging.error("%s", e)
+            return 3
+
+    cache = None
+    if args.skip_cached and args.execute:  # needs adb and the suite file hashes; a dry run prints every test
+        with TRACER.span("result_cache"):
+            cached, cache = apply_result_cache(ZybotCommand(vars=vs, sttls=sttls, path=args.path), args.parallel, options)
+        if not cached.sttls:
+            print(color('All STTL tests already passed on this build; nothing to run.', BOLD, GREEN))
+            return 0
+        sttls = cached.sttls
+
+    sources = None
+    if args.use_index:
+        if args.path:
+            with TRACER.span("resolve_sources"):
+                sources = resolve_sources(sttls, args.path, options.exec_dir)
+        else:
+            logging.warning("--use-index requires --path; ignoring")
+    with TRACER.span("build_command"):
+        command = ZybotCommand(vars=vs, sttls=sttls, path=args.path, flags=flag_tokens, sources=sources)
+        if args.pretty:
+            print(command.pretty(options.exec_dir))
+            print(color('Full Command:', BOLD, YELLOW))
+            print(color(command.display_command(), BOLD))
+        else:
+            print(command.display_command())
 
+    if args.steal_batch < 1:
+        logging.error("--steal-batch must be >= 1")
+        return 3
+    if not args.execute:
+        return 0
+    # Only planned when executing: planning creates argument files and names a job directory
     try:
-        sttls = parse_sttl_block(sttl_source)
-    except ParseError as e:
-        logging.error("STTL error: %s", e)
-        return 2
+        command = apply_preflight(command, args.parallel, options.preflight)
+    except PreflightError as e:
+        logging.error("%s", e)
+        return PREFLIGHT_FAILED_RC
+    with TRACER.span("plan_execution"):
+        plan = plan_execution(command, parallel=args.parallel, chunk_mode=args.chunk_mode, limit=args.max_cmd_len,
+                              schedule=args.schedule, steal_batch=args.steal_batch, job_dir=not args.no_job_dir)
+    if args.parallel or len(plan) > 1 or len(plan[0]) > 1 or plan[0][0].argument_file:
+        heading = f'Execution plan ({len(plan)} concurrent group(s), {sum(len(g) for g in plan)} zybot run(s)'
+        heading += ', work stealing):' if plan.steal else '):'
+        print(color(heading, BOLD, GREEN) if args.pretty else f'# {heading}')
+        for group in plan:
+            for step in group:
+                print(step.display_command())
 
-    command = ZybotCommand(vars=vs, sttls=sttls, path=args.path, flags=flag_tokens)
-    if args.pretty:
-        print(command.pretty())
-        print(color('Full Command:', BOLD, YELLOW))
-        print(color(command.display_command(), BOLD))
-    else:
-        print(command.display_command())
+    #rc = execute(command, args.zybot_path)
+    try:
+        with TRACER.span("execute"):
+            rc = execute_with_progress(command, plan, options, cache=cache, stage=stage)
+    except LeaseError as e:
+        logging.error("%s (use --lease-wait SECONDS to queue)", e)
+        return LEASE_BUSY_RC
+    if rc != 0:
+        logging.error("zybot exited with code %s", rc)
+    return rc
 
-    if args.execute:
-        #rc = execute(command, args.zybot_path)
-        rc = execute(command)
-        if rc != 0:
-            logging.error("zybot exited with code %s", rc)
-        return rc
-    else:
+def run_options(args: argparse.Namespace) -> RunOptions:
+    """RunOptions from the CLI flags; flags that are not given keep the environment defaults.
+    Raises ValidationError for bad retry options."""
+    options = RunOptions(lease_wait=args.lease_wait, timeout=args.timeout, idle_timeout=args.idle_timeout,
+                         retry=retry_policy(args), cache_max_age=args.cache_max_age)
+    if args.exec_dir:
+        options.exec_dir = args.exec_dir
+    if args.no_history:
+        options.history = False
+    if args.no_lease:
+        options.lease = False
+    if args.preflight:
+        options.preflight = args.preflight
+    if args.logcat is not None:
+        options.logcat_dir = os.path.abspath(args.logcat) if args.logcat else ""
+    if args.no_progress:
+        options.progress = False
+    return options
+
+def retry_policy(args: argparse.Namespace) -> RetryPolicy:
+    """RetryPolicy from --retries / --retry-backoff / --retry-on-exit / --retry-on-message."""
+    retries = RETRY_POLICY.max_attempts - 1 if args.retries is None else args.retries
+    if retries < 0 or args.retry_backoff < 0:
+        raise ValidationError("--retries and --retry-backoff must not be negative")
+    try:
+        codes = tuple(int(c) for c in (args.retry_on_exit or '').split(',') if c.strip())
+    except ValueError:
+        raise ValidationError(f"--retry-on-exit expects comma-separated integers, got '{args.retry_on_exit}'")
+    try:
+        messages = tuple(re.compile(m) for m in args.retry_on_message or [])
+    except re.error as e:
+        raise ValidationError(f"Invalid --retry-on-message pattern: {e}")
+    return RetryPolicy(max_attempts=retries + 1, backoff=args.retry_backoff, exit_codes=codes, messages=messages)
+
+def run_manifest_cli(args: argparse.Namespace, options: RunOptions) -> int:
+    if args.var:
+        logging.warning("--var is ignored with --manifest; set vars per job")
+    try:
+        with TRACER.span("load_manifest"):
+            stage = load_stage(args.stage) if args.stage else None
+            jobs = load_manifest(args.manifest, parallel=args.parallel, extra_flags=args.flag or [], stage=stage)
+    except OSError as e:
+        logging.error("Failed reading manifest: %s", e)
+        return 2
+    except ParseError as e:
+        logging.error("Manifest error: %s", e)
+        return 2
+    except ValidationError as e:
+        logging.error("%s", e)
+        return 3
+    if args.jobs < 1 or args.steal_batch < 1:
+        logging.error("--jobs and --steal-batch must be >= 1")
+        return 3
+    for job in jobs:
+        print(f"# {job.name}" + (" (parallel)" if job.parallel else ""))
+        print(job.command.display_command())
+    if not args.execute:
         return 0
+    with TRACER.span("run_manifest", jobs=len(jobs)):
+        rc = run_manifest(jobs, workers=args.jobs, options=options, chunk_mode=args.chunk_mode, schedule=args.schedule,
+                          steal_batch=args.steal_batch, job_dir=not args.no_job_dir)
+    print_manifest_summary(jobs)
+    if rc != 0:
+        logging.error("Manifest finished with code %s", rc)
+    return rc
 
 # ---------------- GUI Interface ----------------
 
@@ -630,6 +4318,8 @@ def main_gui():
     output_frame.pack(fill='both', expand=True, padx=10, pady=5)
     output_text = scrolledtext.ScrolledText(output_frame, height=12, font=('Consolas', 10))
     output_text.pack(fill='both', expand=True)
+    progress_var = tk.StringVar()
+    ttk.Label(output_frame, textvariable=progress_var, font=('Consolas', 10)).pack(anchor='w')
 
     # --- Command Construction & Execution ---
     def build_command_from_gui():
@@ -653,7 +4343,7 @@ def main_gui():
             messagebox.showerror("Invalid STTL Block", msg)
             return None
         try:
-            cmd = build_command(dut_tokens, sttl_raw, path, allow_empty_vars=True, flags=flag_list_copy)
+            cmd = build_command(dut_tokens, parse_sttl_block(sttl_raw), path, allow_empty_vars=True, flags=flag_list_copy)
             return cmd
         except (ValidationError, ParseError) as e:
             messagebox.showerror("Input Error", str(e))
@@ -668,7 +4358,39 @@ def main_gui():
         output_text.delete('1.0', 'end')
         output_text.insert('end', cmd.pretty())
 
+    job_state = {'job': None}
+
+    def append_output(lines):
+        output_text.insert('end', '\n'.join(lines) + '\n')
+        excess = int(output_text.index('end-1c').split('.')[0]) - GUI_OUTPUT_MAX_LINES
+        if excess > 0:
+            output_text.delete('1.0', f'{excess + 1}.0')
+        output_text.see('end')
+
+    def poll_job():
+        job = job_state['job']
+        running = job.running  # sample before draining so no trailing output is lost
+        lines, dropped = job.drain(GUI_OUTPUT_MAX_LINES)
+        if dropped:
+            lines.insert(0, f'... ({dropped} lines skipped)')
+        if lines:
+            append_output(lines)
+        if job.progress:
+            progress_var.set(job.progress.summary())
+        if running:
+            root.after(GUI_POLL_MS, poll_job)
+            return
+        rc = job.returncode
+        status = 'stopped' if job.stopped else f'finished with code {rc}'
+        output_text.insert('end', color(f'Execution {status}\n', BOLD, GREEN if rc == 0 else RED))
+        output_text.see('end')
+        run_btn.configure(state='normal')
+        stop_btn.configure(state='disabled')
+        job_state['job'] = None
+
     def run_zybot():
+        if job_state['job']:
+            return
         cmd = build_command_from_gui()
         if not cmd:
             return
@@ -677,16 +4399,29 @@ def main_gui():
         output_text.delete('1.0', 'end')
         output_text.insert('end', cmd.pretty() + '\n\n')
         output_text.insert('end', color('Executing zybot...\n', BOLD, YELLOW))
-        root.update()
-        rc = execute(cmd)
-        output_text.insert('end', color(f'Execution finished with code {rc}\n', BOLD, GREEN if rc == 0 else RED))
+        job_state['job'] = ZybotJob(cmd).start()
+        run_btn.configure(state='disabled')
+        stop_btn.configure(state='normal')
+        root.after(GUI_POLL_MS, poll_job)
+
+    def stop_zybot():
+        if job_state['job']:
+            job_state['job'].stop()
+
+    def quit_gui():
+        stop_zybot()
+        root.destroy()
 
     # --- Buttons ---
     btn_frame = ttk.Frame(root)
     btn_frame.pack(fill='x', padx=10, pady=5)
     ttk.Button(btn_frame, text="Show Command Summary", command=show_summary).pack(side='left', padx=5)
-    ttk.Button(btn_frame, text="Run zybot", command=run_zybot).pack(side='left', padx=5)
-    ttk.Button(btn_frame, text="Quit", command=root.destroy).pack(side='right', padx=5)
+    run_btn = ttk.Button(btn_frame, text="Run zybot", command=run_zybot)
+    run_btn.pack(side='left', padx=5)
+    stop_btn = ttk.Button(btn_frame, text="Stop", command=stop_zybot, state='disabled')
+    stop_btn.pack(side='left', padx=5)
+    ttk.Button(btn_frame, text="Quit", command=quit_gui).pack(side='right', padx=5)
+    root.protocol("WM_DELETE_WINDOW", quit_gui)
 
     root.mainloop()
 
@@ -699,7 +4434,7 @@ def main():
         if len(sys.argv) > 1 and sys.argv[1] == "--gui":
             main_gui()
         else:
-            cli(sys.argv[1:])
+            exit_code = cli(sys.argv[1:])
     except KeyboardInterrupt:
         logging.error("Interrupted by user")
         exit_code = 130
@@ -721,14 +4456,6 @@ def validate_flag(flag):
         return False, str(e)
 
 def parse_sttl_ids_any(raw: str) -> list:
-    import re
-    pattern = re.compile(r'(?:STTL\/STTL-|STTL-)?(\d{4,})')
-    ids = pattern.findall(raw)
-    unique = []
-    seen = set()
-    for idnum in ids:
-        sid = f'STTL-{idnum}'
-        if sid not in seen:
-            seen.add(sid)
-            unique.append(sid)
-    return unique
+    # Pasted text is already in memory and scanned in one go. Bare numbers have no prefix the
+    # iter_sttl_ids carry could hold back, so this pattern must not be streamed in chunks.
+    return [f'STTL-{idnum}' for idnum in dict.fromkeys(LOOSE_STTL_ID_PATTERN.findall(raw))]
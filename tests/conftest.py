@@ -0,0 +1,21 @@
+"""
+Shared test setup: ZyButler is imported from the repository root, with its local state
+(history, caches, DUT leases) in a temporary directory instead of ~/.zybutler and the host's
+shared lease directory. The environment must be set before ZyButler is imported.
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOLS_DIR = os.path.join(ROOT, "tools")
+sys.path.insert(0, ROOT)
+
+_home = tempfile.mkdtemp(prefix="zybutler_test_")
+atexit.register(shutil.rmtree, _home, True)
+os.environ["ZYBUTLER_HOME"] = _home
+os.environ["ZYBUTLER_LEASE_DIR"] = os.path.join(_home, "leases")
+os.environ["ZYBUTLER_NO_HISTORY"] = "1"
+os.environ["ZYBUTLER_PREFLIGHT"] = "off"
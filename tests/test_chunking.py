@@ -0,0 +1,60 @@
+"""Oversized commands: argument files (chunk_command) and sequential batches (split_batches)."""
+import os
+
+import pytest
+
+import ZyButler as Z
+
+def command(sttls=50, flags=None):
+    return Z.ZybotCommand(vars=[("DUT1", "SERIAL00001"), ("TESTDIR", "x")],
+                          sttls=[f"STTL-{100000 + n}" for n in range(sttls)], path="TS", flags=flags or [])
+
+def test_short_command_is_unchanged():
+    cmd = command(3)
+    assert Z.chunk_command(cmd, "auto", limit=10000) == [cmd]
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(Z.ValidationError):
+        Z.chunk_command(command(3), "zip")
+
+def test_argfile_holds_vars_tests_and_path():
+    cmd = command(50)
+    [chunked] = Z.chunk_command(cmd, "argfile", limit=200)
+    try:
+        assert chunked.sttls == cmd.sttls
+        assert len(chunked.display_command()) <= 200
+        with open(chunked.argument_file, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        assert lines[:2] == ["--variable DUT1:SERIAL00001", "--variable TESTDIR:x"]
+        assert lines[2:-1] == [f"--test {sid}*" for sid in cmd.sttls]
+        assert lines[-1] == "TS"
+    finally:
+        Z.remove_argument_files([chunked])
+    assert not os.path.exists(chunked.argument_file)
+
+def test_batches_stay_under_the_limit_and_keep_every_id_in_order():
+    cmd = command(200, flags=["--outputdir", "out"])
+    batches = Z.chunk_command(cmd, "batch", limit=600)
+    assert len(batches) > 1
+    assert all(len(b.display_command()) <= 600 for b in batches)
+    assert [sid for b in batches for sid in b.sttls] == cmd.sttls
+    assert [b.flags for b in batches] == [["--outputdir", os.path.join("out", f"batch{i}")]
+                                          for i in range(1, len(batches) + 1)]
+    assert all(b.argument_file is None for b in batches)
+
+def test_split_batches_fills_each_batch():
+    cmd = command(30)
+    limit = len(command(10).display_command()) + 40  # room for the batch outputdir and a little more
+    batches = Z.split_batches(cmd, limit)
+    # a batch only ends when the next ID would not fit
+    for batch, following in zip(batches, batches[1:]):
+        grown = Z.ZybotCommand(vars=batch.vars, sttls=batch.sttls + following.sttls[:1], path=batch.path, flags=batch.flags)
+        assert len(grown.display_command()) > limit
+
+def test_batch_mode_falls_back_to_an_argfile_when_vars_alone_are_too_long():
+    cmd = Z.ZybotCommand(vars=[(f"DUT{i}", f"SERIAL{i:05d}") for i in range(1, 30)], sttls=["STTL-1", "STTL-2"])
+    [chunked] = Z.chunk_command(cmd, "batch", limit=100)
+    try:
+        assert chunked.argument_file
+    finally:
+        Z.remove_argument_files([chunked])
@@ -0,0 +1,89 @@
+"""DUT leases: all-or-nothing acquire, busy holders, stale-lease takeover and release."""
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import ZyButler as Z
+
+def manager(tmp_path, ttl=60.0):
+    return Z.LeaseManager(directory=str(tmp_path), ttl=ttl)
+
+def write_lease(tmp_path, serial, **fields):
+    record = {"serial": serial, "owner": "other:1:1", "user": "someone", "host": "elsewhere", "pid": 1,
+              "acquired": time.time(), "expires": time.time() + 60}
+    record.update(fields)
+    with open(tmp_path / f"{serial}.lease", 'w', encoding='utf-8') as f:
+        json.dump(record, f)
+
+def dead_pid():
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+def test_acquire_writes_one_lease_file_per_serial(tmp_path):
+    leases = manager(tmp_path)
+    lease, waited = leases.acquire(["B", "A", "A"])
+    assert lease.serials == ["A", "B"]
+    assert waited < 1
+    assert sorted(os.listdir(tmp_path)) == ["A.lease", "B.lease"]
+    assert leases.holder("A")["owner"] == lease.owner
+    lease.release()
+
+def test_release_frees_the_serials(tmp_path):
+    leases = manager(tmp_path)
+    with leases.acquire(["A"])[0]:
+        assert leases.holder("A") is not None
+    assert leases.holder("A") is None
+    assert os.listdir(tmp_path) == []
+    lease, _ = leases.acquire(["A"])  # reusable right away
+    lease.release()
+    lease.release()  # idempotent
+
+def test_busy_serial_raises_and_holds_nothing(tmp_path):
+    leases = manager(tmp_path)
+    held, _ = leases.acquire(["B"])
+    with pytest.raises(Z.LeaseError, match="B by"):
+        leases.acquire(["A", "B"])
+    assert not (tmp_path / "A.lease").exists()  # all or none
+    held.release()
+
+def test_busy_serial_held_by_another_host(tmp_path):
+    write_lease(tmp_path, "A")
+    with pytest.raises(Z.LeaseError, match="someone@elsewhere"):
+        manager(tmp_path).acquire(["A"])
+
+def test_acquire_waits_for_release(tmp_path):
+    write_lease(tmp_path, "A", expires=time.time() + 0.3)
+    lease, waited = manager(tmp_path).acquire(["A"], wait=5)
+    assert waited > 0
+    lease.release()
+
+def test_expired_lease_is_taken_over(tmp_path):
+    write_lease(tmp_path, "A", expires=time.time() - 1)
+    leases = manager(tmp_path)
+    assert leases.holder("A") is None
+    lease, _ = leases.acquire(["A"])
+    assert leases.holder("A")["owner"] == lease.owner
+    lease.release()
+
+def test_lease_of_dead_process_on_this_host_is_taken_over(tmp_path):
+    write_lease(tmp_path, "A", host=Z.HOSTNAME, pid=dead_pid())
+    lease, _ = manager(tmp_path).acquire(["A"])
+    assert lease.serials == ["A"]
+    lease.release()
+
+def test_lease_of_live_process_on_this_host_is_kept(tmp_path):
+    write_lease(tmp_path, "A", host=Z.HOSTNAME, pid=os.getpid())
+    with pytest.raises(Z.LeaseError):
+        manager(tmp_path).acquire(["A"])
+
+def test_release_leaves_a_taken_over_lease_alone(tmp_path):
+    leases = manager(tmp_path)
+    lease, _ = leases.acquire(["A"])
+    write_lease(tmp_path, "A")  # someone else took it over as stale
+    lease.release()
+    assert leases.holder("A")["owner"] == "other:1:1"
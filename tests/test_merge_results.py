@@ -0,0 +1,78 @@
+"""Merging shard and retry output.xml files into one report (merged.xml and summary.json)."""
+import json
+import os
+
+import pytest
+
+import ZyButler as Z
+
+def output_xml(*tests):
+    """output.xml with (sttl number, status, start second, elapsed) tests."""
+    body = "".join(f'<test name="STTL-{n} Test {n}">\n'
+                   f'<status status="{status}" start="2024-01-01T12:00:{start:02d}.000000" elapsed="{elapsed}"/>\n'
+                   f'</test>\n' for n, status, start, elapsed in tests)
+    return f'<?xml version="1.0" encoding="UTF-8"?>\n<robot generator="Robot 7.0">\n<suite name="TS">\n{body}</suite>\n</robot>\n'
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return str(path)
+
+def job(tmp_path):
+    """A sharded job whose SERIAL00002 shard failed STTL-3, which then passed on retry."""
+    write(tmp_path / "SERIAL00001" / "output.xml", output_xml((1, "PASS", 0, 2.0), (2, "PASS", 2, 3.0)))
+    write(tmp_path / "SERIAL00002" / "output.xml", output_xml((3, "FAIL", 0, 1.0), (4, "SKIP", 1, 0.0)))
+    retry = write(tmp_path / "retry2" / "SERIAL00001" / "output.xml", output_xml((3, "PASS", 30, 4.0)))
+    os.utime(retry, (os.path.getmtime(retry) + 10,) * 2)  # written last
+    return tmp_path
+
+def test_merge_results_keeps_newest_result_per_test(tmp_path):
+    merger = Z.merge_results(str(job(tmp_path)))
+    assert merger.files == 3
+    assert {sid: (r.status, r.dut) for sid, r in merger.results.items()} == {
+        "STTL-1": ("PASS", "SERIAL00001"), "STTL-2": ("PASS", "SERIAL00001"),
+        "STTL-3": ("PASS", "SERIAL00001"), "STTL-4": ("SKIP", "SERIAL00002")}
+    assert merger.attempts["STTL-3"] == 2
+    assert merger.summary_line() == "4 test(s) from 3 result file(s): 3 passed, 0 failed, 1 skipped/not run"
+
+def test_newest_result_wins_whatever_the_merge_order(tmp_path):
+    merger = Z.ResultMerger(str(tmp_path))
+    merger.add(write(tmp_path / "b" / "output.xml", output_xml((1, "PASS", 30, 1.0))))
+    merger.add(write(tmp_path / "a" / "output.xml", output_xml((1, "FAIL", 0, 1.0))))
+    assert merger.results["STTL-1"].status == "PASS"
+
+def test_merged_report_files(tmp_path):
+    Z.merge_results(str(job(tmp_path)))
+    with open(tmp_path / Z.MERGED_SUMMARY, encoding="utf-8") as f:
+        summary = json.load(f)
+    assert (summary["files"], summary["tests"]) == (3, 4)
+    assert summary["counts"] == {"PASS": 3, "SKIP": 1}
+    assert summary["duts"]["SERIAL00001"]["PASS"] == 3
+    assert {r["sttl"]: r["attempts"] for r in summary["results"]} == {"STTL-1": 1, "STTL-2": 1, "STTL-3": 2, "STTL-4": 1}
+    merged = list(Z.iter_output_results(str(tmp_path / Z.MERGED_XML)))
+    assert sorted((r.sttl, r.status, r.duration) for r in merged) == [
+        ("STTL-1", "PASS", 2.0), ("STTL-2", "PASS", 3.0), ("STTL-3", "PASS", 4.0), ("STTL-4", "SKIP", 0.0)]
+
+def test_merged_xml_is_not_merged_again(tmp_path):
+    Z.merge_results(str(job(tmp_path)))
+    assert Z.merge_results(str(tmp_path)).files == 3
+
+def test_background_merge_and_min_files(tmp_path):
+    merger = Z.ResultMerger(str(tmp_path)).start()
+    merger.add(write(tmp_path / "SERIAL00001" / "output.xml", output_xml((1, "PASS", 0, 1.0))), "SERIAL00001")
+    assert not merger.finish(min_files=2)
+    assert merger.files == 1
+    assert not (tmp_path / Z.MERGED_XML).exists()
+
+def test_broken_result_file_is_skipped(tmp_path):
+    merger = Z.ResultMerger(str(tmp_path))
+    merger.add(write(tmp_path / "SERIAL00001" / "output.xml", output_xml((1, "PASS", 0, 1.0))[:60]))
+    merger.add(str(tmp_path / "missing" / "output.xml"))
+    merger.add(write(tmp_path / "SERIAL00002" / "output.xml", output_xml((2, "FAIL", 0, 1.0))))
+    assert merger.finish()
+    assert list(merger.results) == ["STTL-2"]
+
+def test_merge_results_needs_a_directory(tmp_path):
+    with pytest.raises(Z.ParseError):
+        Z.merge_results(str(tmp_path / "output.xml"))
@@ -0,0 +1,81 @@
+"""Reading zybot output.xml files for --rerun-failed."""
+import os
+
+import pytest
+
+import ZyButler as Z
+
+RF7_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<robot generator="Robot 7.0">
+<suite name="Top">
+<suite name="Child">
+<test name="STTL-1 Passing test">
+<kw name="Step"><status status="FAIL" start="2024-01-01T12:00:00.000000" elapsed="1.0"/></kw>
+<status status="PASS" start="2024-01-01T12:00:00.000000" elapsed="2.5"/>
+</test>
+<test name="STTL-2 Failing test">
+<status status="FAIL" start="2024-01-01T12:00:03.000000" elapsed="1.0">boom</status>
+</test>
+</suite>
+<test name="Not an STTL test">
+<status status="FAIL" start="2024-01-01T12:00:05.000000" elapsed="1.0"/>
+</test>
+<status status="FAIL" start="2024-01-01T12:00:00.000000" elapsed="6.0"/>
+</suite>
+</robot>
+"""
+
+LEGACY_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<robot generator="Robot 6.1">
+<suite name="Top">
+<test name="STTL-3 Legacy test">
+<status status="SKIP" starttime="20240101 12:00:00.000" endtime="20240101 12:00:04.500"/>
+</test>
+</suite>
+</robot>
+"""
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
+
+def test_rf7_results(tmp_path):
+    path = write(str(tmp_path / "output.xml"), RF7_XML)
+    results = list(Z.iter_output_results(path, dut="SERIAL00001"))
+    assert [(r.sttl, r.status, r.duration, r.dut) for r in results] == [
+        ("STTL-1", "PASS", 2.5, "SERIAL00001"), ("STTL-2", "FAIL", 1.0, "SERIAL00001")]
+    assert results[1].finished == results[1].started + 1.0
+
+def test_legacy_timestamps(tmp_path):
+    path = write(str(tmp_path / "output.xml"), LEGACY_XML)
+    [result] = Z.iter_output_results(path)
+    assert (result.sttl, result.status, result.dut) == ("STTL-3", "SKIP", "-")
+    assert result.duration == pytest.approx(4.5)
+
+def test_results_survive_small_read_chunks(tmp_path, monkeypatch):
+    path = write(str(tmp_path / "output.xml"), RF7_XML)
+    monkeypatch.setattr(Z, "XML_READ_CHUNK", 7)
+    assert [r.sttl for r in Z.iter_output_results(path)] == ["STTL-1", "STTL-2"]
+
+def test_broken_xml_raises_parse_error(tmp_path):
+    path = write(str(tmp_path / "output.xml"), RF7_XML[:300])
+    with pytest.raises(Z.ParseError):
+        list(Z.iter_output_results(path))
+
+def test_failed_sttls_of_one_file(tmp_path):
+    assert Z.failed_sttls(write(str(tmp_path / "output.xml"), RF7_XML)) == ["STTL-2"]
+
+def test_failed_sttls_uses_the_latest_result(tmp_path):
+    first = write(str(tmp_path / "SERIAL00001" / "output.xml"), RF7_XML)
+    retry = write(str(tmp_path / "retry2" / "output.xml"), RF7_XML.replace('status="FAIL" start="2024-01-01T12:00:03',
+                                                                          'status="PASS" start="2024-01-01T12:00:03'))
+    os.utime(first, (1, 1))  # oldest first
+    assert Z.failed_sttls(str(tmp_path)) == []
+    os.utime(retry, (0, 0))
+    assert Z.failed_sttls(str(tmp_path)) == ["STTL-2"]
+
+def test_directory_without_results(tmp_path):
+    with pytest.raises(Z.ParseError):
+        Z.failed_sttls(str(tmp_path))
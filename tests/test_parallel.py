@@ -0,0 +1,45 @@
+"""Exit code merging and per-DUT sharding (--parallel)."""
+import os
+
+import ZyButler as Z
+
+def command(duts=2, sttls=6, flags=None):
+    return Z.ZybotCommand(vars=[(f"DUT{i}", f"SERIAL{i:05d}") for i in range(1, duts + 1)] + [("TESTDIR", "x")],
+                          sttls=[f"STTL-{n}" for n in range(1, sttls + 1)], path="TS", flags=flags or [])
+
+def test_failed_test_counts_are_summed():
+    assert Z.merge_return_codes([0, 2, 3]) == 5
+
+def test_failed_test_count_is_capped():
+    assert Z.merge_return_codes([200, 100]) == Z.MAX_FAILED_RC
+
+def test_no_codes_is_success():
+    assert Z.merge_return_codes([]) == 0
+
+def test_error_codes_win_over_failures():
+    assert Z.merge_return_codes([3, 252]) == 252
+    assert Z.merge_return_codes([Z.EXECUTION_ERROR_RC, 250]) == Z.EXECUTION_ERROR_RC
+    assert Z.merge_return_codes([-9, 1]) == -9  # killed by a signal
+
+def test_first_error_code_wins():
+    assert Z.merge_return_codes([0, Z.DUT_UNAVAILABLE_RC, Z.EXECUTION_ERROR_RC]) == Z.DUT_UNAVAILABLE_RC
+
+def test_zybutler_error_codes_are_never_summed():
+    for rc in (Z.LEASE_BUSY_RC, Z.PREFLIGHT_FAILED_RC, Z.STAGE_FAILED_RC, Z.EXECUTION_ERROR_RC):
+        assert rc > Z.MAX_FAILED_RC
+        assert Z.merge_return_codes([rc, 3]) == rc
+    assert Z.merge_return_codes([4, 3]) == 7  # plain failure counts, not an error code
+
+def test_round_robin_shards_one_per_dut():
+    shards = Z.shard_command(command(duts=3, sttls=7), "round-robin")
+    assert [s.sttls for s in shards] == [["STTL-1", "STTL-4", "STTL-7"], ["STTL-2", "STTL-5"], ["STTL-3", "STTL-6"]]
+    # every shard drives one phone as DUT1 and keeps the non-DUT variables
+    assert [s.vars for s in shards] == [[("DUT1", f"SERIAL{i:05d}"), ("TESTDIR", "x")] for i in (1, 2, 3)]
+
+def test_shards_write_to_their_own_output_dir():
+    shards = Z.shard_command(command(flags=["--outputdir", "out", "-L", "TRACE"]), "round-robin")
+    assert [s.flags for s in shards] == [["-L", "TRACE", "--outputdir", f"out{os.sep}SERIAL{i:05d}"] for i in (1, 2)]
+
+def test_single_dut_is_not_sharded():
+    cmd = command(duts=1)
+    assert Z.shard_command(cmd, "round-robin") == [cmd]
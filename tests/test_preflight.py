@@ -0,0 +1,69 @@
+"""DUT pre-flight: parsing the probe output and report/exclude handling of failing DUTs."""
+import pytest
+
+import ZyButler as Z
+
+HEALTHY = "boot=1\nbattery=80\ncharging=0\nfree_kb=4194304\nwake=Awake\nlocked=false\n"
+
+def probe(**values):
+    lines = dict(line.split('=', 1) for line in HEALTHY.splitlines())
+    lines.update({k: str(v) for k, v in values.items()})
+    return Z.parse_preflight("SERIAL00001", "\n".join(f"{k}={v}" for k, v in lines.items()))
+
+def test_healthy_device():
+    health = probe()
+    assert health.ok and not health.warnings
+    assert (health.state, health.battery, health.free_mb) == ("device", 80, 4096)
+
+def test_still_booting():
+    assert probe(boot=0).problems == ["not finished booting"]
+
+def test_low_battery_fails_unless_charging():
+    assert probe(battery=5).problems == ["battery 5% and not charging"]
+    assert probe(battery=5, charging=1).ok
+
+def test_low_free_space():
+    assert probe(free_kb=100 * 1024).problems == ["only 100 MB free on /data"]
+
+def test_screen_off_and_locked_are_warnings():
+    health = probe(wake="Asleep", locked="true")
+    assert health.ok
+    assert health.warnings == ["screen off", "screen locked"]
+
+def test_missing_values_are_not_problems():
+    health = Z.parse_preflight("SERIAL00001", "\r\nsome noise\r\n")
+    assert health.ok and health.battery is None and health.free_mb is None
+
+def command():
+    return Z.ZybotCommand(vars=[("DUT1", "SERIAL00001"), ("DUT2", "SERIAL00002"), ("TESTDIR", "x")],
+                          sttls=["STTL-1"], path="TS")
+
+def fake_preflight(monkeypatch, bad):
+    def preflight(serials):
+        return {s: Z.DeviceHealth(s, "offline" if s in bad else "device", ["offline"] if s in bad else [])
+                for s in serials}
+    monkeypatch.setattr(Z, "preflight", preflight)
+
+def test_report_mode_keeps_failing_duts(monkeypatch):
+    fake_preflight(monkeypatch, {"SERIAL00002"})
+    cmd = command()
+    assert Z.apply_preflight(cmd, parallel=True, mode="report") is cmd
+
+def test_exclude_mode_drops_failing_duts_from_parallel_run(monkeypatch):
+    fake_preflight(monkeypatch, {"SERIAL00002"})
+    assert Z.apply_preflight(command(), parallel=True, mode="exclude").vars == [("DUT1", "SERIAL00001"), ("TESTDIR", "x")]
+
+def test_exclude_mode_fails_sequential_run(monkeypatch):
+    fake_preflight(monkeypatch, {"SERIAL00002"})
+    with pytest.raises(Z.PreflightError, match="SERIAL00002"):
+        Z.apply_preflight(command(), parallel=False, mode="exclude")
+
+def test_exclude_mode_fails_when_no_dut_is_left(monkeypatch):
+    fake_preflight(monkeypatch, {"SERIAL00001", "SERIAL00002"})
+    with pytest.raises(Z.PreflightError, match="No DUT"):
+        Z.apply_preflight(command(), parallel=True, mode="exclude")
+
+def test_off_mode_does_not_probe(monkeypatch):
+    monkeypatch.setattr(Z, "preflight", lambda serials: pytest.fail("probed"))
+    cmd = command()
+    assert Z.apply_preflight(cmd, parallel=True, mode="off") is cmd
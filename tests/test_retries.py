@@ -0,0 +1,138 @@
+"""Retries of failed STTL tests: retry plans, DUT rotation and exit codes across attempts."""
+import re
+
+import ZyButler as Z
+
+SERIALS = ["SERIAL00001", "SERIAL00002", "SERIAL00003"]
+
+def command(sttls=("STTL-1", "STTL-2", "STTL-3")):
+    return Z.ZybotCommand(vars=[(f"DUT{i}", s) for i, s in enumerate(SERIALS, 1)] + [("TESTDIR", "x")],
+                          sttls=list(sttls), path="TS", flags=["--outputdir", "out"])
+
+def sharded_plan(cmd):
+    plan = Z.ExecutionPlan([[shard] for shard in Z.shard_command(cmd, "round-robin")])
+    plan.parallel = True
+    plan.output_dir = "out/job"
+    return plan
+
+def retried(plan):
+    return {Z.dut_serial(c): (c.sttls, c.flags) for group in plan for c in group}
+
+def test_retry_of_unsharded_plan_reruns_only_failed_tests():
+    cmd = command()
+    plan = Z.plan_retry(cmd, Z.ExecutionPlan([[cmd]]), {"STTL-2": "SERIAL00001"}, 2)
+    [[retry]] = plan
+    assert retry.sttls == ["STTL-2"]
+    assert retry.vars == cmd.vars
+    assert retry.flags == ["--outputdir", "out/retry2"]
+
+def test_retry_moves_tests_to_the_next_dut():
+    cmd = command()
+    plan = Z.plan_retry(cmd, sharded_plan(cmd), {"STTL-1": "SERIAL00001", "STTL-3": "SERIAL00003"}, 2)
+    assert plan.parallel and plan.output_dir == "out/job"
+    assert retried(plan) == {
+        "SERIAL00001": (["STTL-3"], ["--outputdir", "out/job/retry2/SERIAL00001"]),
+        "SERIAL00002": (["STTL-1"], ["--outputdir", "out/job/retry2/SERIAL00002"]),
+    }
+
+def test_retry_skips_unhealthy_duts(monkeypatch):
+    monkeypatch.setattr(Z, "device_state", lambda serial: "offline" if serial == "SERIAL00002" else "device")
+    unhealthy = Z.UnhealthyDuts()
+    assert unhealthy.check(SERIALS) == {"SERIAL00002": "offline"}
+    cmd = command()
+    plan = Z.plan_retry(cmd, sharded_plan(cmd), {"STTL-1": "SERIAL00001"}, 2, unhealthy)
+    assert {s: sttls for s, (sttls, _) in retried(plan).items()} == {"SERIAL00003": ["STTL-1"]}
+
+def test_retry_keeps_all_duts_when_none_is_healthy(monkeypatch):
+    monkeypatch.setattr(Z, "device_state", lambda serial: "offline")
+    unhealthy = Z.UnhealthyDuts()
+    unhealthy.check(SERIALS)
+    cmd = command()
+    plan = Z.plan_retry(cmd, sharded_plan(cmd), {"STTL-1": "SERIAL00001"}, 2, unhealthy)
+    assert {s: sttls for s, (sttls, _) in retried(plan).items()} == {"SERIAL00002": ["STTL-1"]}
+
+def test_recovered_dut_is_forgotten(monkeypatch):
+    states = {"SERIAL00001": "offline"}
+    monkeypatch.setattr(Z, "device_state", lambda serial: states.get(serial, "device"))
+    unhealthy = Z.UnhealthyDuts()
+    unhealthy.check(["SERIAL00001"])
+    assert "SERIAL00001" in unhealthy
+    states.clear()
+    assert unhealthy.check(["SERIAL00001"]) == {}
+    assert "SERIAL00001" not in unhealthy
+
+class FakeRuns:
+    """Stands in for run_plan: attempts[n] maps STTL ID -> status for attempt n+1; IDs left
+    out produce no result. Each command exits with its failure count (or error_rc)."""
+
+    def __init__(self, attempts, error_rc=None):
+        self.attempts = attempts
+        self.error_rc = error_rc
+        self.plans = []
+
+    def __call__(self, plan, on_line, on_result=None, on_exit=None, **kwargs):
+        statuses = self.attempts[len(self.plans)]
+        self.plans.append(plan)
+        codes = []
+        for group in plan:
+            for cmd in group:
+                failures = 0
+                for sid in cmd.sttls:
+                    if sid in statuses:
+                        on_result(Z.TestResult(sid.upper(), statuses[sid], 1.0, dut=Z.dut_serial(cmd)))
+                        failures += statuses[sid] == 'FAIL'
+                rc = self.error_rc if self.error_rc is not None and len(self.plans) == 1 else failures
+                on_exit(cmd, rc)
+                codes.append(rc)
+        return Z.merge_return_codes(codes)
+
+def run(monkeypatch, attempts, max_attempts, policy=None, error_rc=None):
+    fake = FakeRuns(attempts, error_rc)
+    monkeypatch.setattr(Z, "run_plan", fake)
+    cmd = command()
+    recorded = []
+    policy = policy or Z.RetryPolicy(max_attempts=max_attempts, backoff=0)
+    rc = Z.run_with_retries(cmd, Z.ExecutionPlan([[cmd]]), lambda line: None, policy=policy,
+                            record=lambda result, attempt: recorded.append((result.sttl, result.status, attempt)))
+    return rc, fake.plans, recorded
+
+def test_failed_test_passes_on_retry(monkeypatch):
+    rc, plans, recorded = run(monkeypatch, [{"STTL-1": "PASS", "STTL-2": "FAIL", "STTL-3": "PASS"},
+                                            {"STTL-2": "PASS"}], max_attempts=3)
+    assert rc == 0
+    assert [c.sttls for c in plans[1][0]] == [["STTL-2"]]
+    assert ("STTL-2", "FAIL", 1) in recorded and ("STTL-2", "PASS", 2) in recorded
+
+def test_attempts_are_capped(monkeypatch):
+    rc, plans, _ = run(monkeypatch, [{"STTL-1": "FAIL"}, {"STTL-1": "FAIL"}, {"STTL-1": "FAIL"}], max_attempts=2)
+    assert len(plans) == 2
+    assert rc == 1
+
+def test_no_retries_by_default(monkeypatch):
+    rc, plans, _ = run(monkeypatch, [{"STTL-1": "FAIL", "STTL-2": "FAIL"}], max_attempts=1)
+    assert len(plans) == 1
+    assert rc == 2
+
+def test_failures_not_retried_stay_in_exit_code(monkeypatch):
+    policy = Z.RetryPolicy(max_attempts=2, backoff=0, messages=(re.compile("flaky"),))
+    fake = FakeRuns([{"STTL-1": "FAIL", "STTL-2": "FAIL"}, {"STTL-1": "PASS"}])
+    cmd = command()
+    def emit_messages(plan, on_line, on_result=None, on_exit=None, **kwargs):
+        def with_message(result):
+            result.message = "flaky radio" if result.sttl == "STTL-1" else "real bug"
+            on_result(result)
+        return fake(plan, on_line, on_result=with_message, on_exit=on_exit)
+    monkeypatch.setattr(Z, "run_plan", emit_messages)
+    rc = Z.run_with_retries(cmd, Z.ExecutionPlan([[cmd]]), lambda line: None, policy=policy)
+    assert [c.sttls for c in fake.plans[1][0]] == [["STTL-1"]]
+    assert rc == 1  # STTL-2 was not retried and still counts
+
+def test_tests_without_result_are_retried_after_execution_error(monkeypatch):
+    rc, plans, _ = run(monkeypatch, [{"STTL-1": "PASS"}, {"STTL-2": "PASS", "STTL-3": "PASS"}], max_attempts=2,
+                       error_rc=Z.EXECUTION_ERROR_RC)
+    assert [c.sttls for c in plans[1][0]] == [["STTL-2", "STTL-3"]]
+    assert rc == 0
+
+def test_backoff_grows_per_attempt():
+    policy = Z.RetryPolicy(max_attempts=4, backoff=2, backoff_factor=3)
+    assert [policy.delay(n) for n in (2, 3, 4)] == [2, 6, 18]
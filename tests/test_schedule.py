@@ -0,0 +1,44 @@
+"""Duration-balanced sharding: LPT scheduling from the run history."""
+import ZyButler as Z
+
+class FakeHistory:
+    def __init__(self, durations):
+        self._durations = durations
+
+    def durations(self, sttls):
+        return {sid: self._durations[sid] for sid in sttls if sid in self._durations}
+
+def test_lpt_assigns_longest_first_to_least_loaded():
+    durations = {"A": 7, "B": 6, "C": 5, "D": 4, "E": 3, "F": 2}
+    assert Z.schedule_lpt(list("FEDCBA"), 2, durations) == [["A", "D", "E"], ["B", "C", "F"]]
+
+def test_lpt_assigns_every_test_once():
+    durations = {f"STTL-{n}": float(n % 7 + 1) for n in range(100)}
+    buckets = Z.schedule_lpt(list(durations), 6, durations)
+    assert sorted(sid for b in buckets for sid in b) == sorted(durations)
+    loads = [sum(durations[sid] for sid in b) for b in buckets]
+    assert max(loads) - min(loads) <= max(durations.values())
+
+def test_lpt_with_more_bins_than_tests():
+    assert Z.schedule_lpt(["A"], 3, {"A": 1.0}) == [["A"], [], []]
+
+def test_estimate_uses_median_and_default(monkeypatch):
+    monkeypatch.setattr(Z, "get_history", lambda: FakeHistory({"STTL-1": [10.0, 30.0, 20.0]}))
+    assert Z.estimate_durations(["STTL-1", "STTL-2"]) == {"STTL-1": 20.0, "STTL-2": Z.DEFAULT_TEST_DURATION}
+
+def test_estimate_without_history(monkeypatch):
+    monkeypatch.setattr(Z, "get_history", lambda: None)
+    assert Z.estimate_durations(["STTL-1"]) == {"STTL-1": Z.DEFAULT_TEST_DURATION}
+
+def test_lpt_shards_balance_recorded_durations(monkeypatch):
+    monkeypatch.setattr(Z, "get_history", lambda: FakeHistory({"STTL-1": [600.0], "STTL-2": [300.0], "STTL-3": [300.0]}))
+    command = Z.ZybotCommand(vars=[("DUT1", "SERIAL00001"), ("DUT2", "SERIAL00002")],
+                             sttls=["STTL-1", "STTL-2", "STTL-3"], path="TS")
+    shards = Z.shard_command(command, "lpt")
+    assert [(Z.dut_serial(s), s.sttls) for s in shards] == [("SERIAL00001", ["STTL-1"]),
+                                                            ("SERIAL00002", ["STTL-2", "STTL-3"])]
+
+def test_empty_shards_are_dropped(monkeypatch):
+    monkeypatch.setattr(Z, "get_history", lambda: None)
+    command = Z.ZybotCommand(vars=[(f"DUT{i}", f"SERIAL0000{i}") for i in (1, 2, 3)], sttls=["STTL-1"])
+    assert len(Z.shard_command(command, "lpt")) == 1
@@ -0,0 +1,49 @@
+"""Streaming STTL IDs out of export files (iter_sttl_ids) and the GUI paste box."""
+import io
+import random
+import re
+
+import pytest
+
+import ZyButler as Z
+
+def stream_ids(text, chunk_size):
+    return list(Z.iter_sttl_ids(io.StringIO(text), chunk_size=chunk_size))
+
+def reference(text):
+    return [f"STTL-{n}" for n in dict.fromkeys(Z.STTL_ID_PATTERN.findall(text))]
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 8, 13, 1 << 20])
+def test_ids_cut_at_chunk_boundaries(chunk_size):
+    text = 'id,title\n"STTL-123456",x\nSTTL-7;STTL-123456 STTL/STTL-42 STT STTL- STTL-99\n'
+    assert stream_ids(text, chunk_size) == ["STTL-123456", "STTL-7", "STTL-42", "STTL-99"]
+
+def test_every_chunk_size_matches_one_findall():
+    rng = random.Random(7)
+    tokens = ["STTL-", "STTL", "STT", "S", "T", "L", "-", " ", ",", "\n", "x"] + [str(rng.randint(0, 99999)) for _ in range(10)]
+    for _ in range(200):
+        text = "".join(rng.choice(tokens) for _ in range(rng.randint(0, 40)))
+        if re.search(r"STTL-\d{%d,}" % (Z.STTL_ID_MAX_LEN - len("STTL-")), text):
+            continue  # longer digit runs are not IDs and may be cut (see STTL_ID_MAX_LEN)
+        for chunk_size in range(1, 10):
+            assert stream_ids(text, chunk_size) == reference(text), (text, chunk_size)
+
+def test_carry_is_bounded():
+    # a long run of ID-like characters is not carried along chunk after chunk
+    text = "STTL-" + "1" * 100 + " STTL-5"
+    ids = stream_ids(text, 16)
+    assert ids[-1] == "STTL-5"
+
+def test_seen_is_shared_across_streams():
+    seen = set()
+    assert list(Z.iter_sttl_ids(io.StringIO("STTL-1 STTL-2"), seen)) == ["STTL-1", "STTL-2"]
+    assert list(Z.iter_sttl_ids(io.StringIO("STTL-2 STTL-3"), seen)) == ["STTL-3"]
+
+def test_read_sttl_ids_from_files(tmp_path):
+    first, second = tmp_path / "a.csv", tmp_path / "b.xml"
+    first.write_text("STTL-1,STTL-2\n", encoding="utf-8")
+    second.write_text("<id>STTL-2</id><id>STTL-3</id>", encoding="utf-8")
+    assert Z.read_sttl_ids([str(first), str(second)]) == ["STTL-1", "STTL-2", "STTL-3"]
+
+def test_paste_box_accepts_bare_numbers():
+    assert Z.parse_sttl_ids_any("STTL/STTL-1234, 5678\nSTTL-1234 12") == ["STTL-1234", "STTL-5678"]
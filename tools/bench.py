@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark suite for ZyButler.
+
+Runs the parsing, command-building, scheduling and execution paths against synthetic
+inputs (10 to 100k STTL IDs, 1 to 32 DUTs) using the fake zybot/adb in this directory,
+and reports time per call, throughput and peak memory (tracemalloc) per case.
+
+Usage:
+    python tools/bench.py                          # run all cases, print the table
+    python tools/bench.py --quick -k parse         # smaller sizes, only cases matching 'parse'
+    python tools/bench.py --save baseline.json     # store results as a baseline
+    python tools/bench.py --compare baseline.json  # exit 1 if a case got slower/larger than --tolerance
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TOOLS_DIR))
+os.environ.setdefault("ZYBUTLER_NO_HISTORY", "1")  # keep the local run history out of measurements
+
+import ZyButler as Z  # noqa: E402
+
+ID_SIZES = (10, 100, 1000, 10000, 100000)
+DUT_SIZES = (1, 2, 4, 8, 16, 32)
+QUICK_ID_SIZES = (10, 1000, 10000)
+QUICK_DUT_SIZES = (1, 4, 16)
+MIN_TIME = 0.2  # seconds each measurement loop runs for
+REPEAT = 3  # measurement loops per case; the fastest counts
+DEFAULT_TOLERANCE = 0.25  # allowed relative growth in --compare mode
+
+CASES = []
+
+def case(name, **params):
+    """Register a benchmark: setup(**params) returns (callable, items processed per call, cleanup or None)."""
+    def register(setup):
+        CASES.append((name, params, setup))
+        return setup
+    return register
+
+def sttl_ids(n):
+    return [f"STTL-{100000 + i}" for i in range(n)]
+
+def dut_vars(n):
+    return [f"DUT{i}:FAKE{i:06d}" for i in range(1, n + 1)]
+
+def fake_zybot():
+    return f'"{sys.executable}" "{os.path.join(TOOLS_DIR, "fake_zybot.py")}"'
+
+def fake_adb(tmp):
+    """Wrapper executable for fake_adb.py (DeviceTracker runs adb as a single program path)."""
+    script = os.path.join(TOOLS_DIR, "fake_adb.py")
+    if os.name == 'nt':
+        path = os.path.join(tmp, "adb.bat")
+        with open(path, 'w') as f:
+            f.write(f'@"{sys.executable}" "{script}" %*\n')
+    else:
+        path = os.path.join(tmp, "adb")
+        with open(path, 'w') as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{script}" "$@"\n')
+        os.chmod(path, 0o755)
+    return path
+
+# ---------------- Cases ----------------
+
+@case("parse_sttl_block", ids=ID_SIZES)
+def bench_parse_sttl_block(ids):
+    raw = "id:(" + " ".join(f"STTL/{sid}" for sid in sttl_ids(ids)) + ")"
+    return (lambda: Z.parse_sttl_block(raw)), ids, None
+
+@case("parse_sttl_ids_any", ids=ID_SIZES)
+def bench_parse_sttl_ids_any(ids):
+    raw = "\n".join(f"{sid}\tVerify feature {i}\tApproved" for i, sid in enumerate(sttl_ids(ids)))
+    return (lambda: Z.parse_sttl_ids_any(raw)), ids, None
+
+@case("read_sttl_ids", ids=ID_SIZES)
+def bench_read_sttl_ids(ids):
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    with os.fdopen(fd, 'w') as f:
+        f.write("ID,Title,Status\n")
+        for i, sid in enumerate(sttl_ids(ids)):
+            f.write(f'{sid},"Verify feature {i} on 2024-01-01",Approved\n')
+    return (lambda: Z.read_sttl_ids([path])), ids, lambda: os.remove(path)
+
+@case("parse_vars", duts=DUT_SIZES)
+def bench_parse_vars(duts):
+    tokens = dut_vars(duts) + ["TESTDIR:/data/local/tmp"]
+    return (lambda: Z.parse_vars(tokens)), duts, None
+
+@case("parse_flags", flags=(1, 8, 32))
+def bench_parse_flags(flags):
+    specs = [f"--loglevel DEBUG --metadata key{i}:value{i}" for i in range(flags)]
+    return (lambda: Z.parse_flags(specs)), flags, None
+
+def make_command(ids, duts=1):
+    return Z.build_command(dut_vars(duts), sttl_ids(ids), "TS/ANDROID/", flags=["-L", "TRACE"])
+
+@case("build_args", ids=ID_SIZES)
+def bench_build_args(ids):
+    command = make_command(ids)
+    return command.build_args, ids, None
+
+@case("display_command", ids=ID_SIZES)
+def bench_display_command(ids):
+    command = make_command(ids)
+    return command.display_command, ids, None
+
+@case("pretty", ids=ID_SIZES)
+def bench_pretty(ids):
+    command = make_command(ids)
+    return command.pretty, ids, None
+
+@case("shard_command", ids=(1000, 100000), duts=DUT_SIZES)
+def bench_shard_command(ids, duts):
+    command = make_command(ids, duts)
+    return (lambda: Z.shard_command(command)), ids, None
+
+@case("run_plan", duts=DUT_SIZES)
+def bench_run_plan(duts):
+    # End-to-end dispatch through the fake zybot: spawn, stream and parse 10 tests per DUT
+    tmp = tempfile.mkdtemp(prefix="zybutler_bench_")
+    Z.ZYBOT_EXECUTABLE = fake_zybot()
+    command = make_command(10 * duts, duts)
+    def run():
+        Z.run_plan(Z.plan_execution(command, parallel=duts > 1), lambda line: None, cwd=tmp)
+    return run, 10 * duts, lambda: shutil.rmtree(tmp, ignore_errors=True)
+
+@case("progress_stream", ids=(100, 10000))
+def bench_progress_stream(ids):
+    # Per-line cost of the live progress display: parse, count and echo 10 log lines per test
+    sttls = sttl_ids(ids)
+    lines = []
+    for sid in sttls:
+        lines += [f"[ INFO ] {sid} step {i}" for i in range(10)]
+        lines += [f"{sid} Fake test".ljust(70) + "| PASS |", "-" * 78]
+    devnull = open(os.devnull, 'w')
+    def run():
+        progress = Z.Progress(sttls, durations=dict.fromkeys(sttls, 1.0))
+        display = Z.ProgressDisplay(progress, stream=devnull)
+        parser = Z.ResultParser()
+        for line in lines:
+            result = parser.feed(line)
+            if result:
+                progress.update(result)
+            display.on_line(line)
+        display.refresh()
+    return run, len(lines), devnull.close
+
+@case("merge_results", ids=(1000, 100000), files=(2, 16))
+def bench_merge_results(ids, files):
+    # Streaming merge of per-shard output.xml files into merged.xml + summary.json
+    tmp = tempfile.mkdtemp(prefix="zybutler_bench_")
+    shards = [sttl_ids(ids)[i::files] for i in range(files)]
+    for i, shard in enumerate(shards):
+        os.makedirs(os.path.join(tmp, f"FAKE{i:06d}"))
+        with open(os.path.join(tmp, f"FAKE{i:06d}", "output.xml"), 'w', encoding='utf-8') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n<robot>\n<suite name="Bench">\n')
+            for sid in shard:
+                f.write(f'<test name="{sid} Verify feature">\n<kw name="Step"><msg>log</msg></kw>\n'
+                        f'<status status="PASS" start="2024-01-01T10:00:00.000000" elapsed="1.500"/>\n</test>\n')
+            f.write('</suite>\n</robot>\n')
+    return (lambda: Z.merge_results(tmp)), ids, lambda: shutil.rmtree(tmp, ignore_errors=True)
+
+@case("device_tracker", duts=DUT_SIZES)
+def bench_device_tracker(duts):
+    tmp = tempfile.mkdtemp(prefix="zybutler_bench_")
+    adb = fake_adb(tmp)
+    os.environ["FAKE_ADB_DEVICES"] = str(duts)
+    def run():
+        tracker = Z.DeviceTracker(adb=adb).start()
+        try:
+            tracker.wait_ready(10)
+            if len(tracker.devices()) != duts:
+                raise RuntimeError(f"fake adb reported {len(tracker.devices())} of {duts} devices")
+        finally:
+            tracker.stop()
+    return run, duts, lambda: shutil.rmtree(tmp, ignore_errors=True)
+
+@case("gui_list_set_items", ids=ID_SIZES)
+def bench_gui_list(ids):
+    import tkinter as tk
+    import zybutler_gui
+    root = tk.Tk()  # raises TclError without a display; the case is then skipped
+    root.withdraw()
+    view = zybutler_gui.VirtualList(root, rows=10)
+    items = sttl_ids(ids)
+    def run():
+        view.set_items(items)
+        root.update_idletasks()
+    return run, ids, root.destroy
+
+# ---------------- Measurement ----------------
+
+def measure(fn):
+    """Fastest seconds per call over REPEAT loops of at least MIN_TIME each."""
+    best = float('inf')
+    for _ in range(REPEAT):
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            fn()
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= MIN_TIME:
+                break
+        best = min(best, elapsed / calls)
+    return best
+
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def expand(params, quick):
+    """All parameter combinations of a case, with --quick sizes substituted."""
+    combos = [{}]
+    for key, values in params.items():
+        if quick:
+            values = tuple(v for v in values if v in {"ids": QUICK_ID_SIZES, "duts": QUICK_DUT_SIZES}.get(key, values)) or values[:1]
+        combos = [dict(c, **{key: v}) for c in combos for v in values]
+    return combos
+
+def case_key(name, params):
+    return name + "[" + ",".join(f"{k}={v}" for k, v in params.items()) + "]"
+
+def run_cases(pattern=None, quick=False):
+    results = {}
+    for name, params, setup in CASES:
+        for combo in expand(params, quick):
+            key = case_key(name, combo)
+            if pattern and pattern not in key:
+                continue
+            try:
+                fn, items, cleanup = setup(**combo)
+            except Exception as e:  # e.g. no display for the GUI case
+                print(f"{key:44} skipped: {e}")
+                continue
+            try:
+                fn()  # warm-up (imports, caches)
+                seconds = measure(fn)
+                peak = peak_memory(fn)
+            finally:
+                if cleanup:
+                    cleanup()
+            results[key] = {"seconds": seconds, "items_per_sec": items / seconds, "peak_kb": peak / 1024}
+            print(f"{key:44} {seconds * 1000:10.3f} ms {items / seconds:14,.0f} items/s {peak / 1024:10.1f} KiB")
+    return results
+
+def compare(results, baseline, tolerance):
+    """Print the change per case against baseline; return the keys that regressed beyond tolerance."""
+    regressions = []
+    print(f"\n{'case':44} {'time':>9} {'memory':>9}")
+    for key, base in baseline.items():
+        cur = results.get(key)
+        if not cur:
+            continue
+        dt = cur["seconds"] / base["seconds"] - 1
+        dm = cur["peak_kb"] / base["peak_kb"] - 1 if base["peak_kb"] else 0.0
+        flag = ""
+        if dt > tolerance or dm > tolerance:
+            regressions.append(key)
+            flag = "  REGRESSION"
+        print(f"{key:44} {dt:+9.1%} {dm:+9.1%}{flag}")
+    return regressions
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Offline ZyButler benchmarks")
+    p.add_argument("-k", metavar="SUBSTRING", help="Only run cases whose name contains SUBSTRING")
+    p.add_argument("--quick", action="store_true", help="Run a reduced set of input sizes")
+    p.add_argument("--save", metavar="JSON", help="Write results as a baseline file")
+    p.add_argument("--compare", metavar="JSON", help="Compare against a baseline file; exit 1 on regression")
+    p.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed relative slowdown/memory growth (default 0.25)")
+    args = p.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    results = run_cases(args.k, args.quick)
+    if args.save:
+        meta = {"python": platform.python_version(), "platform": platform.platform(),
+                "created": time.strftime("%Y-%m-%d %H:%M:%S")}
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+        print(f"\nBaseline written to {args.save}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) regressed by more than {args.tolerance:.0%}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Stand-in for adb used by the offline benchmarks and load tests.
+Supports `start-server`, `kill-server`, `devices`, `track-devices` (length-prefixed device
+lists, as adb sends them), `[-s SERIAL] get-state`, `[-s SERIAL] logcat ...` (threadtime lines
+until killed) and `[-s SERIAL] shell ...` (no output, except `getprop ro.build.fingerprint` and
+`date +FORMAT`, key=value health values for ZyButler's pre-flight probe, `sha256sum PATH...` and
+`pm list packages -f`). `push SRC DEST` and `install [OPTIONS] APK` copy into a per-device
+directory under FAKE_ADB_ROOT, which `sha256sum` and `pm` then report on; an installed APK's
+package name is its file name without .apk.
+
+Behaviour is configured through the environment:
+    FAKE_ADB_DEVICES        number of devices, serials FAKE000001... (default 4)
+    FAKE_ADB_START_DELAY    seconds `start-server` takes, e.g. to simulate a cold server (default 0)
+    FAKE_ADB_HOTPLUG        seconds between simulated unplug/offline/replug events in
+                            track-devices (default 0: no hot-plug)
+    FAKE_ADB_SEED           make the hot-plug sequence deterministic
+    FAKE_ADB_BUILD          build id in the reported ro.build.fingerprint (default 1)
+    FAKE_ADB_LOGCAT_RATE    logcat lines per second (default 100)
+    FAKE_ADB_OFFLINE        comma-separated serials reported as offline
+    FAKE_ADB_BATTERY        battery level in percent reported to the pre-flight probe (default 100)
+    FAKE_ADB_SHELL_DELAY    seconds every `shell` command takes (default 0)
+    FAKE_ADB_ROOT           directory holding the simulated device file systems (default: pushes
+                            and installs succeed but are not stored)
+    FAKE_ADB_TRANSFER_DELAY seconds every `push` / `install` takes (default 0)
+"""
+import hashlib
+import os
+import random
+import shlex
+import shutil
+import sys
+import time
+
+def serials():
+    count = int(os.environ.get("FAKE_ADB_DEVICES", "4"))
+    return [f"FAKE{i:06d}" for i in range(1, count + 1)]
+
+def device_list(devices):
+    return "".join(f"{s}\t{state}\n" for s, state in devices.items())
+
+def emit(devices):
+    payload = device_list(devices).encode()
+    sys.stdout.buffer.write(b"%04x" % len(payload) + payload)
+    sys.stdout.flush()
+
+def track_devices():
+    devices = {s: "device" for s in serials()}
+    all_serials = list(devices)
+    emit(devices)
+    interval = float(os.environ.get("FAKE_ADB_HOTPLUG") or 0)
+    seed = os.environ.get("FAKE_ADB_SEED")
+    rng = random.Random(seed) if seed is not None else random.Random()
+    while True:
+        if interval <= 0 or not all_serials:
+            time.sleep(3600)
+            continue
+        time.sleep(interval)
+        serial = rng.choice(all_serials)
+        state = devices.get(serial)
+        if state is None or state == "offline":
+            devices[serial] = "device"  # replugged / back online
+        elif rng.random() < 0.5:
+            del devices[serial]  # unplugged
+        else:
+            devices[serial] = "offline"
+        emit(devices)
+
+def logcat(serial):
+    rate = float(os.environ.get("FAKE_ADB_LOGCAT_RATE") or 100)
+    batch = max(1, int(rate / 10))
+    pid = os.getpid()
+    n = 0
+    while True:
+        now = time.time()
+        stamp = time.strftime("%m-%d %H:%M:%S", time.localtime(now)) + f".{int(now % 1 * 1000):03d}"
+        lines = []
+        for _ in range(batch):
+            n += 1
+            lines.append(f"{stamp} {pid:5d} {pid:5d} D FakeTag: {serial} log line {n}\n")
+        sys.stdout.write("".join(lines))
+        sys.stdout.flush()
+        time.sleep(batch / rate)
+
+def device_path(serial, path):
+    """Host location of a device path in the simulated file system, or None without FAKE_ADB_ROOT."""
+    root = os.environ.get("FAKE_ADB_ROOT")
+    return os.path.join(root, serial, path.lstrip("/")) if root else None
+
+def transfer(serial, src, dest):
+    time.sleep(float(os.environ.get("FAKE_ADB_TRANSFER_DELAY") or 0))
+    target = device_path(serial, dest)
+    if target:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(src, target)
+
+def shell(serial, script):
+    """The shell commands ZyButler's artifact staging runs; returns the exit code."""
+    args = shlex.split(script)
+    if args[:1] == ["sha256sum"]:
+        rc = 0
+        for path in args[1:]:
+            local = device_path(serial, path)
+            if local and os.path.isfile(local):
+                with open(local, "rb") as f:
+                    sys.stdout.write(f"{hashlib.sha256(f.read()).hexdigest()}  {path}\n")
+            else:
+                sys.stderr.write(f"sha256sum: {path}: No such file or directory\n")
+                rc = 1
+        return rc
+    if args == ["pm", "list", "packages", "-f"]:
+        apps = device_path(serial, "/data/app")
+        for package in sorted(os.listdir(apps)) if apps and os.path.isdir(apps) else []:
+            sys.stdout.write(f"package:/data/app/{package}/base.apk={package}\n")
+    return 0
+
+def main(argv):
+    serial = None
+    if len(argv) >= 2 and argv[0] == "-s":
+        serial, argv = argv[1], argv[2:]
+    cmd = argv[0] if argv else ""
+    if cmd == "start-server":
+        time.sleep(float(os.environ.get("FAKE_ADB_START_DELAY") or 0))
+        return 0
+    if cmd == "kill-server":
+        return 0
+    if cmd == "devices":
+        sys.stdout.write("List of devices attached\n" + device_list({s: "device" for s in serials()}) + "\n")
+        return 0
+    if cmd == "track-devices":
+        track_devices()
+    if cmd in ("get-state", "shell", "logcat", "push", "install"):
+        if serial and serial not in serials():
+            sys.stderr.write(f"error: device '{serial}' not found\n")
+            return 1
+        if serial in (os.environ.get("FAKE_ADB_OFFLINE") or "").split(","):
+            sys.stderr.write("error: device offline\n")
+            return 1
+        if cmd == "shell":
+            time.sleep(float(os.environ.get("FAKE_ADB_SHELL_DELAY") or 0))
+        if cmd == "get-state":
+            sys.stdout.write("device\n")
+        elif cmd == "push":
+            transfer(serial, argv[1], argv[2])
+            sys.stdout.write(f"{argv[1]}: 1 file pushed.\n")
+        elif cmd == "install":
+            apk = argv[-1]
+            package = os.path.splitext(os.path.basename(apk))[0]
+            transfer(serial, apk, f"/data/app/{package}/base.apk")
+            sys.stdout.write("Performing Streamed Install\nSuccess\n")
+        elif cmd == "logcat":
+            logcat(serial or serials()[0])
+        elif argv[1:2] == ["date"] and len(argv) == 3:
+            now = time.time()
+            fmt = argv[2].lstrip("+").replace("%s", str(int(now))).replace("%N", f"{int(now % 1 * 1e9):09d}")
+            sys.stdout.write(time.strftime(fmt, time.localtime(now)) + "\n")
+        elif len(argv) == 2 and "echo boot=" in argv[1]:
+            battery = os.environ.get("FAKE_ADB_BATTERY") or "100"
+            sys.stdout.write(f"boot=1\nbattery={battery}\ncharging=0\nfree_kb=8388608\nwake=Awake\nlocked=false\n")
+        elif len(argv) == 2:
+            return shell(serial, argv[1])
+        elif argv[1:] == ["getprop", "ro.build.fingerprint"]:
+            build = os.environ.get("FAKE_ADB_BUILD") or "1"
+            sys.stdout.write(f"fake/fake_phone/fake:14/FAKE.{build}/{build}:user/release-keys\n")
+        return 0
+    sys.stderr.write(f"fake adb: unsupported command {cmd!r}\n")
+    return 1
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main(sys.argv[1:]))
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Stand-in for zybot used by the offline benchmarks and load tests.
+Accepts the options ZyButler passes (-v/--variable, -t/--test, -d/--outputdir, -A/--argumentfile
+and other flags), prints Robot Framework style console output per test, writes output.xml to the
+output directory and exits with the failed-test count, so ZyButler's execution paths can run
+without phones or Robot Framework.
+
+Behaviour is configured through the environment (inherited from ZyButler):
+    FAKE_ZYBOT_DURATION      seconds per test: "0.5" or a uniform range "0.1:2.0" (default 0)
+    FAKE_ZYBOT_FAIL_RATE     probability a test fails (default 0)
+    FAKE_ZYBOT_HANG_RATE     probability a test hangs for FAKE_ZYBOT_HANG_SECONDS (default 0 / 3600)
+    FAKE_ZYBOT_OUTPUT_LINES  extra log lines printed per test (default 0)
+    FAKE_ZYBOT_SEED          make outcomes deterministic per test name (default: random)
+    FAKE_ZYBOT_NO_XML        set to skip writing output.xml
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from xml.sax.saxutils import quoteattr
+
+VALUE_OPTIONS = {"-v", "--variable", "-t", "--test", "-d", "--outputdir", "-A", "--argumentfile",
+                 "-L", "--loglevel", "-i", "--include", "-e", "--exclude", "-s", "--suite"}
+MAX_FAILED_RC = 250
+
+def env_float(name, default=0.0):
+    return float(os.environ.get(name) or default)
+
+def duration_range():
+    spec = os.environ.get("FAKE_ZYBOT_DURATION") or "0"
+    low, _, high = spec.partition(":")
+    return float(low), float(high or low)
+
+def expand_args(argv):
+    """Inline --argumentfile contents (one option per line, "--opt value")."""
+    args = []
+    i = 0
+    while i < len(argv):
+        if argv[i] in ("-A", "--argumentfile") and i + 1 < len(argv):
+            with open(argv[i + 1], encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith("#"):
+                        args.extend(line.split(" ", 1))
+            i += 2
+            continue
+        args.append(argv[i])
+        i += 1
+    return args
+
+def parse_options(args):
+    """Return (test names, output dir, variables)."""
+    tests, variables = [], {}
+    outputdir = "."
+    i = 0
+    while i < len(args):
+        if args[i] in VALUE_OPTIONS and i + 1 < len(args):
+            opt, value = args[i], args[i + 1]
+            if opt in ("-t", "--test"):
+                tests.append(value.rstrip("*"))
+            elif opt in ("-d", "--outputdir"):
+                outputdir = value
+            elif opt in ("-v", "--variable"):
+                key, _, val = value.partition(":")
+                variables[key] = val
+            i += 2
+            continue
+        i += 1
+    return tests, outputdir, variables
+
+def rng_for(name):
+    seed = os.environ.get("FAKE_ZYBOT_SEED")
+    return random.Random(f"{seed}:{name}") if seed is not None else random.Random()
+
+def run_test(name, dut, out):
+    """Simulate one test; return (status, start timestamp, elapsed seconds)."""
+    rng = rng_for(name)
+    low, high = duration_range()
+    duration = rng.uniform(low, high)
+    failed = rng.random() < env_float("FAKE_ZYBOT_FAIL_RATE")
+    hangs = rng.random() < env_float("FAKE_ZYBOT_HANG_RATE")
+    extra = int(env_float("FAKE_ZYBOT_OUTPUT_LINES"))
+    started = time.time()
+    for i in range(extra):
+        out.write(f"[ INFO ] {name} on {dut}: step {i + 1}/{extra}\n")
+    out.flush()
+    if hangs:
+        time.sleep(env_float("FAKE_ZYBOT_HANG_SECONDS", 3600))
+    time.sleep(duration)
+    status = "FAIL" if failed else "PASS"
+    out.write(f"{name} Fake test".ljust(70) + f"| {status} |\n")
+    if failed:
+        out.write(f"Simulated failure on {dut}\n")
+    out.write("-" * 78 + "\n")
+    out.flush()
+    return status, started, time.time() - started
+
+def write_output_xml(outputdir, results):
+    os.makedirs(outputdir, exist_ok=True)
+    with open(os.path.join(outputdir, "output.xml"), "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<robot generator="fake_zybot">\n<suite name="Fake Suite">\n')
+        for name, status, started, elapsed in results:
+            start = datetime.fromtimestamp(started).isoformat(timespec="microseconds")
+            f.write(f'<test name={quoteattr(name + " Fake test")}>\n'
+                    f'<status status="{status}" start="{start}" elapsed="{elapsed:.3f}"/>\n</test>\n')
+        f.write("</suite>\n</robot>\n")
+
+def main(argv):
+    tests, outputdir, variables = parse_options(expand_args(argv))
+    dut = variables.get("DUT1", "-")
+    out = sys.stdout
+    out.write("=" * 78 + "\nFake Suite\n" + "=" * 78 + "\n")
+    results = [(name,) + run_test(name, dut, out) for name in tests]
+    failed = sum(1 for r in results if r[1] == "FAIL")
+    out.write(f"{len(tests)} tests, {len(tests) - failed} passed, {failed} failed\n")
+    out.flush()
+    if not os.environ.get("FAKE_ZYBOT_NO_XML"):
+        write_output_xml(outputdir, results)
+    return min(failed, MAX_FAILED_RC)
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Load test for ZyButler's dispatcher against the fake zybot/adb in this directory.
+
+Runs thousands of simulated tests across hundreds of simulated DUTs, through either the
+in-process execution path (plan_execution + run_plan, the code behind ZyButler.execute) or
+the full CLI, and reports scheduling overhead, throughput and per-test tail latency.
+
+Usage:
+    python tools/loadtest.py --duts 200 --tests 5000 --duration 0.01:0.05
+    python tools/loadtest.py --duts 64 --tests 2000 --schedule steal --fail-rate 0.05
+    python tools/loadtest.py --mode cli --duts 32 --tests 1000
+    python tools/loadtest.py --hang-rate 0.001 --timeout 60 --hotplug 0.5
+    python tools/loadtest.py --hang-rate 0.01 --idle-timeout 2     # hung tests are killed and re-queued
+"""
+import argparse
+import contextlib
+import json
+import logging
+import math
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+# Simulated serials must never be leased in the host's shared lease directory, where real runs would see them
+LEASE_DIR = tempfile.mkdtemp(prefix="zybutler_load_leases_")
+os.environ["ZYBUTLER_LEASE_DIR"] = LEASE_DIR
+
+from bench import dut_vars, fake_adb, fake_zybot, sttl_ids  # noqa: E402
+import ZyButler as Z  # noqa: E402
+
+def percentile(values, pct):
+    """Nearest-rank percentile (same definition as the run history)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+def configure_fakes(args):
+    os.environ["FAKE_ZYBOT_DURATION"] = args.duration
+    os.environ["FAKE_ZYBOT_FAIL_RATE"] = str(args.fail_rate)
+    os.environ["FAKE_ZYBOT_HANG_RATE"] = str(args.hang_rate)
+    os.environ["FAKE_ZYBOT_OUTPUT_LINES"] = str(args.output_lines)
+    if args.seed is not None:
+        os.environ["FAKE_ZYBOT_SEED"] = os.environ["FAKE_ADB_SEED"] = str(args.seed)
+    os.environ["FAKE_ADB_DEVICES"] = str(args.duts)
+    os.environ["FAKE_ADB_HOTPLUG"] = str(args.hotplug)
+    Z.ZYBOT_EXECUTABLE = fake_zybot()
+
+def watch_hotplug(tmp, events):
+    """DeviceTracker on the fake adb; counts add/change/remove events during the run."""
+    tracker = Z.DeviceTracker(adb=fake_adb(tmp)).start()
+    tracker.wait_ready(10)
+    tracker.add_listener(lambda event, serial, state: events.append(event))
+    return tracker
+
+def run_execute(args, command, cwd):
+    """Drive plan_execution + run_plan in-process, collecting per-test results and spawns."""
+    results, spawns, procs = [], [], []
+    lines = [0]
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def on_line(line):
+        lines[0] += 1
+
+    def on_spawn(proc):
+        with lock:
+            spawns.append(time.monotonic())
+            procs.append(proc)
+
+    def on_result(result):
+        with lock:
+            results.append(result)
+
+    start = time.monotonic()
+    plan = Z.plan_execution(command, parallel=True, schedule=args.schedule, steal_batch=args.steal_batch)
+    planned = time.monotonic()
+    outcome = {}
+    runner = threading.Thread(target=lambda: outcome.setdefault(
+        'rc', Z.run_plan(plan, on_line, cwd=cwd, on_spawn=on_spawn, stop_event=stop, on_result=on_result,
+                           timeout=args.zybot_timeout, idle_timeout=args.idle_timeout)))
+    runner.start()
+    runner.join(args.timeout)
+    timed_out = runner.is_alive()
+    if timed_out:
+        stop.set()
+        for proc in list(procs):
+            Z.kill_process_tree(proc)
+        runner.join()
+    wall = time.monotonic() - start
+
+    busy = {}
+    for r in results:
+        busy[r.dut] = busy.get(r.dut, 0.0) + r.duration
+    durations = [r.duration for r in results]
+    lane_wall = wall - (planned - start)
+    return {
+        "mode": "execute",
+        "rc": outcome.get('rc'),
+        "timed_out": timed_out,
+        "tests_reported": len(results),
+        "failed": sum(1 for r in results if r.status == 'FAIL'),
+        "zybot_runs": len(spawns),
+        "output_lines": lines[0],
+        "wall_s": wall,
+        "plan_s": planned - start,
+        "first_spawn_s": (spawns[0] - start) if spawns else None,
+        "throughput_tests_per_s": len(results) / wall if wall else 0.0,
+        "latency_p50_s": percentile(durations, 50),
+        "latency_p95_s": percentile(durations, 95),
+        "latency_p99_s": percentile(durations, 99),
+        "latency_max_s": max(durations, default=0.0),
+        # Time a DUT lane spent outside reported tests (spawn, startup, idle while others finish)
+        "overhead_max_lane_s": lane_wall - max(busy.values(), default=0.0),
+        "utilization": sum(busy.values()) / (lane_wall * args.duts) if lane_wall else 0.0,
+    }
+
+def run_cli(args, cwd):
+    """Drive ZyButler.cli end to end (argument parsing, planning, history, execution)."""
+    argv = [a for v in dut_vars(args.duts) for a in ("--var", v)]
+    argv += ["--sttl-file", args.sttl_file, "--path", "TS/ANDROID/", "--exec-dir", cwd,
+             "--execute", "--parallel", "--schedule", args.schedule, "--steal-batch", str(args.steal_batch)]
+    for flag, value in (("--timeout", args.zybot_timeout), ("--idle-timeout", args.idle_timeout)):
+        if value is not None:
+            argv += [flag, str(value)]
+    start = time.monotonic()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        rc = Z.cli(argv)
+    wall = time.monotonic() - start
+    return {"mode": "cli", "rc": rc, "wall_s": wall, "throughput_tests_per_s": args.tests / wall if wall else 0.0}
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Load test ZyButler against the fake zybot/adb")
+    p.add_argument("--duts", type=int, default=32, help="Simulated DUTs (default 32)")
+    p.add_argument("--tests", type=int, default=1000, help="Simulated STTL tests (default 1000)")
+    p.add_argument("--duration", default="0.01:0.05", help="Seconds per test, fixed or MIN:MAX (default 0.01:0.05)")
+    p.add_argument("--fail-rate", type=float, default=0.0, help="Probability a test fails")
+    p.add_argument("--hang-rate", type=float, default=0.0, help="Probability a test hangs (use with --timeout)")
+    p.add_argument("--output-lines", type=int, default=0, help="Extra log lines per test")
+    p.add_argument("--hotplug", type=float, default=0.0, metavar="SECONDS", help="Simulate a device hot-plug event every SECONDS")
+    p.add_argument("--schedule", choices=Z.SCHEDULES, default="lpt")
+    p.add_argument("--steal-batch", type=int, default=1)
+    p.add_argument("--mode", choices=("execute", "cli"), default="execute", help="In-process run_plan (default) or full cli()")
+    p.add_argument("--timeout", type=float, default=600.0, help="Stop the run after this many seconds (execute mode)")
+    p.add_argument("--zybot-timeout", type=float, metavar="SECONDS", help="ZyButler --timeout: kill and re-queue zybot runs longer than SECONDS")
+    p.add_argument("--idle-timeout", type=float, metavar="SECONDS", help="ZyButler --idle-timeout: kill and re-queue zybot runs silent for SECONDS")
+    p.add_argument("--seed", type=int, help="Deterministic fake outcomes")
+    p.add_argument("--json", metavar="PATH", help="Also write the report as JSON")
+    p.add_argument("--verbose", "-V", action="store_true", help="Show ZyButler's own log output")
+    args = p.parse_args(argv)
+    # Per-shard logs drown the report with hundreds of DUTs; show them only on request
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL, format='[%(levelname)s] %(message)s')
+
+    configure_fakes(args)
+    tmp = tempfile.mkdtemp(prefix="zybutler_load_")
+    Z.ADB_EXECUTABLE = fake_adb(tmp)  # DUT health checks after a hang
+    events = []
+    tracker = watch_hotplug(tmp, events) if args.hotplug > 0 else None
+    try:
+        if args.mode == "cli":
+            args.sttl_file = os.path.join(tmp, "sttl.txt")
+            with open(args.sttl_file, 'w') as f:
+                f.write("\n".join(sttl_ids(args.tests)))
+            report = run_cli(args, tmp)
+        else:
+            command = Z.build_command(dut_vars(args.duts), sttl_ids(args.tests), "TS/ANDROID/")
+            report = run_execute(args, command, tmp)
+    finally:
+        if tracker:
+            tracker.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+        shutil.rmtree(LEASE_DIR, ignore_errors=True)
+    report.update(duts=args.duts, tests=args.tests, schedule=args.schedule, duration=args.duration)
+    if tracker:
+        report["hotplug_events"] = len(events)
+
+    for key, value in report.items():
+        print(f"{key:26} {value:.3f}" if isinstance(value, float) else f"{key:26} {value}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 1 if report.get("timed_out") else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
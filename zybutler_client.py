@@ -0,0 +1,192 @@
+"""
+Command-line client for the ZyButler daemon (python ZyButler.py --daemon).
+Submits jobs and queries them over the daemon's localhost JSON API, so a run starts without
+re-opening the history or re-discovering devices. Uses only the standard library.
+
+Usage:
+    python zybutler_client.py submit --var DUT1:SERIAL --sttl-file sttl.txt --path TS/ANDROID/ --follow
+    python zybutler_client.py status [JOB_ID]
+    python zybutler_client.py output JOB_ID [--follow]
+    python zybutler_client.py wait JOB_ID        # exit code is the job's return code
+    python zybutler_client.py stop JOB_ID
+    python zybutler_client.py devices
+    python zybutler_client.py shutdown
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+
+DAEMON_STATE = os.path.join(os.environ.get("ZYBUTLER_HOME") or os.path.expanduser("~/.zybutler"), "daemon.json")
+POLL_INTERVAL = 0.5  # seconds between output / status polls
+UNREACHABLE_RC = 255  # daemon unreachable or job without an exit code; above zybot's failed-test counts
+
+class DaemonError(Exception):
+    pass
+
+class Client:
+    def __init__(self, url=None, token=None):
+        if not (url and token):
+            try:
+                with open(DAEMON_STATE, encoding="utf-8") as f:
+                    state = json.load(f)
+            except (OSError, ValueError) as e:
+                raise DaemonError(f"no running daemon found ({DAEMON_STATE}: {e}); start one with ZyButler.py --daemon")
+            url, token = url or state["url"], token or state["token"]
+        self.url = url.rstrip("/")
+        self.token = token
+
+    def request(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.url + path, data=data, method=method,
+                                     headers={"X-ZyButler-Token": self.token, "Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=30) as resp:
+                return json.loads(resp.read() or b"null")
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get("error")
+            except ValueError:
+                message = None
+            raise DaemonError(message or f"HTTP {e.code}")
+        except OSError as e:
+            raise DaemonError(f"cannot reach daemon at {self.url}: {e}")
+
+    def follow(self, job_id):
+        """Print the job's output until it finishes; return its return code."""
+        since = 0
+        while True:
+            chunk = self.request("GET", f"/jobs/{job_id}/output?since={since}")
+            if chunk["skipped"]:
+                print(f"... {chunk['skipped']} line(s) dropped ...")
+            for line in chunk["lines"]:
+                print(line)
+            since = chunk["next"]
+            if chunk["status"] not in ("queued", "running"):
+                return job_rc(chunk)
+            time.sleep(POLL_INTERVAL)
+
+    def wait(self, job_id):
+        while True:
+            job = self.request("GET", f"/jobs/{job_id}")
+            if job["status"] not in ("queued", "running"):
+                return job_rc(job)
+            time.sleep(POLL_INTERVAL)
+
+def job_rc(job):
+    rc = job.get("returncode")
+    return 130 if job["status"] in ("stopped", "cancelled") else rc if rc is not None else UNREACHABLE_RC
+
+def job_line(job):
+    text = f"{job['id']:>4}  {job['status']:<9} {job['name']:<16} {job['tests']:>5} test(s)  {' '.join(job['duts'])}"
+    if job.get("progress") and job["status"] == "running":
+        text += f"\n      {job['progress']['summary']}"
+    elif job["returncode"] is not None:
+        text += f"  code {job['returncode']}"
+    return text
+
+def submission(args):
+    """The job entry POSTed to /jobs; local files are made absolute since the daemon may run elsewhere."""
+    entry = {"vars": args.var, "parallel": args.parallel, "schedule": args.schedule, "flags": args.flag,
+             "exec_dir": os.path.abspath(args.exec_dir) if args.exec_dir else None}
+    if args.sttl_file:
+        entry["sttl_file"] = [os.path.abspath(p) for p in args.sttl_file]
+    else:
+        entry["sttl"] = args.sttl_block
+    for key in ("path", "name"):
+        if getattr(args, key):
+            entry[key] = getattr(args, key)
+    if args.stage:
+        entry["stage"] = os.path.abspath(args.stage)
+    return entry
+
+def build_arg_parser():
+    p = argparse.ArgumentParser(description="Submit and query jobs of a running ZyButler daemon")
+    p.add_argument("--url", help="Daemon URL (default: from daemon.json)")
+    p.add_argument("--token", help="Access token (default: from daemon.json)")
+    sub = p.add_subparsers(dest="action", required=True)
+
+    s = sub.add_parser("submit", help="Queue a zybot job")
+    s.add_argument("--var", action="append", required=True, help="DUT variable like DUT1:SERIAL (repeatable)")
+    sttl = s.add_mutually_exclusive_group(required=True)
+    sttl.add_argument("--sttl-block", help="STTL block like id:(STTL/STTL-1 STTL/STTL-2)")
+    sttl.add_argument("--sttl-file", action="append", help="Polarion export containing STTL IDs (repeatable)")
+    s.add_argument("--path", help="Test suite path relative to the execution directory")
+    s.add_argument("--flag", action="append", default=[], help="Extra zybot flag (repeatable)")
+    s.add_argument("--parallel", action="store_true", help="Shard the STTL IDs across DUTs")
+    s.add_argument("--schedule", default="lpt", help="Parallel schedule (lpt, round-robin, steal)")
+    s.add_argument("--stage", help="Artifact stage file to install/push first")
+    s.add_argument("--exec-dir", help="Execution directory (default: the daemon's)")
+    s.add_argument("--name", help="Job name shown in status")
+    s.add_argument("--wait", action="store_true", help="Wait for the job; exit with its return code")
+    s.add_argument("--follow", "-f", action="store_true", help="Stream the job's output; exit with its return code")
+
+    st = sub.add_parser("status", help="Daemon status and jobs, or one job")
+    st.add_argument("job", nargs="?", type=int)
+    st.add_argument("--json", action="store_true", help="Print raw JSON")
+    o = sub.add_parser("output", help="Print a job's output")
+    o.add_argument("job", type=int)
+    o.add_argument("--follow", "-f", action="store_true", help="Keep printing until the job finishes")
+    w = sub.add_parser("wait", help="Wait for a job; exit with its return code")
+    w.add_argument("job", type=int)
+    k = sub.add_parser("stop", help="Cancel a queued job or stop a running one")
+    k.add_argument("job", type=int)
+    sub.add_parser("devices", help="Devices the daemon sees")
+    sub.add_parser("shutdown", help="Stop all jobs and the daemon")
+    return p
+
+def run(args):
+    client = Client(args.url, args.token)
+    if args.action == "submit":
+        job = client.request("POST", "/jobs", submission(args))
+        print(f"Job {job['id']} {job['status']}: {job['command']}")
+        if args.follow:
+            return client.follow(job["id"])
+        return client.wait(job["id"]) if args.wait else 0
+    if args.action == "status":
+        if args.job is not None:
+            job = client.request("GET", f"/jobs/{args.job}")
+            print(json.dumps(job, indent=2) if args.json else job_line(job))
+            return 0
+        status, jobs = client.request("GET", "/status"), client.request("GET", "/jobs")
+        if args.json:
+            print(json.dumps({"daemon": status, "jobs": jobs}, indent=2))
+            return 0
+        print(f"Daemon pid {status['pid']}, up {status['uptime']:.0f}s, {status['workers']} worker(s), exec dir {status['exec_dir']}")
+        for job in jobs:
+            print(job_line(job))
+        return 0
+    if args.action == "output":
+        if args.follow:
+            return client.follow(args.job)
+        chunk = client.request("GET", f"/jobs/{args.job}/output")
+        print("\n".join(chunk["lines"]))
+        return 0
+    if args.action == "wait":
+        return client.wait(args.job)
+    if args.action == "stop":
+        print(job_line(client.request("POST", f"/jobs/{args.job}/stop")))
+        return 0
+    if args.action == "devices":
+        for serial, state in sorted(client.request("GET", "/devices").items()):
+            print(f"{serial}\t{state}")
+        return 0
+    client.request("POST", "/shutdown")
+    print("Daemon stopping")
+    return 0
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    try:
+        return run(args)
+    except DaemonError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return UNREACHABLE_RC
+    except KeyboardInterrupt:
+        return 130
+
+if __name__ == "__main__":
+    sys.exit(main())
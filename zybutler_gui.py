@@ -2,11 +2,154 @@
 Modern GUI for ZyButler. Imports logic from ZyButler.py.
 """
 import tkinter as tk
-from tkinter import ttk, messagebox
-import subprocess
+from tkinter import ttk, messagebox, scrolledtext, filedialog
+import threading
+import queue
 import ZyButler
 import os
 
+class VirtualList(ttk.Frame):
+    """
+    List of strings shown through a fixed number of ttk.Treeview rows.
+    Only the visible window is rendered, so filtering, scrolling and removal
+    cost the same at 10 items or 10k. Items are kept unique and in order.
+    """
+    def __init__(self, master, rows=8, on_change=None):
+        super().__init__(master)
+        self.items = []
+        self.selected = set()
+        self.view = []
+        self.offset = 0
+        self.rows = rows
+        self.on_change = on_change
+        self.anchor = None
+        self.filter_var = tk.StringVar()
+        self.filter_var.trace_add('write', lambda *_: self.apply_filter())
+        self.columnconfigure(0, weight=1)
+
+        top = ttk.Frame(self)
+        top.grid(row=0, column=0, columnspan=2, sticky='ew', pady=(0,4))
+        ttk.Label(top, text="Filter:").pack(side='left')
+        ttk.Entry(top, textvariable=self.filter_var, width=24).pack(side='left', padx=4)
+        ttk.Button(top, text="Remove Selected", command=self.remove_selected).pack(side='left', padx=4)
+        ttk.Button(top, text="Clear", command=self.clear).pack(side='left', padx=4)
+        self.count_label = ttk.Label(top, text="")
+        self.count_label.pack(side='left', padx=8)
+
+        self.tree = ttk.Treeview(self, show='tree', height=rows, selectmode='none')
+        self.tree.tag_configure('selected', background='#007bff', foreground='#fff')
+        self.tree.grid(row=1, column=0, sticky='ew')
+        self.scroll = ttk.Scrollbar(self, orient='vertical', command=self.on_scrollbar)
+        self.scroll.grid(row=1, column=1, sticky='ns')
+        for i in range(rows):
+            self.tree.insert('', 'end', iid=str(i), text='')
+
+        self.tree.bind('<Button-1>', lambda e: self.on_click(e, 'set'))
+        self.tree.bind('<Control-Button-1>', lambda e: self.on_click(e, 'toggle'))
+        self.tree.bind('<Shift-Button-1>', lambda e: self.on_click(e, 'range'))
+        self.tree.bind('<Delete>', lambda e: self.remove_selected())
+        self.tree.bind('<Control-a>', self.select_all)
+        # Widget bindings return "break" so the page-level bind_all scroll doesn't also fire
+        self.tree.bind('<MouseWheel>', lambda e: self.scroll_by(int(-1*(e.delta/120))))
+        self.tree.bind('<Button-4>', lambda e: self.scroll_by(-1))
+        self.tree.bind('<Button-5>', lambda e: self.scroll_by(1))
+        self.render()
+
+    def set_items(self, items):
+        self.items = list(dict.fromkeys(items))
+        self.selected.clear()
+        self.anchor = None
+        self.changed()
+
+    def add(self, item):
+        if item in self.items:
+            return False
+        self.items.append(item)
+        self.changed()
+        return True
+
+    def remove_selected(self):
+        if self.selected:
+            self.items = [i for i in self.items if i not in self.selected]
+            self.selected.clear()
+            self.anchor = None
+            self.changed()
+        return "break"
+
+    def clear(self):
+        self.set_items([])
+
+    def changed(self):
+        self.apply_filter()
+        if self.on_change:
+            self.on_change()
+
+    def apply_filter(self):
+        needle = self.filter_var.get().strip().lower()
+        self.view = [i for i in self.items if needle in i.lower()] if needle else self.items
+        self.anchor = None
+        self.offset = max(0, min(self.offset, len(self.view) - self.rows))
+        self.render()
+
+    def render(self):
+        for r in range(self.rows):
+            idx = self.offset + r
+            if idx < len(self.view):
+                item = self.view[idx]
+                self.tree.item(str(r), text=item, tags=('selected',) if item in self.selected else ())
+            else:
+                self.tree.item(str(r), text='', tags=())
+        total = len(self.view)
+        if total > self.rows:
+            self.scroll.set(self.offset / total, (self.offset + self.rows) / total)
+        else:
+            self.scroll.set(0, 1)
+        shown = f"{total} of {len(self.items)}" if total != len(self.items) else str(total)
+        picked = f", {len(self.selected)} selected" if self.selected else ""
+        self.count_label.configure(text=f"{shown} item(s){picked}")
+
+    def scroll_to(self, offset):
+        offset = max(0, min(offset, len(self.view) - self.rows))
+        if offset != self.offset:
+            self.offset = offset
+            self.render()
+
+    def scroll_by(self, rows):
+        self.scroll_to(self.offset + rows)
+        return "break"
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == 'moveto':
+            self.scroll_to(round(float(amount) * len(self.view)))
+        elif unit == 'pages':
+            self.scroll_by(int(amount) * self.rows)
+        else:
+            self.scroll_by(int(amount))
+
+    def on_click(self, event, mode):
+        self.tree.focus_set()
+        row = self.tree.identify_row(event.y)
+        if not row or self.offset + int(row) >= len(self.view):
+            return "break"
+        idx = self.offset + int(row)
+        item = self.view[idx]
+        if mode == 'range' and self.anchor is not None:
+            lo, hi = sorted((self.anchor, idx))
+            self.selected.update(self.view[lo:hi + 1])
+        elif mode == 'toggle':
+            self.selected.symmetric_difference_update((item,))
+            self.anchor = idx
+        else:
+            self.selected = {item}
+            self.anchor = idx
+        self.render()
+        return "break"
+
+    def select_all(self, event=None):
+        self.selected.update(self.view)
+        self.render()
+        return "break"
+
 class ZyButlerGUI:
     def __init__(self, root):
         self.root = root
@@ -63,29 +206,47 @@ class ZyButlerGUI:
 
         ttk.Label(self.main_frame, text="ZyButler Android Test Runner", style='Header.TLabel').grid(row=0, column=0, columnspan=2, pady=(0, 24), sticky='ew', padx=(0,0))
 
+        # Device discovery runs on a background adb track-devices stream; events are applied in poll_devices()
+        self.device_tracker = ZyButler.get_device_tracker()
+        self.device_events = queue.Queue()
+        self.device_tracker.add_listener(self.on_device_event)
         self.device_list = self.get_connected_devices()
-        self.dut_vars = []
         self.flags = []
-        self.custom_flags = []
         self.sttl_block = tk.StringVar()
         self.test_path = tk.StringVar(value="TS/ANDROID/")
         self.color_enabled = tk.BooleanVar(value=True)
+        self.parallel_enabled = tk.BooleanVar(value=False)
+        self.use_index = tk.BooleanVar(value=False)
+        self.schedule_var = tk.StringVar(value="lpt")
         self.output_text = None
+        self.job = None
 
         self.build_gui()
 
     def get_connected_devices(self):
+        return self.device_tracker.devices()
+
+    def on_device_event(self, event, serial, state):
+        # Called on the tracker thread; Tk widgets are only touched from poll_devices()
+        self.device_events.put((event, serial, state))
+
+    def poll_devices(self):
+        changed = False
         try:
-            result = subprocess.run(["adb", "devices"], capture_output=True, text=True)
-            lines = result.stdout.splitlines()
-            devices = []
-            for line in lines[1:]:
-                if line.strip() and "device" in line:
-                    serial = line.split()[0]
-                    devices.append(serial)
-            return devices
-        except Exception:
-            return []
+            while True:
+                event, serial, state = self.device_events.get_nowait()
+                online = event != 'removed' and state == 'device'
+                if online and serial not in self.device_list:
+                    self.device_list.append(serial)
+                    changed = True
+                elif not online and serial in self.device_list:
+                    self.device_list.remove(serial)
+                    changed = True
+        except queue.Empty:
+            pass
+        if changed:
+            self.device_combobox['values'] = self.device_list
+        self.root.after(ZyButler.GUI_POLL_MS * 5, self.poll_devices)
 
     def build_gui(self):
         row_idx = 1
@@ -103,10 +264,9 @@ class ZyButlerGUI:
         self.device_combobox.set("")
         # Device add button
         ttk.Button(device_row, width=3, command=self.add_device, text="+").grid(row=0, column=1, padx=4)
-        self.device_list_frame = ttk.Frame(dut_frame)
-        self.device_list_frame.grid(row=2, column=0, sticky='ew', padx=8, pady=4)
-        self.device_list_frame.columnconfigure(0, weight=1)
-        self.refresh_device_list()
+        self.dut_list = VirtualList(dut_frame, rows=4, on_change=self.update_command)
+        self.dut_list.grid(row=2, column=0, sticky='ew', padx=8, pady=4)
+        self.poll_devices()
         row_idx += 1
 
         # Test Case Section
@@ -117,12 +277,13 @@ class ZyButlerGUI:
         ttk.Label(sttl_frame, text="Paste or type test case block (any format, IDs will be extracted):").grid(row=0, column=0, sticky='w', padx=8, pady=(8,2))
         sttl_entry = ttk.Entry(sttl_frame, textvariable=self.sttl_block, width=60)
         sttl_entry.grid(row=1, column=0, sticky='ew', padx=8, pady=4)
-        ttk.Button(sttl_frame, text="Parse", width=8, command=self.parse_sttl_input).grid(row=2, column=0, sticky='w', padx=8, pady=2)
-        self.test_list_frame = ttk.Frame(sttl_frame)
-        self.test_list_frame.grid(row=3, column=0, sticky='ew', padx=8, pady=4)
-        self.test_list_frame.columnconfigure(0, weight=1)
-        self.test_ids = []
-        self.refresh_test_list()
+        sttl_btns = ttk.Frame(sttl_frame)
+        sttl_btns.grid(row=2, column=0, sticky='w', padx=8, pady=2)
+        ttk.Button(sttl_btns, text="Parse", width=8, command=self.parse_sttl_input).pack(side='left')
+        ttk.Button(sttl_btns, text="Load Files...", command=self.load_sttl_files).pack(side='left', padx=8)
+        ttk.Button(sttl_btns, text="Rerun Failed...", command=self.load_failed_tests).pack(side='left', padx=8)
+        self.test_list = VirtualList(sttl_frame, rows=10, on_change=self.update_command)
+        self.test_list.grid(row=3, column=0, sticky='ew', padx=8, pady=4)
         row_idx += 1
 
         # Path Section
@@ -133,6 +294,7 @@ class ZyButlerGUI:
         ttk.Label(path_frame, text="Test case path:").grid(row=0, column=0, sticky='w', padx=8, pady=(8,2))
         path_entry = ttk.Entry(path_frame, textvariable=self.test_path, width=60)
         path_entry.grid(row=1, column=0, sticky='ew', padx=8, pady=4)
+        ttk.Checkbutton(path_frame, text="Pass only suite files containing the test IDs (STTL index)", variable=self.use_index).grid(row=2, column=0, sticky='w', padx=8, pady=(0,8))
         row_idx += 1
 
         # Flags Section
@@ -159,10 +321,8 @@ class ZyButlerGUI:
         custom_flag_entry.grid(row=0, column=0, sticky='ew', padx=8, pady=4)
         # Custom flag add button
         ttk.Button(custom_flag_row, width=3, command=self.add_custom_flag, text="+").grid(row=0, column=1, padx=4)
-        self.custom_flag_list_frame = ttk.Frame(flag_frame)
-        self.custom_flag_list_frame.grid(row=4, column=0, sticky='ew', padx=8, pady=4)
-        self.custom_flag_list_frame.columnconfigure(0, weight=1)
-        self.refresh_custom_flag_list()
+        self.custom_flag_list = VirtualList(flag_frame, rows=4, on_change=self.update_command)
+        self.custom_flag_list.grid(row=4, column=0, sticky='ew', padx=8, pady=4)
         row_idx += 1
 
         # Output Section
@@ -177,74 +337,108 @@ class ZyButlerGUI:
         btns_row.grid(row=0, column=1, sticky='e', padx=8)
         # Copy and run buttons
         ttk.Button(btns_row, command=self.copy_command, text="Copy").pack(side='left', padx=8)
-        ttk.Button(btns_row, command=self.run_zybot, text="Run zybot").pack(side='left', padx=8)
+        self.run_button = ttk.Button(btns_row, command=self.run_zybot, text="Run zybot")
+        self.run_button.pack(side='left', padx=8)
+        self.stop_button = ttk.Button(btns_row, command=self.stop_zybot, text="Stop", state='disabled')
+        self.stop_button.pack(side='left', padx=8)
+        parallel_row = ttk.Frame(output_frame)
+        parallel_row.grid(row=1, column=0, sticky='w', padx=8, pady=(0,8))
+        ttk.Checkbutton(parallel_row, text="Run in parallel (one shard per device)", variable=self.parallel_enabled).pack(side='left')
+        ttk.Label(parallel_row, text="Schedule:").pack(side='left', padx=(16,4))
+        ttk.Combobox(parallel_row, textvariable=self.schedule_var, values=ZyButler.SCHEDULES, state='readonly', width=12).pack(side='left')
+        row_idx += 1
+
+        # zybot Output Section
+        log_frame = ttk.LabelFrame(self.main_frame, text="zybot Output", style='Section.TLabelframe')
+        self.style_section(log_frame)
+        log_frame.grid(row=row_idx, column=0, columnspan=2, sticky='ew', padx=(10,20), pady=10)
+        log_frame.columnconfigure(0, weight=1)
+        self.output_text = scrolledtext.ScrolledText(log_frame, height=16, font=('Consolas', 10), state='disabled')
+        self.output_text.grid(row=0, column=0, sticky='ew', padx=8, pady=8)
+        self.progress_bar = ttk.Progressbar(log_frame, mode='determinate', maximum=1.0)
+        self.progress_bar.grid(row=1, column=0, sticky='ew', padx=8)
+        self.progress_var = tk.StringVar()
+        ttk.Label(log_frame, textvariable=self.progress_var, font=('Consolas', 10)).grid(row=2, column=0, sticky='w', padx=8, pady=(0,8))
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def icon_or_text(self, icon, text):
         return {'text': text}
 
+    @ZyButler.traced("gui.add_device")
     def add_device(self):
         serial = self.device_combobox.get().strip()
-        if serial and serial not in self.dut_vars:
-            self.dut_vars.append(serial)
-            self.refresh_device_list()
+        if serial and self.dut_list.add(serial):
             self.device_combobox.set("")
 
-    def refresh_device_list(self):
-        for widget in self.device_list_frame.winfo_children():
-            widget.destroy()
-        for idx, serial in enumerate(self.dut_vars):
-            row = ttk.Frame(self.device_list_frame)
-            ttk.Label(row, text=serial).pack(side='left', padx=4)
-            ttk.Button(row, width=3, command=lambda i=idx: self.remove_device(i), text="-").pack(side='left', padx=4)
-            row.pack(anchor='w', pady=2)
-
-    def remove_device(self, idx):
-        self.dut_vars.pop(idx)
-        self.refresh_device_list()
-        self.update_command()
-
+    @ZyButler.traced("gui.parse_sttl_input")
     def parse_sttl_input(self):
         raw = self.sttl_block.get().strip()
-        ids = ZyButler.parse_sttl_ids_any(raw)
-        self.test_ids = ids
-        self.refresh_test_list()
-        self.update_command()
-
-    def refresh_test_list(self):
-        for widget in self.test_list_frame.winfo_children():
-            widget.destroy()
-        for idx, tid in enumerate(self.test_ids):
-            row = ttk.Frame(self.test_list_frame)
-            ttk.Label(row, text=tid).pack(side='left', padx=4)
-            ttk.Button(row, width=3, command=lambda i=idx: self.remove_test_id(i), text="-").pack(side='left', padx=4)
-            row.pack(anchor='w', pady=2)
-
-    def remove_test_id(self, idx):
-        self.test_ids.pop(idx)
-        self.refresh_test_list()
-        self.update_command()
+        self.test_list.set_items(ZyButler.parse_sttl_ids_any(raw))
+
+    def load_sttl_files(self):
+        paths = filedialog.askopenfilenames(title="Select STTL exports (Polarion CSV/XML or text)",
+                                            filetypes=[("Exports", "*.csv *.xml *.txt"), ("All files", "*.*")])
+        if not paths:
+            return
+        results = queue.Queue()
+        def worker():
+            try:
+                results.put(ZyButler.read_sttl_ids(paths))
+            except OSError as e:
+                results.put(e)
+        threading.Thread(target=worker, daemon=True).start()
+        self.root.after(ZyButler.GUI_POLL_MS, lambda: self.apply_sttl_files(paths, results))
 
+    @ZyButler.traced("gui.load_sttl_files")
+    def apply_sttl_files(self, paths, results):
+        try:
+            outcome = results.get_nowait()
+        except queue.Empty:
+            self.root.after(ZyButler.GUI_POLL_MS, lambda: self.apply_sttl_files(paths, results))
+            return
+        if isinstance(outcome, Exception):
+            messagebox.showerror("Load Files", f"Could not read STTL files:\n{outcome}")
+            return
+        if not outcome:
+            messagebox.showinfo("Load Files", "No STTL-<id> found in the selected files.")
+            return
+        self.test_list.set_items(outcome)
+
+    def load_failed_tests(self):
+        path = filedialog.askopenfilename(title="Select previous zybot output.xml",
+                                          filetypes=[("zybot output", "*.xml"), ("All files", "*.*")])
+        if not path:
+            return
+        results = queue.Queue()
+        def worker():
+            try:
+                results.put(ZyButler.failed_sttls(path))
+            except (OSError, ZyButler.ParseError) as e:
+                results.put(e)
+        threading.Thread(target=worker, daemon=True).start()
+        self.root.after(ZyButler.GUI_POLL_MS, lambda: self.apply_failed_tests(path, results))
+
+    @ZyButler.traced("gui.load_failed_tests")
+    def apply_failed_tests(self, path, results):
+        try:
+            outcome = results.get_nowait()
+        except queue.Empty:
+            self.root.after(ZyButler.GUI_POLL_MS, lambda: self.apply_failed_tests(path, results))
+            return
+        if isinstance(outcome, Exception):
+            messagebox.showerror("Rerun Failed", f"Could not read {path}:\n{outcome}")
+            return
+        if not outcome:
+            messagebox.showinfo("Rerun Failed", "No failed STTL tests in the selected results.")
+            return
+        self.test_list.set_items(outcome)
+        messagebox.showinfo("Rerun Failed", f"Loaded {len(outcome)} failed test(s). Press 'Run zybot' to re-run them.")
+
+    @ZyButler.traced("gui.add_custom_flag")
     def add_custom_flag(self):
         flag = self.custom_flag_var.get().strip()
-        if flag and flag not in self.custom_flags:
-            self.custom_flags.append(flag)
-            self.refresh_custom_flag_list()
+        if flag and self.custom_flag_list.add(flag):
             self.custom_flag_var.set("")
-            self.update_command()
-
-    def refresh_custom_flag_list(self):
-        for widget in self.custom_flag_list_frame.winfo_children():
-            widget.destroy()
-        for idx, flag in enumerate(self.custom_flags):
-            row = ttk.Frame(self.custom_flag_list_frame)
-            ttk.Label(row, text=flag).pack(side='left', padx=4)
-            ttk.Button(row, width=3, command=lambda i=idx: self.remove_custom_flag(i), text="-").pack(side='left', padx=4)
-            row.pack(anchor='w', pady=2)
-
-    def remove_custom_flag(self, idx):
-        self.custom_flags.pop(idx)
-        self.refresh_custom_flag_list()
-        self.update_command()
 
     def style_section(self, frame):
         # Style for section frames to match Bootstrap
@@ -252,19 +446,31 @@ class ZyButlerGUI:
         frame['borderwidth'] = 2
         frame['relief'] = 'groove'
 
-    def update_command(self):
-        dut_tokens = [f"DUT{idx+1}:{serial}" for idx, serial in enumerate(self.dut_vars)]
+    def build_command(self):
+        """ZybotCommand from the current inputs, or None (after showing the error) if they are invalid.
+        STTL index sources are resolved by the job's worker thread, never here on the Tk thread."""
+        dut_tokens = [f"DUT{idx+1}:{serial}" for idx, serial in enumerate(self.dut_list.items)]
         path = self.test_path.get().strip() or None
         flags = []
         for flag, var in self.flag_vars.items():
             if var.get():
                 flags.append(flag)
-        flags.extend(self.custom_flags)
-        if not self.test_ids:
+        flags.extend(self.custom_flag_list.items)
+        try:
+            return ZyButler.build_command(dut_tokens, self.test_list.items, path, allow_empty_vars=True, flags=flags)
+        except (ZyButler.ValidationError, ZyButler.ParseError) as e:
+            self.command_var.set("")
+            messagebox.showerror("Input Error", str(e))
+            return None
+
+    @ZyButler.traced("gui.update_command")
+    def update_command(self):
+        if not self.test_list.items:
             self.command_var.set("")
             return
-        cmd_obj = ZyButler.build_command(dut_tokens, self.test_ids, path, allow_empty_vars=True, flags=flags)
-        self.command_var.set(cmd_obj.display_command())
+        cmd_obj = self.build_command()
+        if cmd_obj:
+            self.command_var.set(cmd_obj.display_command())
 
     def copy_command(self):
         cmd = self.command_var.get()
@@ -274,22 +480,75 @@ class ZyButlerGUI:
             self.root.update()
             messagebox.showinfo("Copied", "Command copied to clipboard.")
 
+    @ZyButler.traced("gui.run_zybot")
     def run_zybot(self):
         cmd = self.command_var.get()
         if not cmd:
             messagebox.showerror("Error", "No command to run.")
             return
+        if self.job:
+            messagebox.showerror("Error", "zybot is already running.")
+            return
         # Build ZybotCommand object for execution
-        dut_tokens = [f"DUT{idx+1}:{serial}" for idx, serial in enumerate(self.dut_vars)]
-        path = self.test_path.get().strip() or None
-        flags = []
-        for flag, var in self.flag_vars.items():
-            if var.get():
-                flags.append(flag)
-        flags.extend(self.custom_flags)
-        cmd_obj = ZyButler.build_command(dut_tokens, self.test_ids, path, allow_empty_vars=True, flags=flags)
-        rc = ZyButler.execute(cmd_obj)
-        messagebox.showinfo("zybot finished", f"Execution finished with code {rc}")
+        cmd_obj = self.build_command()
+        if not cmd_obj:
+            return
+        self.clear_output()
+        self.progress_bar['value'] = 0
+        self.progress_var.set("")
+        self.append_output([f"Executing: {cmd}"])
+        self.job = ZyButler.ZybotJob(cmd_obj, parallel=self.parallel_enabled.get(), schedule=self.schedule_var.get(),
+                                     use_index=self.use_index.get()).start()
+        self.run_button.configure(state='disabled')
+        self.stop_button.configure(state='normal')
+        self.root.after(ZyButler.GUI_POLL_MS, self.poll_job)
+
+    @ZyButler.traced("gui.poll_job")
+    def poll_job(self):
+        running = self.job.running  # sample before draining so no trailing output is lost
+        lines, dropped = self.job.drain(ZyButler.GUI_OUTPUT_MAX_LINES)
+        if dropped:
+            lines.insert(0, f"... ({dropped} lines skipped)")
+        if lines:
+            self.append_output(lines)
+        progress = self.job.progress
+        if progress:
+            self.progress_bar['value'] = progress.fraction
+            self.progress_var.set(progress.summary(width=0))
+        if running:
+            self.root.after(ZyButler.GUI_POLL_MS, self.poll_job)
+            return
+        rc = self.job.returncode
+        status = "stopped" if self.job.stopped else f"finished with code {rc}"
+        self.append_output([f"Execution {status}"])
+        self.job = None
+        self.run_button.configure(state='normal')
+        self.stop_button.configure(state='disabled')
+
+    def stop_zybot(self):
+        if self.job:
+            self.job.stop()
+
+    def clear_output(self):
+        self.output_text.configure(state='normal')
+        self.output_text.delete('1.0', 'end')
+        self.output_text.configure(state='disabled')
+
+    def append_output(self, lines):
+        # Keep only the newest GUI_OUTPUT_MAX_LINES so multi-hour runs don't bloat the widget
+        self.output_text.configure(state='normal')
+        self.output_text.insert('end', '\n'.join(lines) + '\n')
+        excess = int(self.output_text.index('end-1c').split('.')[0]) - ZyButler.GUI_OUTPUT_MAX_LINES
+        if excess > 0:
+            self.output_text.delete('1.0', f'{excess + 1}.0')
+        self.output_text.configure(state='disabled')
+        self.output_text.see('end')
+
+    def on_close(self):
+        self.stop_zybot()
+        self.device_tracker.remove_listener(self.on_device_event)
+        self.root.destroy()
+        ZyButler.write_profile(ZyButler.PROFILE_PATH)  # ZYBUTLER_PROFILE=trace.json records GUI handler timings
 
 def main():
     root = tk.Tk()